@@ -1,231 +1,335 @@
-from dragonfly import (Grammar, AppContext, MappingRule, Dictation, IntegerRef,
-                       Key, Text)
-
-
-git_context = AppContext(title="git Bash")
-git_context2 = AppContext(title="MINGW32:")
-# set the window title to bash in putty for this context to work
-putty_context = AppContext(title="bash")
-grammar = Grammar("bash", context=(putty_context | git_context | git_context2))
-
-
-general_rule = MappingRule(
-	name = "general",
-	mapping = {
-		"cancel": Key("c-c"),
-		"kay": Key("enter"),
-		"left": Key("left"),
-		"right": Key("right"),
-
-		"say <text>": Text("%(text)s"),
-		},
-	extras = [
-		Dictation("text"),
-		],
-)
-
-
-
-file_extensions_rule = MappingRule(
-	name = "file extensions",
-	mapping = {
-		"dot text": Text(".txt"),
-		"dot pie": Text(".py"),
-		},
-	extras = [
-		],
-)
-
-
-bash_rule = MappingRule(
-	name = "bash",
-	mapping = {
-		"P. W. D.": Text("pwd\n"),
-
-		"CD dot dot": Text("cd ..\n"),
-		"CD double dot": Text("cd ..\n"),
-		"CD triple dot": Text("cd ../..\n"),
-		"CD ": Text("cd ") + Key("tab:3"),
-		"CD <text>": Text("cd %(text)s"),
-
-		"copy": Text("cp "),
-		"copy <text>": Text("cp %(text)s"),
-
-		"make directory ": Text("mkdir "),
-		"make directory <text>": Text("mkdir %(text)s\n"),
-
-		"move": Text("mv "),
-		"move <text>": Text("mv %(text)s"),
-		"remove": Text("rm "),
-		"remove <text>": Text("rm %(text)s"),
-
-		"secure copy": Text("scp"),
-		"secure copy <text>": Text("scp %(text)"),
-
-		"change mode": Text("chmod "),
-
-		"grep <text>": Text("grep %(text)s"),
-
-		"cat": Text("cat "),
-		"cat <text>": Text("cat %(text)s"),
-		"exit": Text("exit\n"),
-
-		"list": Text("ls\n"),
-		"list <text>": Text("ls %(text)s"),
-		"list minus L.": Text("ls -l\n"),
-		"list minus A.": Text("ls -a\n"),
-		"list minus one": Text("ls -1 "),
-
-		"pipe": Text(" | "),
-
-		"D. P. K. G. ": Text("dpkg "),
-		"D. P. K. G. minus L.": Text("dpkg -l "),
-		"D. P. K. G. minus I.": Text("dpkg -i "),
-
-		"manual page": Text("man "),
-
-		"word count": Text("wc "),
-		"word count minus L.": Text("wc -l "),
-
-		"repeat previous argument": Key("a-dot"),
-		"up": Key("up"),
-
-		# cursor movement
-		"back": Key("a-b"),
-		"[<n>] back": Key("a-b:%(n)d"),
-		"[<n>] whiskey": Key("a-f:%(n)d"),
-		"dollar": Key("c-e"),
-		"hat": Key("c-a"),
-
-		"scratch": Key("c-w"),
-		"[<n>] scratch": Key("c-w:%(n)d"),
-		"paste": Key("c-y"),
-
-		"make": Text("make\n"),
-		"make clean": Text("make clean\n"),
-
-		"evince": Text("evince "),
-		"evince <text>": Text("evince %(text)s"),
-
-                "Python": Text("python "),
-
-		"aptitude search": Text("aptitude search "),
-		"pseudo-aptitude install": Text("sudo aptitude install "),
-		"pseudo-aptitude update": Text("sudo aptitude update "),
-		"pseudo-aptitude remove": Text("sudo aptitude remove "),
-
-		"A. P. T. file search": Text("apt-file search "),
-
-		"vim": Text("vim "),
-		"vim <text>": Text("vim %(text)s"),
-
-
-		"W. get ": Text("wget "),
-		},
-	extras = [
-		Dictation("text"),
-		IntegerRef("n", 1, 20)
-		],
-	defaults = {
-		"n": 1
-	}
-)
-
-
-git_rule = MappingRule(
-	name = "git",
-	mapping = {
-		# commands for git version control
-		"git add": Text("git add "),
-		"git add <text>": Text("git add %(text)s"),
-		"git remove": Text("git rm "),
-		"git remove <text>": Text("git rm %(text)s"),
-		"git move": Text("git move "),
-		"git move <text>": Text("git mv %(text)s"),
-		"git status": Text("git status\n"),
-		"git patch": Text("git add -p\n"),
-
-		"git branch": Text("git branch "),
-
-		"git merge": Text("git merge "),
-		"git merge not fast forward": Text("git merge --no-ff "),
-
-		"git log": Text("git log\n"),
-		"git log [color] words": Text("git log -p --color-words\n"),
-		"git log minus (P.|patch)": Text("git log -p\n"),
-		"git log minus stat": Text("git log --stat\n"),
-
-		"git diff": Text("git diff\n"),
-		"git diff [color] words": Text("git diff --color-words\n"),
-		"git diff cache": Text("git diff --cached\n"),
-		"git diff [color] words cached": Text("git diff --color-words --cached\n"),
-
-
-		"git submodule init": Text("git submodule init "),
-		"git submodule update": Text("git submodule update "),
-
-		"git kay": Text("gitk\n"),
-		"git kay all": Text("gitk --all\n"),
-
-		"git commit message": Text("git commit -m ''") + Key("left"),
-		"git commit": Text("git commit "),
-		"git commit --amend": Text("git commit --amend\n"),
-
-		"git check out": Text("git checkout "),
-		"git check out <text>": Text("git checkout %(text)s"),
-		"git check out minus F.": Text("git checkout -f\n"),
-
-		"git stash": Text("git stash\n"),
-
-		"git pull": Text("git pull\n"),
-
-		"git push": Text("git push\n"),
-		"git push drop box": Text("git push dropbox\n"),
-		"git push origin": Text("git push origin\n"),
-		"git push tomato": Text("git push tomate\n"),
-		"git push all": Text("git push --all\n"),
-		"git push github": Text("git push github\n"),
-		"git help": Text("git help"),
-		"git help push": Text("git help push\n"),
-
-		"git remote add": Text("git remote add"),
-		"yes": Key("y,enter"),
-		"no": Key("n,enter"),
-		"quit": Key("q,enter"),
-		},
-	extras = [
-		Dictation("text"),
-		],
-)
-
-prefix_key = "c-a"
-
-screen_rule = MappingRule(
-	name = "screen",
-	mapping = {
-		"switch to (screen | window) <n>": Key(prefix_key) + Key("%(n)d"),
-		"switch to (window next | next window | screen next | next screen)":
-			Key(prefix_key) + Key("n"),
-		"switch to (window previous | previous window | screen previous | previous screen)":
-			Key(prefix_key) + Key("p"),
-		"create (screen | window)": Key(prefix_key) + Key("c"),
-		},
-	extras = [
-		IntegerRef("n", 0, 20)
-		]
-)
-
-
-grammar.add_rule(general_rule)
-grammar.add_rule(file_extensions_rule)
-grammar.add_rule(bash_rule)
-grammar.add_rule(screen_rule)
-grammar.add_rule(git_rule)
-grammar.load()
+from dragonfly import (AppContext, MappingRule, Dictation,
+                       Key, Text, CompoundRule, Alternative, Repetition, RuleRef,
+                       DictList, Function)
+
+from actioncache import validate
+import commandindex
+from contextindex import IndexedGrammar
+from executor import StopRule, submit
+from gitrefs import update_list
+from grammarcache import ModuleCache
+from grammarregistry import add_grammar, unload_grammars
+from helpindex import register
+from keybatch import compile_repeat
+from lazygrammar import LazyGrammar
+from pathindex import change_directory, update_list as update_path_list
+from spokenlist import PhraseListRef
+from spokennumbers import NumberRef, add_number_rules
+from textinsert import InsertText
+from tracing import traced
+from usagestats import record, repeat_max, save, sequence_max
+
+
+# Spoken forms and the compiled grammar are read from a cache instead of
+#  being parsed and compiled again, until this file changes.  See
+#  grammarcache.py.
+cache = ModuleCache("_bash", __file__)
+
+with cache:
+	git_context = AppContext(title="git Bash")
+	git_context2 = AppContext(title="MINGW32:")
+	# set the window title to bash in putty for this context to work
+	putty_context = AppContext(title="bash")
+	bash_context = (putty_context | git_context | git_context2)
+
+
+	general_rule = MappingRule(
+		name = "general",
+		exported = False,
+		mapping = {
+			"cancel": Key("c-c"),
+			"kay": Key("enter"),
+			"left": Key("left"),
+			"right": Key("right"),
+
+			"say <text>": InsertText("%(text)s"),
+			},
+		extras = [
+			Dictation("text"),
+			],
+	)
+
+
+
+	file_extensions_rule = MappingRule(
+		name = "file extensions",
+		exported = False,
+		mapping = {
+			"dot text": Text(".txt"),
+			"dot pie": Text(".py"),
+			},
+		extras = [
+			],
+	)
+
+
+	# Names near the shell's working directory, see pathindex.py.  "CD"
+	#  commands move the index along with the shell.
+	paths = DictList("paths")
+
+	# Executables and shell history lines, see commandindex.py.
+	commands = DictList("commands")
+
+	bash_rule = MappingRule(
+		name = "bash",
+		exported = False,
+		mapping = {
+			"P. W. D.": Text("pwd\n"),
+			# Typed but not run, see commandindex.py.
+			"run <command>": Text("%(command)s"),
+
+			"CD dot dot": Text("cd ..\n") + Function(change_directory, path=".."),
+			"CD double dot": Text("cd ..\n") + Function(change_directory, path=".."),
+			"CD triple dot": Text("cd ../..\n") + Function(change_directory, path="../.."),
+			"CD ": Text("cd ") + Key("tab:3"),
+			"CD <path>": Text("cd %(path)s") + Function(change_directory),
+
+			"copy": Text("cp "),
+			"copy <path>": Text("cp %(path)s"),
+
+			"make directory ": Text("mkdir "),
+			"make directory <text>": Text("mkdir %(text)s\n"),
+
+			"move": Text("mv "),
+			"move <text>": Text("mv %(text)s"),
+			"remove": Text("rm "),
+			"remove <text>": Text("rm %(text)s"),
+
+			"secure copy": Text("scp"),
+			"secure copy <text>": Text("scp %(text)"),
+
+			"change mode": Text("chmod "),
+
+			"grep <text>": Text("grep %(text)s"),
+
+			"cat": Text("cat "),
+			"cat <path>": Text("cat %(path)s"),
+			"exit": Text("exit\n"),
+
+			"list": Text("ls\n"),
+			"list <path>": Text("ls %(path)s"),
+			"list minus L.": Text("ls -l\n"),
+			"list minus A.": Text("ls -a\n"),
+			"list minus one": Text("ls -1 "),
+
+			"pipe": Text(" | "),
+
+			"D. P. K. G. ": Text("dpkg "),
+			"D. P. K. G. minus L.": Text("dpkg -l "),
+			"D. P. K. G. minus I.": Text("dpkg -i "),
+
+			"manual page": Text("man "),
+
+			"word count": Text("wc "),
+			"word count minus L.": Text("wc -l "),
+
+			"repeat previous argument": Key("a-dot"),
+			"up": Key("up"),
+
+			# cursor movement
+			"back": Key("a-b"),
+			"[<n>] back": Key("a-b:%(n)d"),
+			"[<n>] whiskey": Key("a-f:%(n)d"),
+			"dollar": Key("c-e"),
+			"hat": Key("c-a"),
+
+			"scratch": Key("c-w"),
+			"[<n>] scratch": Key("c-w:%(n)d"),
+			"paste": Key("c-y"),
+
+			"make": Text("make\n"),
+			"make clean": Text("make clean\n"),
+
+			"evince": Text("evince "),
+			"evince <text>": Text("evince %(text)s"),
+
+	                "Python": Text("python "),
+
+			"aptitude search": Text("aptitude search "),
+			"pseudo-aptitude install": Text("sudo aptitude install "),
+			"pseudo-aptitude update": Text("sudo aptitude update "),
+			"pseudo-aptitude remove": Text("sudo aptitude remove "),
+
+			"A. P. T. file search": Text("apt-file search "),
+
+			"vim": Text("vim "),
+			"vim <path>": Text("vim %(path)s"),
+
+
+			"W. get ": Text("wget "),
+			},
+		extras = [
+			Dictation("text"),
+			NumberRef("n", 1, 20),
+			PhraseListRef("path", paths),
+			PhraseListRef("command", commands),
+			],
+		defaults = {
+			"n": 1
+		}
+	)
+
+
+	# Branches of the current repository, see gitrefs.py.  The list is
+	#  brought up to date at the start of each utterance.
+	git_refs = DictList("git_refs")
+
+	git_rule = MappingRule(
+		name = "git",
+		exported = False,
+		mapping = {
+			# commands for git version control
+			"git add": Text("git add "),
+			"git add <text>": Text("git add %(text)s"),
+			"git remove": Text("git rm "),
+			"git remove <text>": Text("git rm %(text)s"),
+			"git move": Text("git move "),
+			"git move <text>": Text("git mv %(text)s"),
+			"git status": Text("git status\n"),
+			"git patch": Text("git add -p\n"),
+
+			"git branch": Text("git branch "),
+			"git branch delete <ref>": Text("git branch -d %(ref)s"),
+
+			"git merge": Text("git merge "),
+			"git merge <ref>": Text("git merge %(ref)s"),
+			"git merge not fast forward": Text("git merge --no-ff "),
+			"git merge not fast forward <ref>": Text("git merge --no-ff %(ref)s"),
+
+			"git log": Text("git log\n"),
+			"git log [color] words": Text("git log -p --color-words\n"),
+			"git log minus (P.|patch)": Text("git log -p\n"),
+			"git log minus stat": Text("git log --stat\n"),
+
+			"git diff": Text("git diff\n"),
+			"git diff [color] words": Text("git diff --color-words\n"),
+			"git diff cache": Text("git diff --cached\n"),
+			"git diff [color] words cached": Text("git diff --color-words --cached\n"),
+
+
+			"git submodule init": Text("git submodule init "),
+			"git submodule update": Text("git submodule update "),
+
+			"git kay": Text("gitk\n"),
+			"git kay all": Text("gitk --all\n"),
+
+			"git commit message": Text("git commit -m ''") + Key("left"),
+			"git commit": Text("git commit "),
+			"git commit --amend": Text("git commit --amend\n"),
+
+			"git check out": Text("git checkout "),
+			"git check out <ref>": Text("git checkout %(ref)s"),
+			"git check out minus F.": Text("git checkout -f\n"),
+
+			"git stash": Text("git stash\n"),
+
+			"git pull": Text("git pull\n"),
+
+			"git push": Text("git push\n"),
+			"git push drop box": Text("git push dropbox\n"),
+			"git push origin": Text("git push origin\n"),
+			"git push tomato": Text("git push tomate\n"),
+			"git push all": Text("git push --all\n"),
+			"git push github": Text("git push github\n"),
+			"git help": Text("git help"),
+			"git help push": Text("git help push\n"),
+
+			"git remote add": Text("git remote add"),
+			"yes": Key("y,enter"),
+			"no": Key("n,enter"),
+			"quit": Key("q,enter"),
+			},
+		extras = [
+			Dictation("text"),
+			PhraseListRef("ref", git_refs),
+			],
+	)
+
+	prefix_key = "c-a"
+
+	screen_rule = MappingRule(
+		name = "screen",
+		exported = False,
+		mapping = {
+			"switch to (screen | window) <n>": Key(prefix_key) + Key("%(n)d"),
+			"switch to (window next | next window | screen next | next screen)":
+				Key(prefix_key) + Key("n"),
+			"switch to (window previous | previous window | screen previous | previous screen)":
+				Key(prefix_key) + Key("p"),
+			"create (screen | window)": Key(prefix_key) + Key("c"),
+			},
+		extras = [
+			NumberRef("n", 0, 20)
+			]
+	)
+
+
+	# Check every action spec now instead of when it is first spoken.
+	validate(general_rule, file_extensions_rule, bash_rule, git_rule,
+		screen_rule)
+
+
+	# The rules above are not exported.  Instead, any sequence of their
+	#  commands can be said in one utterance, e.g. "git add dot pie kay",
+	#  optionally followed by a repeat count.  The whole sequence is sent as
+	#  one batch by the background executor, see keybatch.py and executor.py.
+	command = Alternative([
+		RuleRef(rule=general_rule),
+		RuleRef(rule=file_extensions_rule),
+		RuleRef(rule=bash_rule),
+		RuleRef(rule=screen_rule),
+		RuleRef(rule=git_rule),
+		])
+	sequence = Repetition(command, min=1, max=sequence_max("_bash", 8),
+		name="sequence")
+
+
+	class RepeatRule(CompoundRule):
+		spec = "<sequence> [[[and] repeat [that]] <n> times]"
+		extras = [
+			sequence,
+			NumberRef("n", 1, repeat_max("_bash", 20)),
+			]
+		defaults = {
+			"n": 1,
+		}
+
+		def _process_begin(self):
+			update_list(git_refs)
+			update_path_list(paths)
+			commandindex.update_list(commands)
+
+		def _process_recognition(self, node, extras):
+			record("_bash", node, len(extras["sequence"]), extras["n"])
+			submit(compile_repeat(extras["sequence"], extras["n"]))
+
+
+	# The grammar is only created and loaded the first time one of the
+	#  shell windows is in the foreground when an utterance starts.  Until
+	#  then only a stub grammar is loaded, see lazygrammar.py.
+	grammar = None
+
+	def build_grammar():
+		global grammar
+		with cache:
+			grammar = IndexedGrammar("bash", context=bash_context)
+			grammar.add_rule(traced(RepeatRule()))
+			grammar.add_rule(StopRule())
+			add_number_rules(grammar)
+			grammar.load()
+			add_grammar(grammar, __name__)
+			register(grammar, "_bash")
+		return [grammar]
+
+	lazy_grammar = LazyGrammar("bash", bash_context, build_grammar, __name__)
 
 # Unload function which will be called by natlink at unload time.
 def unload():
     global grammar
-    if grammar: grammar.unload()
+    lazy_grammar.unload()
+    if grammar:
+        commandindex.save()
+        save()
+    unload_grammars(__name__)
     grammar = None
 
@@ -1,6 +1,10 @@
 from dragonfly import (Grammar, AppContext, MappingRule, Dictation, IntegerRef,
                        Key, Text)
 
+from actioncache import validate
+from grammarregistry import add_grammar, unload_grammars
+from helpindex import ShowCommandsRule, register
+
 
 grammar = Grammar("dragon")
 
@@ -15,13 +19,19 @@ dragon_rule = MappingRule(
 )
 
 
+# Check every action spec now instead of when it is first spoken.
+validate(dragon_rule)
+
 
 grammar.add_rule(dragon_rule)
+grammar.add_rule(ShowCommandsRule())
 grammar.load()
+add_grammar(grammar, __name__)
+register(grammar, "_dragonall")
 
 # Unload function which will be called by natlink at unload time.
 def unload():
     global grammar
-    if grammar: grammar.unload()
+    unload_grammars(__name__)
     grammar = None
 
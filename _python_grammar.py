@@ -3,6 +3,11 @@
 
 from dragonfly import (Grammar, CompoundRule, Dictation, Text, Key, AppContext, MappingRule)
 
+from actioncache import validate
+from grammarregistry import add_grammar, unload_grammars
+from helpindex import register
+from textinsert import InsertText
+
 class PythonEnabler(CompoundRule):
     spec = "Enable Python"                  # Spoken command to enable the Python grammar.
     
@@ -30,7 +35,7 @@ class PythonTestRule(CompoundRule):
 class PythonCommentsSyntax(MappingRule):
 
     mapping  = {
-                "comment":                Text("# "),
+                "comment":                InsertText("# "),
                 
                
                }
@@ -39,21 +44,26 @@ class PythonCommentsSyntax(MappingRule):
 # handles Python control structures
 class PythonControlStructures(MappingRule):
     mapping  = {
-                    "if":                   Text("if condition:") + Key("enter"),
-                    "while loop":           Text("while condition:") + Key("enter"),
-                    "for loop":             Text("for something in something:") + Key("enter"),
+                    "if":                   InsertText("if condition:") + Key("enter"),
+                    "while loop":           InsertText("while condition:") + Key("enter"),
+                    "for loop":             InsertText("for something in something:") + Key("enter"),
                     
-                    "function":             Text("def functionName():") + Key("enter"),
-                    "class":                Text("class className(inheritance):") + Key("enter"),
+                    "function":             InsertText("def functionName():") + Key("enter"),
+                    "class":                InsertText("class className(inheritance):") + Key("enter"),
                     
                
                }    
 
 
+# Check every action spec now instead of when it is first spoken.
+validate(PythonCommentsSyntax.mapping, PythonControlStructures.mapping)
+
+
 # The main Python grammar rules are activated here
 pythonBootstrap = Grammar("python bootstrap")                
 pythonBootstrap.add_rule(PythonEnabler())
 pythonBootstrap.load()
+add_grammar(pythonBootstrap, __name__)
 
 pythonGrammar = Grammar("python grammar")
 pythonGrammar.add_rule(PythonTestRule())
@@ -61,11 +71,15 @@ pythonGrammar.add_rule(PythonCommentsSyntax())
 pythonGrammar.add_rule(PythonControlStructures())
 pythonGrammar.add_rule(PythonDisabler())
 pythonGrammar.load()
+add_grammar(pythonGrammar, __name__)
 pythonGrammar.disable()
 
+register(pythonBootstrap, "_python_grammar")
+register(pythonGrammar, "_python_grammar")
+
 
 # Unload function which will be called by natlink at unload time.
 def unload():
-    global pythonGrammar
-    if pythonGrammar: pythonGrammar.unload()
-    pythonGrammar = None
+    global pythonBootstrap, pythonGrammar
+    unload_grammars(__name__)
+    pythonBootstrap = pythonGrammar = None
@@ -0,0 +1,139 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Load-time validation and pre-warming of action specs
+============================================================================
+
+Entries like ``"[<n>] up": Key("k:%(n)d")`` are only substituted and
+parsed when they are executed.  A typo in such a spec therefore shows up
+as an error in the middle of a command, and every execution pays for
+parsing the spec again.
+
+*validate()* checks every Key spec of the given mappings or MappingRules,
+raising an ActionError naming the spoken-form if a spec is invalid.
+Static specs, those without "%(...)" references, were parsed when the
+Key was created and their result is checked; sample values are
+substituted into the others, which are then parsed once.  This is what
+the invalid 'semicolon' key name in gvim.py's LetterRule would have been
+caught by.  Every command-module validates all its mappings on import.
+
+*prewarm()* fills the parsed Key cache of keybatch.py with the specs of
+a mapping for a range of values of a number extra, so that the common
+"up 1" ... "up 20" commands are never parsed during a recognition.
+
+"""
+
+import re
+
+from dragonfly import ActionError, Key
+
+from keybatch import KEY, character_keys, key_action, merge_runs, unbind
+
+
+_reference_pattern = re.compile(r"%\((\w+)\)(\w)")
+
+
+def _sample_data(spec, overrides=None):
+    # Sample values for every "%(name)x" reference in *spec*.
+    data = {}
+    for name, conversion in _reference_pattern.findall(spec):
+        if conversion in "di":
+            data[name] = 1
+        else:
+            data[name] = "x"
+    data.update(overrides or {})
+    return data
+
+
+def _key_actions(action):
+    # Yield all Key actions contained in *action*.
+    action, data = unbind(action, None)
+    series = getattr(action, "_actions", None)
+    if series is not None:
+        for child in series:
+            for key in _key_actions(child):
+                yield key
+    elif isinstance(action, Key):
+        yield action
+
+
+def _check_events(events):
+    # Older dragonfly versions raise from the parser, newer ones return
+    #  an error message along with the events.
+    if isinstance(events, tuple) and len(events) == 2 and events[1]:
+        raise ActionError(events[1])
+
+
+def _check_spec(spec):
+    _check_events(Key(spec, static=True)._events)
+
+
+def _check_key(key):
+    if key._static:
+        _check_events(key._events)
+    else:
+        _check_spec(key._spec % _sample_data(key._spec))
+
+
+_characters_checked = False
+
+
+def validate(*mappings):
+    """
+        Check every Key spec in the given mappings or MappingRule
+        instances, raising on invalid ones.
+    """
+    global _characters_checked
+    if not _characters_checked:
+        validate_character_keys()
+        _characters_checked = True
+    for mapping in mappings:
+        mapping = getattr(mapping, "_mapping", mapping)
+        for spoken_form, action in mapping.items():
+            for key in _key_actions(action):
+                if not key._spec:
+                    continue
+                try:
+                    _check_key(key)
+                except Exception as e:
+                    raise ActionError("Invalid action for %r: %s"
+                                      % (spoken_form, e))
+
+
+def validate_character_keys():
+    """ Check the key names keybatch.py uses for typing text. """
+    for character, name in character_keys.items():
+        try:
+            _check_spec(name)
+        except Exception as e:
+            raise ActionError("Invalid key name for %r: %s" % (character, e))
+
+
+def prewarm(mapping, name="n", values=range(1, 21), passes=()):
+    """
+        Parse and cache the Key specs of *mapping* which refer to the
+        number extra *name*, for each of the given *values*.
+
+        *passes* are the keybatch.py passes the rule applies before
+        emission, so that the cached spec is the one actually sent.
+        They must not have side effects.
+    """
+    count = 0
+    for action in mapping.values():
+        for key in _key_actions(action):
+            spec = key._spec
+            if not spec or key._static or "%%(%s)" % name not in spec:
+                continue
+            for value in values:
+                items = [(KEY, spec % _sample_data(spec, {name: value}))]
+                for optimize in passes:
+                    items = optimize(items)
+                for kind, run in merge_runs(items):
+                    if kind == KEY:
+                        key_action(run)
+                        count += 1
+    return count
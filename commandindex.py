@@ -0,0 +1,298 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Index of shell commands as a dynamic list
+============================================================================
+
+_bash.py has spoken forms for a few dozen commands; anything else had to
+be dictated through "say <text>".  This module indexes the commands the
+user actually has and uses, so that _bash.py can offer them as a
+DictList for "run <command>".  A command is said as the words of its
+command line, see spokenlist.py, e.g. "run git log oneline" types "git
+log --oneline".  The command is only typed, not run; saying "kay" presses
+enter, also in the same utterance: "run git log oneline kay".  That way
+a misrecognition cannot run some other line of the history.
+
+The commands offered are:
+
+ - the command lines of the shell history, most frequent first, skipping
+   those with more than *max_words* words
+ - the executables found in the directories of *search_path*
+
+At most *max_entries* commands are offered.
+
+The history file is *history_path*, by default the HISTFILE environment
+variable or ~/.bash_history.  It is read incrementally: a refresh reads
+only the lines appended since the last one.  If the start of the file
+changed, e.g. because bash truncated it to HISTFILESIZE, the counts are
+rebuilt from the whole file.
+
+Directory listings and history counts are kept in a JSON cache file,
+*cache_path*, so that loading does not have to rescan the search path or
+the whole history.  A refresh stats the history file and the search
+path directories and only reads what changed, which is cheap enough to
+do at the start of every utterance.  The cache is written at most every
+*save_interval* seconds and by *save()*, which _bash.py calls when it is
+unloaded.
+
+Note that the engine cannot see the history or PATH of a remote shell,
+e.g. over PuTTY; set the environment variables accordingly.
+
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from spokenlist import spoken_form, update_list as _update_list
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+search_path   = os.environ.get("PATH", "")
+history_path  = (os.environ.get("HISTFILE")
+                 or os.path.expanduser("~/.bash_history"))
+cache_path    = (os.environ.get("DRAGONFLY_COMMAND_CACHE")
+                 or os.path.expanduser("~/.dragonfly_commands.json"))
+max_entries   = 3000
+max_words     = 6
+max_history   = 10000   # Distinct history lines counted.
+save_interval = 60
+
+stats = {
+    "refreshes": 0,     # Calls of CommandIndex.refresh().
+    "listings":  0,     # Search path directories (re-)listed.
+    "history":   0,     # Bytes of history read.
+    "rebuilds":  0,     # Times the history was counted from the start.
+    "saves":     0,     # Times the cache was written.
+}
+
+_cache_version = 1
+_head_bytes = 256
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _digest(data, length):
+    return (length, hashlib.md5(data[:length]).hexdigest())
+
+
+def _executables(directory):
+    # Names of the executable files in *directory*.
+    names = []
+    try:
+        listing = os.listdir(directory)
+    except OSError:
+        return names
+    if os.name == "nt":
+        extensions = os.environ.get("PATHEXT", ".COM;.EXE;.BAT;.CMD")
+        extensions = set(e.lower() for e in extensions.split(";") if e)
+        for name in listing:
+            base, extension = os.path.splitext(name)
+            if extension.lower() in extensions:
+                names.append(base)
+    else:
+        for name in listing:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                names.append(name)
+    return sorted(set(names))
+
+
+#---------------------------------------------------------------------------
+
+class CommandIndex(object):
+    """ Cached executables and history counts. """
+
+    def __init__(self, search_path=search_path, history_path=history_path,
+                 cache_path=cache_path):
+        self.search_path = search_path
+        self.history_path = history_path
+        self.cache_path = cache_path
+        self._listings = {}     # Directory -> (mtime, [names]).
+        self._counts = {}       # History line -> count.
+        self._offset = 0        # Bytes of the history counted.
+        self._mtime = None      # Modification time of the history.
+        self._head = _digest(b"", 0)    # (Length, digest) of the start
+                                        #  of the history counted.
+        self._entries = None    # Built entries, None after changes.
+        self._dirty = False     # Changes not yet saved.
+        self._saved = time.time()
+        self.load()
+
+    #-----------------------------------------------------------------------
+    # Cache file.
+
+    def load(self):
+        """ Read the cache file, if there is a valid one. """
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if cache.get("version") != _cache_version:
+            return
+        self._listings = dict((d, tuple(v)) for d, v
+                              in cache.get("listings", {}).items())
+        history = cache.get("history", {})
+        if history.get("path") == self.history_path:
+            self._counts = history.get("counts", {})
+            self._offset = history.get("offset", 0)
+            self._mtime = history.get("mtime")
+            self._head = tuple(history.get("head", self._head))
+
+    def save(self):
+        """ Write the cache file, if anything changed. """
+        if not self._dirty:
+            return
+        cache = {
+            "version":  _cache_version,
+            "listings": self._listings,
+            "history":  {
+                "path":   self.history_path,
+                "counts": self._counts,
+                "offset": self._offset,
+                "mtime":  self._mtime,
+                "head":   self._head,
+            },
+        }
+        temporary = self.cache_path + ".tmp"
+        try:
+            with open(temporary, "w") as f:
+                json.dump(cache, f)
+            if os.name == "nt" and os.path.exists(self.cache_path):
+                os.remove(self.cache_path)
+            os.rename(temporary, self.cache_path)
+        except (IOError, OSError):
+            return
+        self._dirty = False
+        self._saved = time.time()
+        stats["saves"] += 1
+
+    #-----------------------------------------------------------------------
+    # Refreshing.
+
+    def _refresh_listings(self):
+        directories = [d for d in self.search_path.split(os.pathsep) if d]
+        changed = False
+        for directory in directories:
+            mtime = _mtime(directory)
+            cached = self._listings.get(directory)
+            if cached and cached[0] == mtime:
+                continue
+            names = _executables(directory) if mtime is not None else []
+            self._listings[directory] = (mtime, names)
+            stats["listings"] += 1
+            changed = True
+        for directory in list(self._listings):
+            if directory not in directories:
+                del self._listings[directory]
+                changed = True
+        return changed
+
+    def _refresh_history(self):
+        try:
+            status = os.stat(self.history_path)
+            size, mtime = status.st_size, status.st_mtime
+        except OSError:
+            size, mtime = 0, None
+        if size == self._offset and mtime == self._mtime:
+            return False
+        data = b""
+        try:
+            with open(self.history_path, "rb") as f:
+                head = f.read(_head_bytes)
+                if size < self._offset \
+                        or _digest(head, self._head[0]) != self._head:
+                    # Rewritten rather than appended to, start over.
+                    self._counts = {}
+                    self._offset = 0
+                    stats["rebuilds"] += 1
+                f.seek(self._offset)
+                data = f.read(size - self._offset)
+        except (IOError, OSError):
+            head = b""
+        # A trailing line without newline may still be written.
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+        self._mtime = mtime
+        self._head = _digest(head, min(_head_bytes, self._offset))
+        stats["history"] += end
+        for line in data[:end].decode("utf-8", "replace").splitlines():
+            line = line.strip()
+            # Lines like "#1500000000" are timestamps.
+            if line and not line.startswith("#"):
+                self._counts[line] = self._counts.get(line, 0) + 1
+        if len(self._counts) > max_history:
+            ranked = sorted(self._counts.items(), key=lambda i: -i[1])
+            self._counts = dict(ranked[:max_history])
+        return True
+
+    def refresh(self):
+        """ Bring the index up to date with PATH and the history. """
+        stats["refreshes"] += 1
+        listings = self._refresh_listings()
+        history = self._refresh_history()
+        if listings or history:
+            self._entries = None
+            self._dirty = True
+        if self._dirty and time.time() - self._saved > save_interval:
+            self.save()
+
+    def entries(self):
+        """ Return a dict of spoken form -> command. """
+        self.refresh()
+        if self._entries is not None:
+            return self._entries
+        entries = {}
+        ranked = sorted(self._counts.items(), key=lambda i: (-i[1], i[0]))
+        for line, count in ranked:
+            if len(entries) >= max_entries:
+                break
+            spoken = spoken_form(line)
+            if spoken and len(spoken.split()) <= max_words:
+                entries.setdefault(spoken, line)
+        directories = [d for d in self.search_path.split(os.pathsep) if d]
+        for directory in directories:
+            for name in self._listings.get(directory, (None, ()))[1]:
+                if len(entries) >= max_entries:
+                    break
+                spoken = spoken_form(name)
+                if spoken:
+                    entries.setdefault(spoken, name)
+        self._entries = entries
+        return entries
+
+
+#---------------------------------------------------------------------------
+
+_index = None
+
+
+def index():
+    """ Return the shared index, creating it on first use. """
+    global _index
+    if _index is None:
+        _index = CommandIndex()
+    return _index
+
+
+def update_list(dict_list):
+    """ Fill *dict_list* with the index.  Only changes are sent. """
+    return _update_list(dict_list, index().entries())
+
+
+def save():
+    if _index is not None:
+        _index.save()
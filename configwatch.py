@@ -0,0 +1,254 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Reloading config files without reloading command-modules
+============================================================================
+
+Changing a formatter in gvim.txt or a command in notepad.py's config
+file used to take reloading the whole command-module: importing it
+again, building all its rules and loading all its grammars.  This
+module watches a command-module's config file instead:
+
+    watcher = ConfigWatcher(config, make_config, reload_config)
+
+Every *check_interval* seconds the modification times of the watched
+files are compared with those of the last load.  When one changed,
+*make_config()* creates a new Config with the same sections and items,
+all set to their defaults, and only the config file is loaded into it
+with Config.load().  The module's *reload_config(config, namespace)* is
+then called with the new Config and the namespace of the file, and the
+watcher watches the new Config from then on.  If loading the file
+failed, e.g. because it was saved half-edited, the new Config is
+dropped and no rule is touched; the module keeps using its loaded
+Config, and the file is loaded again once it is saved the next time.
+Config.load() only logs the errors of the file, so they are counted on
+the "config" logger while it runs.
+
+That function compares the new mappings with the loaded ones, see
+*mapping_changed()*, builds new instances of only the rules whose
+mapping changed and moves them into the loaded rule objects with
+*replace_rule()*.  Everything which refers to those rule objects, e.g.
+the RuleRefs of the repeat rules, stays valid.  Finally
+*reload_grammars()* loads only the grammars containing a replaced rule
+into the engine again; the module's other grammars stay loaded.
+
+Changes which add or remove whole rules, e.g. the first formatter in a
+config file which had none, still need the command-module to be
+reloaded; *reload_config()* says so.
+
+The checks run on an engine timer, which with natlink calls back
+between utterances.  Set *check_interval* to None before the
+command-modules are loaded to turn watching off, or call *check_all()*
+to check right away.
+
+"""
+
+import logging
+import os
+import time
+import types
+
+from dragonfly import get_engine
+
+from helpindex import register, unregister
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+check_interval = 1.0
+
+stats = {
+    "checks":  0,       # Times the config files were checked.
+    "reloads": 0,       # Config files loaded again.
+    "errors":  0,       # Config files not reloaded because they failed.
+    "rules":   0,       # Rules replaced.
+    "reload_total": 0.0,    # Seconds spent reloading, in total.
+}
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except (OSError, TypeError):
+        return None
+
+
+#---------------------------------------------------------------------------
+# Comparing actions.
+
+def describe(value):
+    """
+        Return a comparable description of *value*, an action, function
+        or plain value.  Actions which describe equal do the same; the
+        description of anything unknown only equals itself.
+    """
+    if isinstance(value, (types.FunctionType, types.MethodType)):
+        function = getattr(value, "__func__", value)
+        code = function.__code__
+        closure = [describe(cell.cell_contents)
+                   for cell in function.__closure__ or ()]
+        return ("function", code.co_code,
+                tuple(describe(c) for c in code.co_consts),
+                code.co_names, describe(function.__defaults__),
+                tuple(closure))
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,
+                tuple(describe(item) for item in value))
+    if isinstance(value, dict):
+        return ("dict", tuple(sorted((repr(k), describe(v))
+                                     for k, v in value.items())))
+    if isinstance(value, types.CodeType):
+        return ("code", value.co_code,
+                tuple(describe(c) for c in value.co_consts))
+    if value is None or isinstance(value, (bool, int, float, str,
+                                           type(u""))):
+        return value
+    attributes = getattr(value, "__dict__", None)
+    if attributes is not None and not isinstance(value, type):
+        return (type(value).__name__,
+                tuple(sorted((name, describe(item)) for name, item
+                             in attributes.items())))
+    return ("object", id(value))
+
+
+def mapping_changed(old, new):
+    """ Return whether the mappings *old* and *new* differ. """
+    if set(old) != set(new):
+        return True
+    for spec, action in new.items():
+        if describe(action) != describe(old[spec]):
+            return True
+    return False
+
+
+#---------------------------------------------------------------------------
+# Replacing rules.
+
+# Attributes which describe the state of a rule in its grammar, rather
+#  than the rule itself.
+_state = ("_grammar", "_active", "_enabled")
+
+
+def replace_rule(rule, new_rule):
+    """
+        Move the element, mapping, extras and so on of *new_rule* into
+        *rule*, which keeps its grammar and state.  Return *rule*.
+    """
+    for name, value in new_rule.__dict__.items():
+        if name not in _state:
+            setattr(rule, name, value)
+    stats["rules"] += 1
+    return rule
+
+
+def reload_grammars(grammars, module):
+    """ Load the loaded ones of *grammars* into the engine again. """
+    for grammar in grammars:
+        if grammar is None or not grammar.loaded:
+            continue
+        # A disabled grammar stays disabled.
+        unregister(grammar)
+        grammar.unload()
+        grammar.load()
+        register(grammar, module)
+
+
+#---------------------------------------------------------------------------
+
+class _ErrorCounter(logging.Handler):
+    # Counts the errors which Config.load() logs instead of raising them.
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+class ConfigWatcher(object):
+    """ Loads a Config's file again when it changes. """
+
+    def __init__(self, config, make_config, reload, paths=None):
+        self.config = config
+        self.make_config = make_config
+        self.reload = reload
+        self.paths = paths or [config.config_path]
+        self._mtimes = [_mtime(path) for path in self.paths]
+        _watchers.append(self)
+        if check_interval is not None:
+            _start(check_interval)
+
+    def _load(self):
+        # Return a new Config loaded from the file and its namespace, or
+        #  raise if loading the file failed.
+        config = self.make_config()
+        errors = _ErrorCounter()
+        logger = logging.getLogger("config")
+        logger.addHandler(errors)
+        try:
+            namespace = config.load(self.config.config_path)
+        finally:
+            logger.removeHandler(errors)
+        if errors.count:
+            raise ValueError("%d errors logged" % errors.count)
+        return config, namespace
+
+    def check(self):
+        """ Reload the config if its file changed; return whether. """
+        stats["checks"] += 1
+        mtimes = [_mtime(path) for path in self.paths]
+        if mtimes == self._mtimes:
+            return False
+        self._mtimes = mtimes
+        started = time.time()
+
+        try:
+            config, namespace = self._load()
+        except Exception as e:
+            stats["errors"] += 1
+            print("Not reloading %s: %s" % (self.config.config_path, e))
+            return False
+
+        self.config = config
+        try:
+            self.reload(config, namespace)
+        except Exception as e:
+            print("Reloading %s failed: %s" % (self.config.config_path, e))
+        stats["reloads"] += 1
+        stats["reload_total"] += time.time() - started
+        return True
+
+    def close(self):
+        if self in _watchers:
+            _watchers.remove(self)
+        if not _watchers:
+            _stop()
+
+
+_watchers = []
+_timer = None
+
+
+def check_all():
+    """ Check all watched config files now. """
+    for watcher in list(_watchers):
+        watcher.check()
+
+
+def _start(interval):
+    global _timer
+    if _timer is None:
+        _timer = get_engine().create_timer(check_all, interval)
+
+
+def _stop():
+    global _timer
+    if _timer is not None:
+        _timer.stop()
+        _timer = None
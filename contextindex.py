@@ -0,0 +1,163 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Context evaluation once per window
+============================================================================
+
+Dragonfly matches the context of every grammar against the foreground
+window at the start of every utterance, and every grammar then walks its
+rules to activate or deactivate them, even if the same window has been
+in the foreground for the last hundred utterances.  _bash.py, gvim.py
+and notepad.py each OR several AppContexts, and their lazy stubs, see
+lazygrammar.py, have contexts too.
+
+Grammars created as *IndexedGrammar* instead of Grammar share one
+*ContextIndex*.  The first time a window is seen at the start of an
+utterance, the index matches the contexts of all loaded IndexedGrammars
+against it once and remembers which grammars are in context for that
+window.  A window is identified by its signature: the executable, the
+title and the handle.  A change of either, e.g. to the title when vim
+opens another file, counts as a change of focus.
+
+At the start of each utterance an IndexedGrammar then looks up whether
+it is in context instead of matching its context again.  A grammar
+which was inactive and stays inactive, e.g. gvim.py's while a shell has
+the focus, has nothing to activate or deactivate and returns right
+away; only grammars whose activation changed or which are active
+process the start of the utterance.
+
+The last *max_windows* signatures are kept.  The index is cleared when
+an IndexedGrammar is loaded or unloaded.  The counters in *stats* show
+how many context evaluations were avoided.
+
+"""
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+
+from dragonfly import Grammar
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+max_windows = 32
+
+stats = {
+    "windows":     0,   # Window signatures indexed.
+    "evaluations": 0,   # Contexts matched against a window.
+    "avoided":     0,   # Context matches answered by the index.
+    "skipped":     0,   # Grammars which stayed inactive and were skipped.
+    "toggled":     0,   # Grammars which were activated or deactivated.
+}
+
+
+#---------------------------------------------------------------------------
+
+class ContextIndex(object):
+    """ The IndexedGrammars in context, by window signature. """
+
+    def __init__(self, max_windows=max_windows):
+        self.max_windows = max_windows
+        self._grammars = []
+        self._windows = OrderedDict() if OrderedDict else {}
+
+    def add(self, grammar):
+        if grammar not in self._grammars:
+            self._grammars.append(grammar)
+        self._windows.clear()
+
+    def remove(self, grammar):
+        if grammar in self._grammars:
+            self._grammars.remove(grammar)
+        self._windows.clear()
+
+    def _index(self, window):
+        # Match every context against *window* once.
+        in_context = set()
+        for grammar in self._grammars:
+            context = grammar._context
+            if context is None:
+                in_context.add(grammar)
+                continue
+            stats["evaluations"] += 1
+            if context.matches(*window):
+                in_context.add(grammar)
+        stats["windows"] += 1
+        return frozenset(in_context)
+
+    def in_context(self, grammar, window):
+        """ Return whether *grammar* is in context for *window*. """
+        grammars = self._windows.pop(window, None)
+        if grammars is None:
+            grammars = self._index(window)
+            while len(self._windows) >= self.max_windows:
+                oldest = next(iter(self._windows))
+                del self._windows[oldest]
+        elif grammar._context is not None:
+            stats["avoided"] += 1
+        # Most recently used last.
+        self._windows[window] = grammars
+        return grammar in grammars
+
+
+index = ContextIndex()
+
+
+class IndexedGrammar(Grammar):
+    """
+        Grammar which looks up whether it is in context in the shared
+        ContextIndex, and skips the start of utterances while it stays
+        inactive.
+    """
+
+    def __init__(self, *args, **kwargs):
+        Grammar.__init__(self, *args, **kwargs)
+        self._was_active = False
+
+    def load(self):
+        Grammar.load(self)
+        index.add(self)
+
+    def unload(self):
+        # Also called by Grammar.__del__(), possibly at exit.
+        if not self._loaded:
+            return
+        index.remove(self)
+        Grammar.unload(self)
+
+    def process_begin(self, executable, title, handle):
+        window = (executable, title, handle)
+        active = self._enabled and index.in_context(self, window)
+        if not active and not self._in_context \
+                and not [r for r in self._rules if r.active]:
+            # Inactive before and after, nothing to deactivate.
+            stats["skipped"] += 1
+            return
+        if active != self._was_active:
+            stats["toggled"] += 1
+        self._was_active = active
+
+        # The same as Grammar.process_begin(), but with the context
+        #  already matched.
+        if not self._enabled:
+            [r.deactivate() for r in self._rules if r.active]
+        elif active:
+            if not self._in_context:
+                self._in_context = True
+                self.enter_context()
+            self._process_begin(executable, title, handle)
+            for r in self._rules:
+                if r.exported and hasattr(r, "process_begin"):
+                    r.process_begin(executable, title, handle)
+        else:
+            if self._in_context:
+                self._in_context = False
+                self.exit_context()
+            [r.deactivate() for r in self._rules if r.active]
@@ -0,0 +1,281 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Asynchronous, cancellable action executor
+============================================================================
+
+Recognition callbacks used to execute their actions directly, so a long
+repeat blocked the engine until the last keystroke was sent and the
+next utterance could not interrupt it.
+
+This module runs a single background thread which takes batches of
+items (see keybatch.py) from a bounded queue and sends them in order.
+Recognition callbacks only compile and *submit* their batch.
+
+Saying "stop" (StopRule) or any command which calls *cancel()* drops
+all queued batches, stops the batch being sent after its current chunk
+of keystrokes, and releases all modifiers.
+
+A batch can be submitted with a *sender*, a function which tries to
+deliver the batch some other way and returns True if it did, e.g. the
+remote vim backend in vimrpc.py.  Keystrokes are only sent if it
+returns False.
+
+Batches containing a Mimic are queued like any other, but the engine
+must only be called from its own thread: the background thread hands
+each Mimic to an engine timer, which runs it between utterances, and
+waits for it before sending the rest of the batch.  Recognition is not
+blocked meanwhile and "stop" cancels such batches too.
+
+The *stats* dictionary counts submissions, cancellations, the queue
+depth and the time batches spent waiting in the queue.
+
+"""
+
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from dragonfly import CompoundRule, MappingRule, Mimic, get_engine
+
+from keybatch import ACTION, emit, flatten
+from modifiers import ReleaseAll
+import tracing
+
+
+#---------------------------------------------------------------------------
+
+stats = {
+    "submitted":  0,    # Batches submitted.
+    "executed":   0,    # Batches sent completely.
+    "cancelled":  0,    # Batches dropped or stopped by cancel().
+    "rejected":   0,    # Batches rejected because the queue was full.
+    "depth_max":  0,    # Largest queue depth seen at submission.
+    "wait_total": 0.0,  # Total seconds batches waited in the queue.
+    "wait_max":   0.0,  # Longest time a batch waited in the queue.
+}
+
+
+class Executor(object):
+
+    def __init__(self, maxsize=32, chunk_size=64, engine_interval=0.05):
+        self.chunk_size = chunk_size
+        self.engine_interval = engine_interval
+        self._queue = queue.Queue(maxsize)
+        self._generation = 0
+        self._idle = threading.Event()
+        self._idle.set()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Actions waiting to be run on the engine thread, and the number
+        #  of queued batches which contain such actions.
+        self._engine_calls = queue.Queue()
+        self._engine_batches = 0
+        self._engine_timer = None
+
+    def depth(self):
+        """ Return the number of batches waiting in the queue. """
+        return self._queue.qsize()
+
+    def submit(self, items, sender=None):
+        """ Queue a batch of *items* for execution. """
+        stats["submitted"] += 1
+        self._start()
+        stats["depth_max"] = max(stats["depth_max"], self.depth() + 1)
+        trace = tracing.current()
+        if trace is not None:
+            trace = (trace, tracing.clock())
+        on_engine = not self._thread_safe(items)
+        entry = (self._generation, time.time(), items, sender, trace,
+                 on_engine)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            stats["rejected"] += 1
+            print("Executor queue full, command dropped")
+            return False
+        if on_engine:
+            self._engine_batch(1)
+        return True
+
+    def cancel(self, timeout=1.0):
+        """ Drop all queued and in-flight keystrokes. """
+        with self._lock:
+            self._generation += 1
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            stats["cancelled"] += 1
+            if entry[5]:
+                self._engine_batch(-1)
+            self._queue.task_done()
+        self._idle.wait(timeout)
+        ReleaseAll().execute()
+
+    def wait(self):
+        """ Block until all submitted batches have been executed. """
+        if self._thread is not None:
+            self._queue.join()
+
+    #-----------------------------------------------------------------------
+
+    def _send(self, items, sender, stopped):
+        if sender is not None and sender(items):
+            return
+        run = []
+        for item in items:
+            if self._thread_safe([item]):
+                run.append(item)
+                continue
+            emit(run, self.chunk_size, stopped)
+            run = []
+            if stopped() or not self._call_engine(item[1], stopped):
+                return
+        emit(run, self.chunk_size, stopped)
+
+    def _thread_safe(self, items):
+        for kind, value in items:
+            if kind == ACTION and isinstance(value[0], Mimic):
+                return False
+        return True
+
+    #-----------------------------------------------------------------------
+    # Actions which must run on the engine thread.
+
+    def _engine_batch(self, change):
+        # Count queued batches with engine actions; the timer which
+        #  runs those actions is only needed while there are any.
+        #  Started by submit(), on the engine thread.
+        with self._lock:
+            self._engine_batches += change
+            start = change > 0 and self._engine_timer is None
+        if start:
+            self._engine_timer = get_engine().create_timer(
+                self._run_engine_calls, self.engine_interval)
+
+    def _call_engine(self, value, stopped):
+        # Have the engine timer run (action, data) and wait for it,
+        #  unless cancelled.  Return whether it was run.
+        done = threading.Event()
+        self._engine_calls.put((self._generation, value, done))
+        while not done.wait(self.engine_interval):
+            if stopped():
+                return False
+        return True
+
+    def _run_engine_calls(self):
+        while True:
+            try:
+                generation, (action, data), done = \
+                    self._engine_calls.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if generation == self._generation:
+                    action.execute(data)
+            except Exception as e:
+                print("Executor failed to execute %s: %s" % (action, e))
+            finally:
+                done.set()
+        with self._lock:
+            stop = not self._engine_batches and self._engine_timer
+            if stop:
+                self._engine_timer = None
+        if stop:
+            stop.stop()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            name="action executor")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            generation, submitted, items, sender, trace, on_engine = entry
+            self._idle.clear()
+            try:
+                if generation != self._generation:
+                    stats["cancelled"] += 1
+                    continue
+                waited = time.time() - submitted
+                stats["wait_total"] += waited
+                stats["wait_max"] = max(stats["wait_max"], waited)
+                stopped = lambda: generation != self._generation
+                if trace is None:
+                    self._send(items, sender, stopped)
+                else:
+                    utterance, queued = trace
+                    with tracing.resume(utterance):
+                        tracing.record("queue", queued, tracing.clock())
+                        with tracing.span("inject"):
+                            self._send(items, sender, stopped)
+                if stopped():
+                    stats["cancelled"] += 1
+                else:
+                    stats["executed"] += 1
+            except Exception as e:
+                print("Executor failed to execute batch: %s" % e)
+            finally:
+                if on_engine:
+                    self._engine_batch(-1)
+                self._idle.set()
+                self._queue.task_done()
+
+
+executor = Executor()
+
+
+def submit(items, sender=None):
+    return executor.submit(items, sender)
+
+
+def submit_action(action, data=None, sender=None):
+    return executor.submit(flatten([action], data), sender)
+
+
+def cancel():
+    executor.cancel()
+
+
+#---------------------------------------------------------------------------
+# Rules which use the executor.
+
+class QueuedMappingRule(MappingRule):
+    """
+        MappingRule which submits its actions to the executor.
+
+        Takes the same arguments as MappingRule, plus an optional
+        *sender* for the submitted batches.
+    """
+
+    sender = None
+
+    def __init__(self, *args, **kwargs):
+        if "sender" in kwargs:
+            self.sender = kwargs.pop("sender")
+        MappingRule.__init__(self, *args, **kwargs)
+
+    def _process_recognition(self, value, extras):
+        submit_action(value, extras, self.sender)
+
+
+class StopRule(CompoundRule):
+    """ Rule which cancels all pending keystrokes. """
+
+    spec = "stop"
+
+    def _process_recognition(self, node, extras):
+        cancel()
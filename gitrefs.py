@@ -0,0 +1,189 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Git refs as a dynamic list
+============================================================================
+
+Branch names dictated through a free <text> element are slow to decode
+and often misrecognized.  This module reads the refs of a git repository
+so that _bash.py can offer them as a small DictList instead, e.g.
+"git check out feature login" types "git checkout feature/login".
+
+The refs are read directly from the repository, without running git:
+
+ - .git/HEAD for the current branch, which is listed first
+ - the loose refs below .git/refs/heads and .git/refs/remotes
+ - .git/packed-refs
+
+Everything read is cached along with the modification time of the file
+or directory it came from.  A refresh only stats those paths and
+re-reads the ones which changed, so it can be done at the start of
+every utterance.
+
+The repository is the one containing *git_directory*, by default the
+DRAGONFLY_GIT_DIR environment variable or the current directory.  Note
+that the terminal's working directory is not known to the engine, e.g.
+when working over PuTTY, so set it to the repository you work in.
+
+"""
+
+import os
+
+from spokenlist import spoken_form, update_list as _update_list
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+git_directory = os.environ.get("DRAGONFLY_GIT_DIR") or os.getcwd()
+
+stats = {
+    "refreshes": 0,     # Calls of GitRefs.refs().
+    "reads":     0,     # Files and directories (re-)read.
+}
+
+
+def find_git_dir(directory):
+    """ Return the .git directory of the repository at *directory*. """
+    directory = os.path.abspath(directory)
+    while True:
+        candidate = os.path.join(directory, ".git")
+        if os.path.isdir(candidate):
+            return candidate
+        if os.path.isfile(candidate):
+            # Worktrees and submodules: "gitdir: <path>".
+            with open(candidate) as f:
+                content = f.read().strip()
+            if content.startswith("gitdir:"):
+                path = content[len("gitdir:"):].strip()
+                return os.path.normpath(os.path.join(directory, path))
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+#---------------------------------------------------------------------------
+
+class GitRefs(object):
+    """ Cached names of the branches of one repository. """
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        self._files = {}    # Path -> (mtime, parsed content).
+        self._dirs = {}     # Path -> (mtime, subdirectories, files).
+
+    def _cached_file(self, path, parse):
+        mtime = _mtime(path)
+        cached = self._files.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        content = None
+        if mtime is not None:
+            with open(path) as f:
+                content = parse(f.read())
+            stats["reads"] += 1
+        self._files[path] = (mtime, content)
+        return content
+
+    def _loose_refs(self, directory, prefix):
+        # Yield the names of the ref files below *directory*.
+        mtime = _mtime(directory)
+        cached = self._dirs.get(directory)
+        if not cached or cached[0] != mtime:
+            subdirectories, files = [], []
+            if mtime is not None:
+                for name in sorted(os.listdir(directory)):
+                    if os.path.isdir(os.path.join(directory, name)):
+                        subdirectories.append(name)
+                    else:
+                        files.append(name)
+                stats["reads"] += 1
+            cached = (mtime, subdirectories, files)
+            self._dirs[directory] = cached
+        for name in cached[2]:
+            yield prefix + name
+        for name in cached[1]:
+            for ref in self._loose_refs(os.path.join(directory, name),
+                                        prefix + name + "/"):
+                yield ref
+
+    def current_branch(self):
+        """ Return the checked out branch, or None if HEAD is detached. """
+        return self._cached_file(os.path.join(self.git_dir, "HEAD"),
+                                 _parse_head)
+
+    def refs(self):
+        """ Return the local and remote branch names, current first. """
+        stats["refreshes"] += 1
+        refs_dir = os.path.join(self.git_dir, "refs")
+        heads = set(self._loose_refs(os.path.join(refs_dir, "heads"), ""))
+        remotes = set(self._loose_refs(os.path.join(refs_dir, "remotes"),
+                                       ""))
+        packed = self._cached_file(os.path.join(self.git_dir,
+                                                "packed-refs"),
+                                   _parse_packed_refs) or ()
+        for ref in packed:
+            if ref.startswith("refs/heads/"):
+                heads.add(ref[len("refs/heads/"):])
+            elif ref.startswith("refs/remotes/"):
+                remotes.add(ref[len("refs/remotes/"):])
+        remotes = set(r for r in remotes if not r.endswith("/HEAD"))
+
+        current = self.current_branch()
+        names = sorted(heads) + sorted(remotes)
+        if current in heads:
+            names.remove(current)
+            names.insert(0, current)
+        return names
+
+
+def _parse_head(content):
+    content = content.strip()
+    if content.startswith("ref: refs/heads/"):
+        return content[len("ref: refs/heads/"):]
+    return None
+
+
+def _parse_packed_refs(content):
+    refs = []
+    for line in content.splitlines():
+        if not line or line[0] in "#^":
+            continue
+        parts = line.split(None, 1)
+        if len(parts) == 2:
+            refs.append(parts[1].strip())
+    return refs
+
+
+#---------------------------------------------------------------------------
+
+_repositories = {}
+
+
+def update_list(dict_list, directory=None):
+    """
+        Fill *dict_list* with the refs of the repository containing
+        *directory*, by default *git_directory*.  The list is only
+        changed if the refs changed.
+    """
+    git_dir = find_git_dir(directory or git_directory)
+    refs = {}
+    if git_dir is not None:
+        repository = _repositories.get(git_dir)
+        if repository is None:
+            repository = _repositories[git_dir] = GitRefs(git_dir)
+        for ref in repository.refs():
+            refs.setdefault(spoken_form(ref), ref)
+    return _update_list(dict_list, refs)
@@ -0,0 +1,328 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Grammar cache for fast loading of command-modules
+============================================================================
+
+Most of the time it takes to load gvim.py or notepad.py is spent parsing
+text: every spoken form of every rule is parsed into an element tree by
+the Compound class, and every static Key action parses its spec into
+keyboard events.  Loading a grammar into natlink then compiles all its
+rules into the binary format the engine reads.  This module keeps the
+results in a cache file per command-module:
+
+    cache = ModuleCache("gvim", __file__)
+
+    with cache:
+        ... build and load the grammars ...
+
+Inside the *with* block, and only there, the results are served from
+the cache:
+
+ - the element tree of a spoken form, keyed on its spec and the names
+   of its extras; the extras themselves are those of the Compound
+   being built
+ - the keyboard events of a Key spec, keyed on the spec
+ - the compiled grammar of a grammar loaded into natlink, keyed on its
+   name and the definitions of all its rules, so that changes made
+   outside the module, e.g. the limits of usagestats.py, compile it
+   again
+
+Every lookup returns objects of its own, unpickled from the cache.  When
+the block is left, parsing and compiling work as usual again, even if
+the block raised, and the cache file is rewritten if anything was
+missing from it.  The cache is only used if it was written for the same
+module source, the same config file, e.g. gvim.txt, and the same
+versions of dragonfly and Python; otherwise everything is parsed as
+usual and the cache starts afresh.
+
+The cache files are written to *cache_directory*, by default the
+DRAGONFLY_GRAMMAR_CACHE environment variable or ~/.dragonfly_cache.
+Set *enabled* to False to bypass the cache.  Run ``python headless.py
+--startup`` to compare the load times of all modules with and without
+the cache.
+
+The rules and actions themselves are still built by the module, and
+executing the config file cannot be cached.
+
+"""
+
+import hashlib
+import os
+import sys
+from io import BytesIO
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from dragonfly import Compound, Key
+from dragonfly.grammar import elements_compound
+from dragonfly.grammar.elements_basic import id_generator
+
+try:
+    from dragonfly.engines.backend_natlink.compiler import NatlinkCompiler
+except ImportError:
+    NatlinkCompiler = None
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+cache_directory = (os.environ.get("DRAGONFLY_GRAMMAR_CACHE")
+                   or os.path.expanduser("~/.dragonfly_cache"))
+enabled         = True
+
+stats = {
+    "hits":   0,    # Results served from a cache.
+    "misses": 0,    # Results parsed or compiled.
+}
+
+_format = 2
+
+
+def _dragonfly_version():
+    try:
+        import pkg_resources
+    except ImportError:
+        return "unknown"
+    for name in ("dragonfly2", "dragonfly"):
+        try:
+            return "%s %s" % (name,
+                              pkg_resources.get_distribution(name).version)
+        except Exception:
+            pass
+    return "unknown"
+
+
+def _keyboard_name():
+    # Key events depend on the keyboard implementation.
+    keyboard = getattr(Key, "_keyboard", None)
+    if not isinstance(keyboard, type):
+        keyboard = type(keyboard)
+    return "%s.%s" % (keyboard.__module__, keyboard.__name__)
+
+
+def module_key(module_file, config_files=()):
+    """ Return the cache key of a module and its config files. """
+    digest = hashlib.sha1()
+    digest.update(("%d %s %s %s %s" % (
+        _format, _dragonfly_version(), sys.version_info[:2], sys.platform,
+        _keyboard_name())).encode("utf-8"))
+    for path in [module_file] + list(config_files):
+        digest.update(b"\0")
+        try:
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        except (IOError, OSError):
+            pass
+    return digest.hexdigest()
+
+
+def grammar_key(grammar):
+    """ Return the definitions of all rules of *grammar*, hashed. """
+    digest = hashlib.sha1()
+    for rule in grammar.rules:
+        digest.update(("%s %s %s %s\0" % (
+            rule.name, rule.exported, rule.imported,
+            rule.element.gstring() if rule.element else "")
+                       ).encode("utf-8"))
+    return digest.hexdigest()
+
+
+#---------------------------------------------------------------------------
+# Cache entries are pickled.  Elements of the extras of a Compound are
+#  pickled as references to their names, and unpickled as the extras of
+#  the Compound looking the entry up.
+
+def _dumps(value, extras=None):
+    buffer = BytesIO()
+    pickler = pickle.Pickler(buffer, 2)
+    if extras:
+        names = dict((id(element), name) for name, element in extras.items())
+        pickler.persistent_id = lambda value: names.get(id(value))
+    pickler.dump(value)
+    return buffer.getvalue()
+
+
+def _loads(data, extras=None):
+    unpickler = pickle.Unpickler(BytesIO(data))
+    if extras:
+        unpickler.persistent_load = extras.__getitem__
+    return unpickler.load()
+
+
+def _renumber(element, extras):
+    # Unpickled elements still have the ids of the elements they were
+    #  pickled from, which dragonfly uses to tell elements apart.
+    kept = set(id(extra) for extra in extras.values())
+    stack = [element]
+    while stack:
+        element = stack.pop()
+        if id(element) not in kept:
+            element._id = next(id_generator)
+            stack.extend(element.children)
+
+
+class _Spec(object):
+    # Stands in for the parse tree of a spec, which is only parsed once
+    #  the extras of its Compound are known, see _CachingTransformer.
+
+    def __init__(self, spec):
+        self.spec = spec
+
+
+class _CachingParser(object):
+    # Stands in for Compound._parser.
+
+    def __init__(self, parser):
+        self.parser = parser
+
+    def parse(self, spec):
+        return _Spec(spec)
+
+    def __getattr__(self, name):
+        return getattr(self.parser, name)
+
+
+#---------------------------------------------------------------------------
+
+class ModuleCache(object):
+    """ The cached parse results and grammars of one command-module. """
+
+    def __init__(self, name, module_file, config_files=None):
+        if module_file.endswith((".pyc", ".pyo")):
+            module_file = module_file[:-1]
+        if config_files is None:
+            config_files = [os.path.splitext(module_file)[0] + ".txt"]
+        self.name = name
+        self.module_file = module_file
+        self.config_files = config_files
+        self.path = os.path.join(cache_directory, name + ".pickle")
+        self.key = None
+        self.entries = {}
+        self.missed = False
+        self._saved = []
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                key, entries = pickle.load(f)
+        except Exception:
+            return False
+        if key != self.key:
+            return False
+        self.entries = entries
+        return True
+
+    def save(self):
+        try:
+            if not os.path.isdir(cache_directory):
+                os.makedirs(cache_directory)
+            temporary = self.path + ".tmp"
+            with open(temporary, "wb") as f:
+                pickle.dump((self.key, self.entries), f, 2)
+            if os.name == "nt" and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(temporary, self.path)
+        except (IOError, OSError):
+            return False
+        self.missed = False
+        return True
+
+    def lookup(self, key, build, extras=None):
+        """
+            Return a copy of the entry *key*, or the result of *build()*,
+            which is added to the cache.  Elements of *extras* are
+            referred to by name, see the functions above.
+        """
+        if key in self.entries:
+            stats["hits"] += 1
+            return _loads(self.entries[key], extras)
+        stats["misses"] += 1
+        result = build()
+        try:
+            self.entries[key] = _dumps(result, extras)
+        except Exception:
+            # Results which cannot be pickled are simply not cached.
+            return result
+        self.missed = True
+        return result
+
+    def __enter__(self):
+        if not enabled:
+            self._saved.append(None)
+            return self
+        key = module_key(self.module_file, self.config_files)
+        if key != self.key:
+            self.key = key
+            self.entries = {}
+            self.load()
+
+        parser = Compound._parser
+        transformer = elements_compound.CompoundTransformer
+        parse_spec = Key.__dict__.get("_parse_spec")
+        compile_grammar = (NatlinkCompiler.__dict__["compile_grammar"]
+                           if NatlinkCompiler else None)
+        self._saved.append((parser, transformer, parse_spec,
+                            compile_grammar))
+        cache = self
+
+        class _CachingTransformer(transformer):
+            # Stands in for CompoundTransformer, and builds the element
+            #  tree of a spec when it is not in the cache.
+            def transform(self, tree):
+                if not isinstance(tree, _Spec):
+                    return transformer.transform(self, tree)
+                if "{" in tree.spec:
+                    # Specifiers such as {weight=2} modify the extras.
+                    return transformer.transform(self,
+                                                 parser.parse(tree.spec))
+                build = lambda: transformer.transform(
+                    self, parser.parse(tree.spec))
+                key = ("spec", tree.spec, tuple(sorted(self.extras)))
+                element = cache.lookup(key, build, self.extras)
+                _renumber(element, self.extras)
+                return element
+
+        Compound._parser = _CachingParser(parser)
+        elements_compound.CompoundTransformer = _CachingTransformer
+
+        if parse_spec is not None:
+            def _parse_spec(self, spec):
+                return cache.lookup(("key", spec),
+                                    lambda: parse_spec(self, spec))
+            Key._parse_spec = _parse_spec
+
+        if compile_grammar is not None:
+            def _compile_grammar(self, grammar):
+                try:
+                    key = ("grammar", grammar.name, grammar_key(grammar))
+                except Exception:
+                    return compile_grammar(self, grammar)
+                return cache.lookup(key,
+                                    lambda: compile_grammar(self, grammar))
+            NatlinkCompiler.compile_grammar = _compile_grammar
+        return self
+
+    def __exit__(self, *exc_info):
+        saved = self._saved.pop()
+        if saved is None:
+            return False
+        parser, transformer, parse_spec, compile_grammar = saved
+        try:
+            if self.missed:
+                self.save()
+        finally:
+            Compound._parser = parser
+            elements_compound.CompoundTransformer = transformer
+            if parse_spec is not None:
+                Key._parse_spec = parse_spec
+            if compile_grammar is not None:
+                NatlinkCompiler.compile_grammar = compile_grammar
+        return False
@@ -0,0 +1,263 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Grammar complexity analyzer with budgets
+============================================================================
+
+Repetitions over large alternatives and nested optional parts in specs
+like ``"[<n>] (delete | D.) (whiskey|word)"`` make grammars grow quickly,
+and larger grammars are slower to load and to recognize.  This module
+loads the command-modules on the headless engine of headless.py and
+reports for every rule of their grammars:
+
+ - alternatives -- the number of different word sequences the rule
+   accepts, counting a dictation slot or a list entry as one word
+ - depth -- how deeply its elements are nested, including the rules it
+   references; every optional repetition of a Repetition is one level
+ - dictation -- the largest number of dictation slots in one utterance
+ - size -- the size of the rule's compiled definition in bytes, from
+   dragonfly's natlink compiler; "-" if that is not available
+
+Each module is then checked against its entry in *budgets*, or against
+*default_budget*: the size of all its compiled grammars and the largest
+alternatives, depth and dictation of any of its rules must not exceed
+the budget.  Run it from this directory:
+
+    python grammarcheck.py
+    python grammarcheck.py gvim notepad
+
+The exit status is 1 if a module is over its budget, so that the check
+can be run before committing.
+
+"""
+
+import struct
+import sys
+
+from headless import HeadlessSession, command_modules, compiled_size
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+default_budget = {
+    "size":         16 * 1024,
+    "alternatives": 10 ** 12,
+    "depth":        40,
+    "dictation":    4,
+}
+
+# Budgets of the modules, just above what they needed when they were
+#  last measured: the compiled size rounded up to whole kB, the next
+#  power of ten of alternatives, two more levels of depth and one more
+#  dictation slot.  A change which makes a grammar grow beyond that has
+#  to raise the budget on purpose.  Modules without an entry are checked
+#  against the default budget.
+budgets = {
+    "_dragonall": {
+        "size":         1 * 1024,
+        "alternatives": 10 ** 1,
+        "depth":        6,
+        "dictation":    2,
+    },
+    "_bash": {
+        "size":         15 * 1024,
+        "alternatives": 10 ** 23,
+        "depth":        31,
+        "dictation":    9,
+    },
+    "_python_grammar": {
+        "size":         2 * 1024,
+        "alternatives": 10 ** 1,
+        "depth":        5,
+        "dictation":    1,
+    },
+    "notepad": {
+        "size":         7 * 1024,
+        "alternatives": 10 ** 62,
+        "depth":        52,
+        "dictation":    17,
+    },
+    "gvim": {
+        "size":         47 * 1024,
+        "alternatives": 10 ** 88,
+        "depth":        72,
+        "dictation":    17,
+    },
+}
+
+metrics = ["alternatives", "depth", "dictation", "size"]
+
+
+#---------------------------------------------------------------------------
+# Element tree metrics.
+
+def _metrics(element, memo):
+    # Return (alternatives, depth, dictation) of *element*.  Repetitions
+    #  share their child, so every element is only analyzed once.
+    key = id(element)
+    if key in memo:
+        return memo[key]
+
+    from dragonfly import (Alternative, Dictation, Empty, ListRef,
+                           Literal, Optional, RuleRef, Sequence)
+    from dragonfly.grammar.elements_basic import Impossible
+
+    if isinstance(element, RuleRef):
+        alternatives, depth, dictation = _metrics(element.rule.element, memo)
+        result = (alternatives, depth + 1, dictation)
+    elif isinstance(element, ListRef):
+        result = (len(element.list), 1, 0)
+    elif isinstance(element, Dictation):
+        result = (1, 1, 1)
+    elif isinstance(element, Impossible):
+        result = (0, 1, 0)
+    elif isinstance(element, (Literal, Empty)) or not element.children:
+        result = (1, 1, 0)
+    else:
+        children = [_metrics(child, memo) for child in element.children]
+        depth = max(c[1] for c in children) + 1
+        if isinstance(element, Optional):
+            alternatives, _, dictation = children[0]
+            result = (alternatives + 1, depth, dictation)
+        elif isinstance(element, Sequence):
+            alternatives = 1
+            for child in children:
+                alternatives *= child[0]
+            result = (alternatives, depth, sum(c[2] for c in children))
+        elif isinstance(element, Alternative):
+            result = (sum(c[0] for c in children), depth,
+                      max(c[2] for c in children))
+        else:
+            raise TypeError("Cannot analyze element %r" % element)
+    memo[key] = result
+    return result
+
+
+def rule_sizes(grammar):
+    """
+        Return the estimated compiled size of each rule of *grammar* by
+        name, or an empty dict if the natlink compiler is not available.
+        Only the rule definitions are counted, not the words which all
+        rules of the grammar share.
+    """
+    try:
+        from dragonfly.engines.backend_natlink.compiler import (
+            NatlinkCompiler, _Compiler)
+    except ImportError:
+        return {}
+    compiler = _Compiler()
+    for rule in grammar.rules:
+        NatlinkCompiler()._compile_rule(rule, compiler)
+    # Each element of a definition is packed as "HHL".
+    entry = struct.calcsize("HHL")
+    return dict((name, entry * len(definition)) for name, definition
+                in compiler._rule_definitions.items())
+
+
+class RuleReport(object):
+
+    def __init__(self, module, grammar, rule, memo, size=None):
+        self.module = module
+        self.grammar = grammar
+        self.rule = rule
+        (self.alternatives, self.depth,
+         self.dictation) = _metrics(rule.element, memo)
+        self.size = size
+
+
+class ModuleReport(object):
+
+    def __init__(self, module, grammars):
+        self.module = module
+        self.grammars = grammars
+        memo = {}
+        self.rules = []
+        for grammar in grammars:
+            sizes = rule_sizes(grammar)
+            for rule in grammar.rules:
+                self.rules.append(RuleReport(module, grammar, rule, memo,
+                                             sizes.get(rule.name)))
+        sizes = [compiled_size(grammar) for grammar in grammars]
+        self.size = None if None in sizes else sum(sizes)
+        self.budget = dict(default_budget)
+        self.budget.update(budgets.get(module, {}))
+
+    def value(self, metric):
+        if metric == "size":
+            return self.size
+        return max([getattr(r, metric) for r in self.rules] or [0])
+
+    def violations(self):
+        """ Return (metric, value, budget) for each exceeded budget. """
+        violations = []
+        for metric in metrics:
+            value = self.value(metric)
+            if value is not None and value > self.budget[metric]:
+                violations.append((metric, value, self.budget[metric]))
+        return violations
+
+
+#---------------------------------------------------------------------------
+# Reporting.
+
+def _count(value):
+    # Counts of alternatives can have hundreds of digits.
+    if value is None:
+        return "-"
+    text = "%d" % value
+    if len(text) <= 9:
+        return text
+    return "%s.%se%d" % (text[0], text[1], len(text) - 1)
+
+
+def analyze(modules=command_modules):
+    """ Load *modules* and return a ModuleReport for each. """
+    session = HeadlessSession()
+    session.load_all(modules=modules)
+    reports = [ModuleReport(name, session.grammars[name])
+               for name in modules]
+    session.unload_all()
+    return reports
+
+
+def print_report(report):
+    print("%s" % report.module)
+    print("  %-32s %12s %6s %9s %9s" % ("rule", "alternatives", "depth",
+                                        "dictation", "size [B]"))
+    for rule in report.rules:
+        name = rule.rule.name if rule.rule.exported else "(%s)" % rule.rule.name
+        print("  %-32s %12s %6d %9d %9s" % (name[:32],
+                                            _count(rule.alternatives),
+                                            rule.depth, rule.dictation,
+                                            _count(rule.size)))
+    print("  %-32s %12s %6s %9s %9s" % ("budget",
+                                        _count(report.budget["alternatives"]),
+                                        report.budget["depth"],
+                                        report.budget["dictation"],
+                                        _count(report.budget["size"])))
+    print("  compiled size of all grammars: %s bytes" % _count(report.size))
+    for metric, value, budget in report.violations():
+        print("  OVER BUDGET: %s is %s, budget %s"
+              % (metric, _count(value), _count(budget)))
+    print("")
+
+
+def check(modules=command_modules):
+    """ Print the reports of *modules*; return False if over budget. """
+    reports = analyze(modules)
+    for report in reports:
+        print_report(report)
+    over = [r.module for r in reports if r.violations()]
+    if over:
+        print("Over budget: %s" % ", ".join(over))
+    return not over
+
+
+if __name__ == "__main__":
+    if not check(sys.argv[1:] or command_modules):
+        sys.exit(1)
@@ -0,0 +1,155 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Registry of the loaded grammars of all command-modules
+============================================================================
+
+Each command-module used to unload the grammars it remembered in its
+own *unload()*, and some were forgotten: _python_grammar.py never
+unloaded its bootstrap grammar.  Every time natlink reloaded the module,
+another copy of that grammar stayed loaded in the engine, making
+decoding slower and using memory until Dragon was restarted.
+
+Each command-module now adds every grammar it loads to the registry of
+this module, right after loading it:
+
+    grammar.load()
+    add_grammar(grammar, __name__)
+
+The registry keeps the grammars in load order, with the command-module
+which loaded them.  The stub grammar of a LazyGrammar is added for the
+module given to it, see lazygrammar.py.  A command-module's *unload()*
+then only has to call:
+
+    unload_grammars(__name__)
+
+which removes all its grammars from the help index and unloads them,
+the last loaded first.  Each unloaded grammar is then *release()*d: its
+rules and lists refer back to it, and with Python 2 the garbage
+collector never frees such a cycle because Grammar has a *__del__()*
+method; the grammar, its rules and everything they refer to used to
+stay in memory after every reload.  *counts()* returns the number of
+live grammars and rules by module, and *leaked()* the grammars which
+are still loaded although the module which loaded them was unloaded or
+replaced by a newer import.
+
+Run ``python headless.py --soak`` to reload all command-modules many
+times and see that the counts and the memory used stay flat.
+
+"""
+
+import sys
+
+from helpindex import unregister
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+stats = {
+    "loads":   0,       # Grammars added.
+    "unloads": 0,       # Grammars unloaded.
+}
+
+
+def release(grammar):
+    """
+        Remove the rules and lists of the unloaded *grammar*, so that
+        the grammar can be freed.
+    """
+    for rule in list(grammar._rules):
+        grammar.remove_rule(rule)
+    for list_ in grammar._lists:
+        list_.grammar = None
+    del grammar._lists[:]
+
+
+def unload_all(grammars):
+    """ Unload and release *grammars*, the last one first. """
+    for grammar in reversed(grammars):
+        unregister(grammar)
+        if grammar.loaded:
+            grammar.unload()
+        registry.remove(grammar)
+        release(grammar)
+
+
+#---------------------------------------------------------------------------
+
+class GrammarRegistry(object):
+    """ The loaded grammars, in load order, with their module. """
+
+    def __init__(self):
+        self._grammars = []     # (grammar, module name, module namespace)
+                                #  in load order.
+
+    def add(self, grammar, module):
+        """ Add the loaded *grammar* of command-module *module*. """
+        if [g for g in self.grammars() if g is grammar]:
+            return
+        namespace = getattr(sys.modules.get(module), "__dict__", None)
+        self._grammars.append((grammar, module, namespace))
+        stats["loads"] += 1
+
+    def remove(self, grammar):
+        grammars = [entry for entry in self._grammars
+                    if entry[0] is not grammar]
+        if len(grammars) < len(self._grammars):
+            stats["unloads"] += 1
+        self._grammars = grammars
+
+    def grammars(self, module=None):
+        """ Return the loaded grammars of *module*, or all of them. """
+        return [g for g, m, n in self._grammars
+                if module is None or m == module]
+
+    def unload(self, module):
+        """ Unload all grammars of *module*, the last loaded first. """
+        grammars = self.grammars(module)
+        unload_all(grammars)
+        return len(grammars)
+
+    def counts(self):
+        """ Return {module: (grammars, rules)} of the loaded grammars. """
+        counts = {}
+        for grammar, module, namespace in self._grammars:
+            grammars, rules = counts.get(module, (0, 0))
+            counts[module] = (grammars + 1, rules + len(grammar.rules))
+        return counts
+
+    def leaked(self):
+        """
+            Return the loaded grammars whose module is no longer
+            imported, or was imported again since it loaded them.
+        """
+        leaked = []
+        for grammar, module, namespace in self._grammars:
+            current = sys.modules.get(module)
+            if getattr(current, "__dict__", None) is not namespace:
+                leaked.append(grammar)
+        return leaked
+
+
+registry = GrammarRegistry()
+
+
+def add_grammar(grammar, module):
+    """ Add *grammar*, which *module* loaded. """
+    registry.add(grammar, module)
+
+
+def unload_grammars(module):
+    """ Unload all grammars which *module* loaded. """
+    return registry.unload(module)
+
+
+def counts():
+    return registry.counts()
+
+
+def leaked():
+    return registry.leaked()
@@ -0,0 +1,606 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Headless engine stand-in and end-to-end benchmark
+============================================================================
+
+The command-modules in this directory normally only run inside Dragon
+NaturallySpeaking through natlink.  This module runs them without
+either, on dragonfly2's "text" engine, so that they can be exercised
+and timed on any platform:
+
+ - every command-module is imported and its grammars are loaded, and
+   the time each module takes to load is measured
+ - scripted utterances are recognized with the engine's *mimic()*,
+   optionally in the context of a given executable and window title
+ - keystrokes are not sent anywhere; the keyboard used by Key and Text
+   actions is replaced by a *RecordingKeyboard* which only records them
+ - for each utterance the time from the start of its recognition to
+   the first keystroke, the number of keyboard injections and the
+   number of key events are reported
+
+Run it from this directory, either with the default script or with a
+script file containing one utterance per line:
+
+    python headless.py
+    python headless.py utterances.txt
+    python headless.py --modes
+    python headless.py --startup
+    python headless.py --lazy
+    python headless.py --soak [iterations]
+
+The third form repeatedly switches between vim's modes and prints the
+mean time of each utterance.  The fourth one loads the command-modules
+in fresh processes, first with an empty grammar cache and then with the
+cache written by the first, see grammarcache.py.  The text engine does
+not compile grammars, so these times leave out compiling for natlink.
+
+Grammars which a command-module builds on first use, see lazygrammar.py,
+are normally built right after the module is imported, and the time that
+takes is reported separately.  With ``--lazy`` they are only built when
+an utterance of the script first matches their context, as in Dragon.
+
+``--soak`` loads, uses and unloads the command-modules again and again,
+as natlink does when their files change, and prints the number of
+grammars and rules loaded, of Python objects and the memory used every
+so often.  All of them should stay flat; grammars which are still
+loaded although their module was unloaded are listed, see
+grammarregistry.py.
+
+Each line of a script file has the form ``executable | title | words``.
+Empty lines and lines starting with "#" are ignored.  Note that the
+text engine expects dictated words in upper case, e.g.
+``notepad | Untitled | insert HELLO WORLD``.
+
+"""
+
+import gc
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+# Helper modules, imported before the command-modules so that their
+#  import time is not attributed to the first command-module.
+helper_modules = ["tracing", "keybatch", "modifiers", "peephole", "executor",
+                  "actioncache", "textinsert", "vimcount", "vimrpc",
+                  "modes", "helpindex", "grammarregistry", "spokenlist",
+                  "gitrefs",
+                  "pathindex", "commandindex", "spokennumbers",
+                  "usagestats", "grammarcache", "contextindex",
+                  "configwatch", "lazygrammar"]
+
+command_modules = ["_dragonall", "_bash", "_python_grammar", "notepad",
+                   "gvim"]
+
+# Default script:  (executable, window title, words).
+default_script = [
+    ("notepad", "Untitled - Notepad", "up four down"),
+    ("notepad", "Untitled - Notepad",
+     "hat space four down and repeat that twenty times"),
+    ("notepad", "Untitled - Notepad", "left seven words backspace three"),
+    ("gvim", "test.py - GVIM", "five down twenty times"),
+    ("gvim", "test.py - GVIM", "window left"),
+    ("gvim", "test.py - GVIM", "execute"),
+    ("gvim", "test.py - GVIM", "write and quit"),
+    ("gvim", "test.py - GVIM", "kay"),
+    ("gvim", "test.py - GVIM", "insert"),
+    ("gvim", "test.py - GVIM", "HELLO WORLD"),
+    ("gvim", "test.py - GVIM", "kay"),
+    ("putty", "user@host: bash", "P. W. D."),
+    ("putty", "user@host: bash", "say HELLO THERE"),
+    ("python", "python", "enable python"),
+    ("python", "python", "function"),
+    ("python", "python", "switch language"),
+    ("explorer", "desktop", "snore"),
+]
+
+# Utterances which switch between vim's modes, see benchmark_modes().
+mode_script = [
+    ("gvim", "test.py - GVIM", "execute"),
+    ("gvim", "test.py - GVIM", "kay"),
+    ("gvim", "test.py - GVIM", "insert"),
+    ("gvim", "test.py - GVIM", "HELLO"),
+    ("gvim", "test.py - GVIM", "kay"),
+    ("gvim", "test.py - GVIM", "up"),
+]
+
+
+#---------------------------------------------------------------------------
+
+def _allow_dragonfly2():
+    # The command-modules require the "dragonfly" distribution, which
+    #  dragonfly2 provides under another name.  Only skip that check if
+    #  dragonfly2 is what is installed.
+    try:
+        import pkg_resources
+        pkg_resources.get_distribution("dragonfly2")
+    except Exception:
+        return
+    require = pkg_resources.require
+
+    def _require(*requirements):
+        requirements = [r for r in requirements
+                        if not str(r).split()[0] == "dragonfly"]
+        if requirements:
+            return require(*requirements)
+        return []
+
+    pkg_resources.require = _require
+
+
+class RecordingKeyboard(object):
+    """
+        Keyboard which records the events of Key and Text actions
+        instead of sending them.
+
+        All other attributes are those of the wrapped *keyboard*.
+    """
+
+    def __init__(self, keyboard):
+        self._keyboard = keyboard
+        self.injections = []
+
+    def send_keyboard_events(self, events):
+        self.injections.append((time.time(), list(events)))
+
+    def clear(self):
+        self.injections = []
+
+    def __getattr__(self, name):
+        return getattr(self._keyboard, name)
+
+
+def install_recorder():
+    """ Replace the keyboard of Key and Text actions by a recorder. """
+    from dragonfly import Key, Text
+    recorder = None
+    for action in (Key, Text):
+        for cls in action.__mro__:
+            keyboard = vars(cls).get("_keyboard")
+            if keyboard is None:
+                continue
+            if not isinstance(keyboard, RecordingKeyboard):
+                if recorder is None:
+                    recorder = RecordingKeyboard(keyboard)
+                cls._keyboard = recorder
+            else:
+                recorder = keyboard
+    return recorder
+
+
+#---------------------------------------------------------------------------
+
+class Utterance(object):
+    """ Result of a recognized utterance. """
+
+    def __init__(self, words, executable, title, started):
+        self.words = words
+        self.executable = executable
+        self.title = title
+        self.started = started
+        self.finished = None
+        self.recognized = False
+        self.injections = []
+
+    @property
+    def latency(self):
+        """ Seconds from recognition to the first keystroke, or None. """
+        if not self.injections:
+            return None
+        return self.injections[0][0] - self.started
+
+    @property
+    def duration(self):
+        return self.finished - self.started
+
+    @property
+    def events(self):
+        return sum(len(events) for _, events in self.injections)
+
+
+class HeadlessSession(object):
+    """
+        Command-modules running on the text engine.
+
+        Output printed by the modules is captured in *output* unless
+        *quiet* is false.  Lazy grammars are built as soon as their
+        module is loaded unless *lazy* is true.
+    """
+
+    def __init__(self, directory=None, quiet=True, lazy=False):
+        self.directory = directory or os.path.dirname(os.path.abspath(
+                                                      __file__))
+        self.quiet = quiet
+        self.lazy = lazy
+        self.output = StringIO()
+        self.modules = {}
+        self._order = []
+        self.load_times = {}
+        self.grammar_counts = {}
+        self.grammars = {}
+        self.lazy_grammars = {}
+        self._imported = {}
+
+        if self.directory not in sys.path:
+            sys.path.insert(0, self.directory)
+        _allow_dragonfly2()
+        from dragonfly import get_engine
+        self.engine = get_engine("text")
+        self.engine.connect()
+        self.keyboard = install_recorder()
+
+    def _capture(self):
+        if not self.quiet:
+            return None
+        stdout, sys.stdout = sys.stdout, self.output
+        return stdout
+
+    def _release(self, stdout):
+        if stdout is not None:
+            sys.stdout = stdout
+
+    def load(self, name):
+        """ Import module *name* and record its load time. """
+        import lazygrammar
+        before = set(self.engine.grammars)
+        lazy_before = set(lazygrammar.instances)
+        stdout = self._capture()
+        try:
+            started = time.time()
+            module = __import__(name)
+            self.load_times[name] = time.time() - started
+        finally:
+            self._release(stdout)
+        self.modules[name] = module
+        self._order.append(name)
+        self.lazy_grammars[name] = [l for l in lazygrammar.instances
+                                    if l not in lazy_before]
+        stubs = set(l.stub for l in self.lazy_grammars[name])
+        self._imported[name] = [g for g in self.engine.grammars
+                                if g not in before and g not in stubs]
+        if not self.lazy:
+            self.build(name)
+        self.update_grammars(name)
+        return module
+
+    def build(self, name):
+        """ Build the lazy grammars of module *name*. """
+        stdout = self._capture()
+        try:
+            for lazy in self.lazy_grammars[name]:
+                lazy.build()
+        finally:
+            self._release(stdout)
+        self.update_grammars(name)
+
+    def build_time(self, name):
+        """ Return the time the lazy grammars of *name* took to build. """
+        times = [l.build_time for l in self.lazy_grammars[name]
+                 if l.build_time is not None]
+        return sum(times) if times else None
+
+    def update_grammars(self, name):
+        """ Bring *grammars* of module *name* up to date. """
+        grammars = list(self._imported[name])
+        for lazy in self.lazy_grammars[name]:
+            grammars.extend(lazy.grammars or [])
+        self.grammars[name] = grammars
+        self.grammar_counts[name] = len(grammars)
+
+    def load_all(self, helpers=helper_modules, modules=command_modules):
+        for name in list(helpers) + list(modules):
+            self.load(name)
+
+    def unload(self, name):
+        """ Unload module *name* so that it can be imported again. """
+        module = self.modules.pop(name)
+        self._order.remove(name)
+        unload = getattr(module, "unload", None)
+        stdout = self._capture()
+        try:
+            if unload is not None:
+                unload()
+        finally:
+            self._release(stdout)
+        sys.modules.pop(name, None)
+
+    def unload_all(self):
+        # The command-modules first, before the helpers they use.
+        for name in reversed(self._order):
+            self.unload(name)
+
+    def utter(self, words, executable="", title=""):
+        """ Recognize *words* and wait for all resulting keystrokes. """
+        from dragonfly.engines.base import MimicFailure
+        import executor
+
+        self.keyboard.clear()
+        stdout = self._capture()
+        result = Utterance(words, executable, title, time.time())
+        try:
+            self.engine.mimic(words.split(), executable=executable,
+                              title=title)
+            result.recognized = True
+        except MimicFailure:
+            pass
+        finally:
+            executor.executor.wait()
+            result.finished = time.time()
+            self._release(stdout)
+        result.injections = self.keyboard.injections
+        return result
+
+    def replay(self, script):
+        return [self.utter(words, executable, title)
+                for executable, title, words in script]
+
+
+#---------------------------------------------------------------------------
+# Benchmark.
+
+def read_script(path):
+    """ Read a script file, see the module documentation. """
+    script = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            executable, title, words = [p.strip() for p in line.split("|", 2)]
+            script.append((executable, title, words))
+    return script
+
+
+def compiled_size(grammar):
+    """
+        Return the size in bytes of *grammar* compiled for Dragon, or
+        None if the natlink compiler is not available.
+    """
+    try:
+        from dragonfly.engines.backend_natlink.compiler import \
+            NatlinkCompiler
+    except ImportError:
+        return None
+    compiled, rule_names = NatlinkCompiler().compile_grammar(grammar)
+    return len(compiled)
+
+
+def _ms(seconds):
+    if seconds is None:
+        return "-"
+    return "%.2f" % (seconds * 1000)
+
+
+def _print_grammars(session):
+    print("Grammar load time and size per module")
+    print("%-16s %10s %10s %9s %6s %9s" % ("module", "load [ms]",
+                                           "build [ms]", "grammars",
+                                           "rules", "size [B]"))
+    for name in command_modules:
+        session.update_grammars(name)
+        grammars = session.grammars[name]
+        sizes = [compiled_size(g) for g in grammars]
+        size = "-" if None in sizes else "%d" % sum(sizes)
+        print("%-16s %10s %10s %9d %6d %9s" % (
+            name, _ms(session.load_times[name]),
+            _ms(session.build_time(name)), session.grammar_counts[name],
+            sum(len(g.rules) for g in grammars), size))
+    helpers = sum(session.load_times[name] for name in helper_modules)
+    print("%-16s %10s" % ("(helpers)", _ms(helpers)))
+    print("")
+
+
+def benchmark(script=default_script, lazy=False):
+    session = HeadlessSession(lazy=lazy)
+    session.load_all()
+
+    # Lazy grammars are built by the script, so only report them after.
+    if not lazy:
+        _print_grammars(session)
+    results = session.replay(script)
+    if lazy:
+        _print_grammars(session)
+    print("Utterances")
+    print("%-44s %11s %10s %6s %7s" % ("words", "first [ms]", "total [ms]",
+                                       "calls", "events"))
+    for result in results:
+        words = "%s: %s" % (result.executable, result.words)
+        if not result.recognized:
+            words = "* " + words
+        print("%-44s %11s %10s %6d %7d" % (words[:44], _ms(result.latency),
+                                           _ms(result.duration),
+                                           len(result.injections),
+                                           result.events))
+
+    if not all(r.recognized for r in results):
+        print("* not recognized")
+    latencies = [r.latency for r in results if r.latency is not None]
+    if latencies:
+        print("")
+        print("first key latency:  mean %s ms, max %s ms"
+              % (_ms(sum(latencies) / len(latencies)), _ms(max(latencies))))
+    print("events per utterance:  mean %.1f"
+          % (sum(r.events for r in results) / float(len(results))))
+
+    import contextindex
+    counts = contextindex.stats
+    print("context matches:  %d evaluated for %d windows, %d avoided;"
+          "  grammars skipped %d times, toggled %d times"
+          % (counts["evaluations"], counts["windows"], counts["avoided"],
+             counts["skipped"], counts["toggled"]))
+
+    session.unload_all()
+    return results
+
+
+def benchmark_modes(repeat=200, script=mode_script):
+    """
+        Replay *script* *repeat* times and print the mean time of each
+        utterance, including switching the modes of gvim.py.
+    """
+    session = HeadlessSession()
+    session.load_all()
+    totals = [0.0] * len(script)
+    for i in range(repeat):
+        for index, result in enumerate(session.replay(script)):
+            if not result.recognized:
+                print("Not recognized: %s" % result.words)
+            totals[index] += result.duration
+
+    print("Mode switches, mean of %d" % repeat)
+    print("%-44s %10s" % ("words", "total [ms]"))
+    for (executable, title, words), total in zip(script, totals):
+        print("%-44s %10s" % (words, _ms(total / repeat)))
+    print("%-44s %10s" % ("(all)", _ms(sum(totals) / repeat)))
+
+    import modes
+    switches = modes.stats["switches"] or 1
+    print("")
+    print("rules switched per mode switch:  %.1f, switching time: mean %s ms"
+          % (modes.stats["rules"] / float(switches),
+             _ms(modes.stats["switch_total"] / switches)))
+    session.unload_all()
+
+
+def _resident_kb():
+    # Resident memory of this process, where /proc is available.
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def benchmark_soak(iterations=200, every=20, script=default_script[:4]):
+    """
+        Load all command-modules, build their grammars, recognize
+        *script* and unload them again, *iterations* times, and print
+        the grammars, rules and objects alive every *every* iterations,
+        while the modules are loaded.
+    """
+    import grammarregistry
+    import helpindex
+
+    session = HeadlessSession()
+    session.load_all(modules=[])
+    print("Reloading all command-modules %d times" % iterations)
+    print("%10s %9s %9s %7s %10s %10s %8s" % ("iteration", "engine",
+          "grammars", "rules", "objects", "rss [kB]", "help"))
+    for i in range(1, iterations + 1):
+        for name in command_modules:
+            session.load(name)
+        session.replay(script)
+        if i == 1 or i % every == 0:
+            gc.collect()
+            counts = grammarregistry.counts().values()
+            print("%10d %9d %9d %7d %10d %10s %8d" % (
+                i, len(session.engine.grammars),
+                sum(g for g, r in counts), sum(r for g, r in counts),
+                len(gc.get_objects()), _resident_kb() or "-",
+                len(helpindex.index._entries)))
+        for name in command_modules:
+            session.unload(name)
+
+    gc.collect()
+    leaked = grammarregistry.leaked()
+    print("")
+    print("grammars loaded %d times, unloaded %d times, %d leaked%s"
+          % (grammarregistry.stats["loads"], grammarregistry.stats["unloads"],
+             len(leaked), "".join("\n  %s" % g.name for g in leaked)))
+    print("uncollectable objects:  %d" % len(gc.garbage))
+    session.unload_all()
+
+
+def load_times(cache=True):
+    """
+        Load all modules and print the time each took to load and to
+        build its lazy grammars, in ms.
+    """
+    session = HeadlessSession()
+    if not cache:
+        import grammarcache
+        grammarcache.enabled = False
+    session.load_all()
+    for name in command_modules:
+        print("%s %s" % (name, _ms(session.load_times[name]
+                                   + (session.build_time(name) or 0))))
+    session.unload_all()
+
+
+def _load_times_process(cache_directory, cache=True):
+    # Load the modules in a fresh interpreter, so that nothing parsed
+    #  by an earlier run is still in memory.
+    environment = dict(os.environ, DRAGONFLY_GRAMMAR_CACHE=cache_directory)
+    arguments = ["--load-times"] + ([] if cache else ["--no-cache"])
+    output = subprocess.Popen([sys.executable, os.path.abspath(__file__)]
+                              + arguments, env=environment,
+                              stdout=subprocess.PIPE).communicate()[0]
+    times = {}
+    for line in output.decode("utf-8").splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[0] in command_modules:
+            times[parts[0]] = float(parts[1])
+    return times
+
+
+def benchmark_startup(runs=3):
+    """
+        Print the load time of each module without the grammar cache,
+        when writing it and when reading it, the best of *runs* fresh
+        processes each.
+    """
+    cache_directory = tempfile.mkdtemp()
+    try:
+        columns = [[], [], []]
+        for i in range(runs):
+            columns[0].append(_load_times_process(cache_directory, False))
+            for name in os.listdir(cache_directory):
+                os.remove(os.path.join(cache_directory, name))
+            columns[1].append(_load_times_process(cache_directory))
+            columns[2].append(_load_times_process(cache_directory))
+    finally:
+        shutil.rmtree(cache_directory)
+
+    print("Module load time [ms], best of %d processes" % runs)
+    print("%-16s %10s %10s %10s" % ("module", "no cache", "writing",
+                                    "cached"))
+    totals = [0.0] * len(columns)
+    for name in command_modules:
+        times = [min(t[name] for t in column) for column in columns]
+        totals = [a + b for a, b in zip(totals, times)]
+        print("%-16s %10.2f %10.2f %10.2f" % tuple([name] + times))
+    print("%-16s %10.2f %10.2f %10.2f" % tuple(["(all)"] + totals))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--modes"]:
+        benchmark_modes()
+    elif sys.argv[1:] == ["--startup"]:
+        benchmark_startup()
+    elif sys.argv[1:] == ["--lazy"]:
+        benchmark(lazy=True)
+    elif sys.argv[1:2] == ["--soak"]:
+        benchmark_soak(*[int(a) for a in sys.argv[2:3]])
+    elif sys.argv[1:2] == ["--load-times"]:
+        load_times(cache="--no-cache" not in sys.argv)
+    elif len(sys.argv) > 1:
+        benchmark(read_script(sys.argv[1]))
+    else:
+        benchmark()
@@ -0,0 +1,179 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Help index of spoken forms
+============================================================================
+
+Entering a vim mode used to print every command of the mode, which is
+slow console I/O right when the user wants to start talking.
+
+Instead, each command-module *register()*s its grammars once after
+loading them.  The spoken forms and the help text of every exported
+rule are built at that point, and nothing is printed until asked for:
+
+ - "show commands" prints the help of all rules which are currently
+   active, e.g. only those of vim's insert mode while in insert mode
+ - "show commands <text>" searches the spoken forms of all loaded
+   modules; forms starting with the text come first, then forms with
+   a word starting with it, then similar forms
+
+The ShowCommandsRule is added to the global grammar in _dragonall.py.
+
+"""
+
+import bisect
+import difflib
+import re
+
+from dragonfly import (Choice, CompoundRule, Dictation, MappingRule,
+                       RuleRef)
+
+
+#---------------------------------------------------------------------------
+
+class HelpEntry(object):
+    """ The spoken forms and help text of one rule. """
+
+    def __init__(self, module, rule):
+        self.module = module
+        self.rule = rule
+        self.forms = sorted(spoken_forms(rule))
+        self.text = "%s (%s):\n  %s" % (rule.name, module,
+                                        "\n  ".join(self.forms))
+
+    @property
+    def active(self):
+        return getattr(self.rule, "active", True)
+
+
+def spoken_forms(rule):
+    """ Return the spoken forms of a MappingRule or CompoundRule. """
+    if isinstance(rule, MappingRule):
+        return list(rule._mapping.keys())
+    spec = getattr(rule, "spec", None) or rule.name
+    # Rules like ``spec = "<command>"`` are all in the Choice.
+    if spec.startswith("<") and spec.endswith(">"):
+        extra = rule._extras.get(spec[1:-1])
+        if isinstance(extra, Choice):
+            return list(extra._choices.keys())
+    # The forms of a repeat rule are in the rules it references.
+    forms = set([spec])
+    for referenced in _referenced_rules(rule.element):
+        if not referenced.exported and isinstance(referenced, MappingRule):
+            forms.update(referenced._mapping.keys())
+    return list(forms)
+
+
+def _referenced_rules(element):
+    if isinstance(element, RuleRef):
+        yield element.rule
+        return
+    for child in element.children:
+        for rule in _referenced_rules(child):
+            yield rule
+
+
+_word_pattern = re.compile(r"[\w.']+")
+_optional_pattern = re.compile(r"\[[^\]]*\]|<[^>]*>")
+
+
+def _search_key(form):
+    # "[<n>] up" is found by searching for "up".
+    return " ".join(_optional_pattern.sub(" ", form.lower()).split())
+
+
+class HelpIndex(object):
+
+    def __init__(self):
+        self._entries = []
+        self._forms = []        # Sorted (search key, form, entry).
+        self._words = []        # Sorted (lower case word, form, entry).
+
+    def register(self, grammar, module=None):
+        """ Add the exported rules of *grammar* to the index. """
+        module = module or grammar.name
+        for rule in grammar.rules:
+            if not rule.exported:
+                continue
+            entry = HelpEntry(module, rule)
+            self._entries.append(entry)
+            for form in entry.forms:
+                self._forms.append((_search_key(form), form, entry))
+                for word in set(_word_pattern.findall(form.lower())):
+                    self._words.append((word, form, entry))
+        self._forms.sort(key=lambda t: t[:2])
+        self._words.sort(key=lambda t: t[:2])
+
+    def unregister(self, grammar):
+        """ Remove the rules of *grammar* from the index. """
+        rules = set(id(rule) for rule in grammar.rules)
+        keep = lambda e: id(e.rule) not in rules
+        self._entries = [e for e in self._entries if keep(e)]
+        self._forms = [t for t in self._forms if keep(t[2])]
+        self._words = [t for t in self._words if keep(t[2])]
+
+    def active_help(self):
+        """ Return the help text of all active rules. """
+        return "\n".join(e.text for e in self._entries if e.active)
+
+    def search(self, query, limit=20):
+        """ Return (form, entry) pairs matching *query*, best first. """
+        query = query.lower().strip()
+        results = []
+        seen = set()
+
+        def add(form, entry):
+            if (form, id(entry)) not in seen:
+                seen.add((form, id(entry)))
+                results.append((form, entry))
+
+        for table in (self._forms, self._words):
+            index = bisect.bisect_left(table, (query,))
+            while (index < len(table) and len(results) < limit
+                   and table[index][0].startswith(query)):
+                add(table[index][1], table[index][2])
+                index += 1
+        if len(results) < limit:
+            forms = dict((t[0], t) for t in self._forms)
+            for match in difflib.get_close_matches(query, list(forms),
+                                                   limit - len(results)):
+                add(forms[match][1], forms[match][2])
+        return results[:limit]
+
+    def search_text(self, query, limit=20):
+        results = self.search(query, limit)
+        if not results:
+            return "No commands match %r" % query
+        return "\n".join("%-40s %s (%s)" % (form, entry.rule.name,
+                                            entry.module)
+                         for form, entry in results)
+
+
+index = HelpIndex()
+
+
+def register(grammar, module=None):
+    index.register(grammar, module)
+
+
+def unregister(grammar):
+    index.unregister(grammar)
+
+
+#---------------------------------------------------------------------------
+
+class ShowCommandsRule(CompoundRule):
+    """ Rule which prints the active commands or searches all. """
+
+    spec = "show commands [<text>]"
+    extras = [Dictation("text")]
+
+    def _process_recognition(self, node, extras):
+        if "text" in extras:
+            print(index.search_text("%s" % extras["text"]))
+        else:
+            print(index.active_help())
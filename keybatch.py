@@ -0,0 +1,338 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Batched keystroke emission
+============================================================================
+
+The repeat rules in notepad.py and gvim.py used to call execute() once
+per action per repetition.  With a sequence of 16 actions repeated 100
+times that meant 1,600 separate keyboard injections.
+
+This module flattens a recognized sequence of actions into a list of
+*items* before anything is sent to the keyboard:
+
+ - ``(KEY, spec)`` -- a fully substituted Key spec, e.g. ``"up:4"``
+ - ``(TEXT, text)`` -- a fully substituted Text spec which could not
+   be expressed as keystrokes
+ - ``(ACTION, (action, data))`` -- any other action (Function, Mimic,
+   ...), which is executed as-is with its bound data
+
+Adjacent KEY items are then joined into a single comma-separated Key
+spec, so that a whole ``sequence x count`` stream made up of keystrokes
+is sent with one injection call.  Items are never reordered; an ACTION
+item simply ends the current run of keystrokes.
+
+"""
+
+import re
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+
+from dragonfly import Key, Text
+
+from tracing import span
+
+
+KEY    = "key"
+TEXT   = "text"
+ACTION = "action"
+
+
+#---------------------------------------------------------------------------
+# Written characters and the key names which type them.  Text specs that
+#  consist only of these characters are folded into the surrounding Key
+#  run.  Note that 'semicolon' is not a valid key name for Key().
+
+character_keys = {
+    " ":  "space",     "\t": "tab",        "\n": "enter",
+    "&":  "ampersand", "'":  "squote",     "*":  "asterisk",
+    "@":  "at",        "\\": "backslash",  "`":  "backtick",
+    "|":  "bar",       "^":  "caret",      ":":  "colon",
+    ",":  "comma",     "$":  "dollar",     ".":  "dot",
+    '"':  "dquote",    "=":  "equal",      "!":  "exclamation",
+    "#":  "hash",      "-":  "minus",      "%":  "percent",
+    "+":  "plus",      "?":  "question",   "/":  "slash",
+    "~":  "tilde",     "_":  "underscore",
+    "<":  "langle",    "{":  "lbrace",     "[":  "lbracket",
+    "(":  "lparen",    ">":  "rangle",     "}":  "rbrace",
+    "]":  "rbracket",  ")":  "rparen",
+}
+for character in "abcdefghijklmnopqrstuvwxyz":
+    character_keys[character] = character
+    character_keys[character.upper()] = character.upper()
+for character in "0123456789":
+    character_keys[character] = character
+
+
+# The reverse mapping, including a few alternative key names.
+key_characters = dict((name, character)
+                      for character, name in character_keys.items())
+key_characters["apostrophe"] = "'"
+key_characters["hyphen"] = "-"
+
+
+def text_to_key_spec(text):
+    """
+        Return a Key spec which types *text*, or None if *text*
+        contains a character without a known key name.
+    """
+    names = []
+    for character in text:
+        name = character_keys.get(character)
+        if name is None:
+            return None
+        names.append(name)
+    return ", ".join(names)
+
+
+#---------------------------------------------------------------------------
+# Key spec elements.
+
+_element_pattern = re.compile(r"^(?:([acsw]+)-)?(\w+)(?::(\d+|up|down))?$")
+
+
+def split_elements(spec):
+    """ Return the comma-separated elements of a Key spec. """
+    return [element.strip() for element in spec.split(",")]
+
+
+def parse_element(element):
+    """
+        Parse a single Key spec element into a tuple
+        ``(modifiers, name, repeat, direction)``.
+
+        *direction* is "up" or "down" for elements like "shift:up"
+        and None otherwise.  Returns None for elements with pauses
+        or any other syntax this module does not handle.
+    """
+    match = _element_pattern.match(element)
+    if not match:
+        return None
+    modifiers, name, suffix = match.groups()
+    if suffix in ("up", "down"):
+        return modifiers or "", name, 1, suffix
+    return modifiers or "", name, int(suffix or 1), None
+
+
+def format_element(modifiers, name, repeat=1, direction=None):
+    """ The inverse of parse_element(). """
+    if modifiers:
+        name = modifiers + "-" + name
+    if direction:
+        return "%s:%s" % (name, direction)
+    if repeat != 1:
+        return "%s:%d" % (name, repeat)
+    return name
+
+
+def count_events(items):
+    """ Return the number of keyboard events *items* will send. """
+    total = 0
+    for kind, value in items:
+        if kind == TEXT:
+            total += 2 * len(value)
+        elif kind == KEY:
+            for element in split_elements(value):
+                parsed = parse_element(element)
+                if parsed is None:
+                    total += 2
+                    continue
+                modifiers, name, repeat, direction = parsed
+                if direction:
+                    total += 1
+                else:
+                    total += 2 * len(modifiers) + 2 * repeat
+    return total
+
+
+#---------------------------------------------------------------------------
+# Flattening of actions into items.
+
+def unbind(action, data):
+    """ Return the unwrapped *action* and the data it is bound to. """
+    # Actions returned by MappingRule.value() carry the rule's extras.
+    #  Older dragonfly versions store them on a copy of the action,
+    #  newer ones wrap the action in a BoundAction.
+    if hasattr(action, "_action") and hasattr(action, "_data"):
+        bound = dict(data or {})
+        bound.update(action._data or {})
+        return unbind(action._action, bound)
+    bound = getattr(action, "_bound_data", None)
+    if bound:
+        data = bound
+    return action, data
+
+
+def resolve_spec(action, data):
+    """ Return the spec of a Key or Text *action* substituted with *data*. """
+    if action._static or not data:
+        return action._spec
+    try:
+        return action._spec % data
+    except KeyError:
+        return None
+
+
+def _flatten_action(action, data, items):
+    action, data = unbind(action, data)
+
+    series = getattr(action, "_actions", None)
+    if series is not None:
+        for child in series:
+            _flatten_action(child, data, items)
+        return
+
+    spec = None
+    if isinstance(action, (Key, Text)):
+        spec = resolve_spec(action, data)
+    if spec is None or getattr(action, "_autofmt", False):
+        items.append((ACTION, (action, data)))
+    elif isinstance(action, Key):
+        if spec.strip():
+            items.append((KEY, spec))
+    else:
+        key_spec = text_to_key_spec(spec)
+        if key_spec is not None:
+            if key_spec:
+                items.append((KEY, key_spec))
+        else:
+            items.append((TEXT, spec))
+
+
+def flatten(actions, data=None):
+    """ Return the list of items for the given sequence of *actions*. """
+    items = []
+    with span("substitute"):
+        for action in actions:
+            _flatten_action(action, data, items)
+    return items
+
+
+def keys_to_text(actions, data=None):
+    """
+        Return the text typed by *actions*, or None if they do more
+        than typing characters.  Used to turn spelled letters into a
+        single Text action.
+    """
+    characters = []
+    for kind, value in flatten(actions, data):
+        if kind == TEXT:
+            characters.append(value)
+            continue
+        if kind != KEY:
+            return None
+        for element in split_elements(value):
+            parsed = parse_element(element)
+            if parsed is None or parsed[0] or parsed[3]:
+                return None
+            character = key_characters.get(parsed[1])
+            if character is None:
+                return None
+            characters.append(character * parsed[2])
+    return "".join(characters)
+
+
+def compile_repeat(actions, count=1, trailer=None, passes=()):
+    """
+        Return the items for executing *actions* *count* times,
+        followed by the optional *trailer* action.
+
+        Each of the optional *passes* is a function which takes a
+        list of items and returns an equivalent, cheaper one.  They
+        are applied in order to the complete stream.
+    """
+    items = flatten(actions) * count
+    if trailer is not None:
+        items.extend(flatten([trailer]))
+    with span("optimize"):
+        for optimize in passes:
+            items = optimize(items)
+    return items
+
+
+#---------------------------------------------------------------------------
+# Cache of parsed Key actions, keyed by their fully substituted spec.
+#  Parsing a spec into keyboard events is the expensive part of executing
+#  a Key action, and the same few specs are sent over and over again.
+#  See actioncache.py for validating and pre-warming it at load time.
+
+key_cache_size = 1024
+key_cache_stats = {"hits": 0, "misses": 0}
+_key_cache = OrderedDict() if OrderedDict else {}
+_key_cache_lock = threading.Lock()
+
+
+def key_action(spec):
+    """ Return a static Key action for *spec*, parsing it only once. """
+    with _key_cache_lock:
+        action = _key_cache.pop(spec, None)
+    if action is None:
+        key_cache_stats["misses"] += 1
+        action = Key(spec, static=True)
+    else:
+        key_cache_stats["hits"] += 1
+    with _key_cache_lock:
+        _key_cache[spec] = action
+        while len(_key_cache) > key_cache_size:
+            if OrderedDict:
+                _key_cache.popitem(last=False)
+            else:
+                _key_cache.popitem()
+    return action
+
+
+#---------------------------------------------------------------------------
+# Emission of items.
+
+def merge_runs(items):
+    """ Join adjacent KEY items and adjacent TEXT items. """
+    merged = []
+    for kind, value in items:
+        if merged and kind != ACTION and merged[-1][0] == kind:
+            separator = ", " if kind == KEY else ""
+            merged[-1] = (kind, merged[-1][1] + separator + value)
+        else:
+            merged.append((kind, value))
+    return merged
+
+
+def emit(items, chunk_size=None, stopped=None):
+    """
+        Send *items* to the keyboard, one injection call per run.
+
+        If *stopped* is given, runs of keystrokes are sent in chunks
+        of at most *chunk_size* elements and *stopped* is called
+        before each chunk and each other item.  Emission ends as
+        soon as it returns true.
+    """
+    for kind, value in merge_runs(items):
+        if stopped is not None and stopped():
+            return
+        if kind == KEY:
+            if stopped is None or not chunk_size:
+                key_action(value).execute()
+                continue
+            elements = split_elements(value)
+            for start in range(0, len(elements), chunk_size):
+                if start and stopped():
+                    return
+                chunk = elements[start:start + chunk_size]
+                key_action(", ".join(chunk)).execute()
+        elif kind == TEXT:
+            Text(value, static=True).execute()
+        else:
+            action, data = value
+            action.execute(data)
+
+
+def execute_repeat(actions, count=1, trailer=None, passes=()):
+    """ Execute *actions* *count* times as a single batched stream. """
+    emit(compile_repeat(actions, count, trailer, passes))
@@ -0,0 +1,191 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Grammars built on first use
+============================================================================
+
+gvim.py, notepad.py and _bash.py each only apply to one kind of window,
+but building their rules and loading their grammars into the engine
+used to happen when natlink loaded them, for all of them, even if that
+kind of window was never used in a session.  With this module a
+command-module only loads a small stub grammar with its context:
+
+    def build_grammar():
+        grammar = Grammar("gvim", context=gvim_context)
+        ...
+        grammar.load()
+        add_grammar(grammar, __name__)
+        return [grammar]
+
+    lazy_grammar = LazyGrammar("gvim", gvim_context, build_grammar,
+                               __name__)
+
+The first time an utterance starts while the context matches, the stub
+calls *build_grammar()*, which creates and loads the real grammars, and
+lets them process the start of that utterance.  From then on the stub
+is disabled.  Whether the new grammars can already recognize that first
+utterance depends on the engine: the text engine of headless.py
+includes them, Dragon may only use them from the next utterance on.
+
+If *build_grammar()* raises, the grammars it already loaded are unloaded
+again and the stub is disabled all the same, so that the build is not
+attempted again at every utterance; reload the command-module to retry.
+
+The command-module still owns and unloads the grammars it built, which
+it adds to the registry of grammarregistry.py like all others.  The
+stub is added there too, for the command-module given as *module*.  The
+command-module's *unload()* also calls *LazyGrammar.unload()* to remove
+the stub.
+Commands only appear in the help index of helpindex.py once their
+grammar has been built.
+
+To avoid the delay on first use, the grammars can be built while the
+user is not speaking: if *prewarm_interval* is set, by default from the
+DRAGONFLY_PREWARM environment variable, one grammar which has not been
+built yet is built every *prewarm_interval* seconds after loading.  The
+engine's timers call back between utterances with natlink; the text
+engine calls them from a thread.
+
+"""
+
+import os
+import time
+
+from dragonfly import Rule, get_engine
+from dragonfly.grammar.elements_basic import Impossible
+
+from contextindex import IndexedGrammar
+from grammarregistry import registry, unload_all
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+prewarm_interval = os.environ.get("DRAGONFLY_PREWARM")
+if prewarm_interval:
+    prewarm_interval = float(prewarm_interval)
+else:
+    prewarm_interval = None
+
+stats = {
+    "stubs":     0,     # Stub grammars loaded.
+    "builds":    0,     # Grammars built on first use.
+    "prewarms":  0,     # Grammars built by the prewarm timer.
+    "failures":  0,     # Builds which raised.
+}
+
+# All lazy grammars which have not been unloaded, in load order.
+instances = []
+
+
+#---------------------------------------------------------------------------
+
+class _StubGrammar(IndexedGrammar):
+    # Stands in for the grammars of a LazyGrammar until they are built.
+
+    def __init__(self, lazy):
+        IndexedGrammar.__init__(self, "%s (not built)" % lazy.name,
+                                context=lazy.context)
+        self.lazy = lazy
+        # A grammar needs an exported rule to be loaded.
+        self.add_rule(Rule(name="stub", element=Impossible(),
+                           exported=True))
+
+    def _process_begin(self, executable, title, handle):
+        if self.lazy.built:
+            return
+        stats["builds"] += 1
+        for grammar in self.lazy.build():
+            grammar.process_begin(executable, title, handle)
+
+
+class LazyGrammar(object):
+    """
+        The grammars of a command-module, built by calling *build*
+        when *context* first matches at the start of an utterance.
+        *build* must load them, add them to the grammar registry and
+        return a list of them.  The stub is registered for *module*.
+    """
+
+    def __init__(self, name, context, build, module=None):
+        self.name = name
+        self.context = context
+        self._build = build
+        self.grammars = None
+        self.build_time = None
+        self.stub = _StubGrammar(self)
+        self.stub.load()
+        if module is not None:
+            registry.add(self.stub, module)
+        stats["stubs"] += 1
+        instances.append(self)
+        if prewarm_interval is not None:
+            start_prewarm(prewarm_interval)
+
+    @property
+    def built(self):
+        return self.grammars is not None
+
+    def build(self):
+        """ Build and load the grammars, if not done yet. """
+        if self.grammars is None:
+            started = time.time()
+            loaded = registry.grammars()
+            try:
+                self.grammars = list(self._build())
+            except Exception as e:
+                print("Building %s failed: %s" % (self.name, e))
+                unload_all([g for g in registry.grammars()
+                            if g not in loaded])
+                self.grammars = []
+                stats["failures"] += 1
+            self.build_time = time.time() - started
+            self.stub.disable()
+        return self.grammars
+
+    def unload(self):
+        """ Unload the stub.  The built grammars are not unloaded. """
+        if self in instances:
+            instances.remove(self)
+        if self.stub.loaded:
+            unload_all([self.stub])
+            self.stub.lazy = None
+
+
+def build_all():
+    """ Build all lazy grammars which have not been built yet. """
+    for lazy in list(instances):
+        lazy.build()
+
+
+#---------------------------------------------------------------------------
+# Prewarming.
+
+_timer = None
+
+
+def _prewarm():
+    for lazy in list(instances):
+        if not lazy.built:
+            lazy.build()
+            stats["prewarms"] += 1
+            return
+    stop_prewarm()
+
+
+def start_prewarm(interval):
+    """ Build one lazy grammar every *interval* seconds until all are. """
+    global _timer
+    if _timer is None:
+        _timer = get_engine().create_timer(_prewarm, interval)
+
+
+def stop_prewarm():
+    global _timer
+    if _timer is not None:
+        _timer.stop()
+        _timer = None
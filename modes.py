@@ -0,0 +1,92 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Modes of a grammar
+============================================================================
+
+gvim.py used to put each of vim's modes into grammars of its own and to
+switch modes by enabling and disabling whole grammars.  Each switch made
+the engine deactivate every rule of the old grammars and activate every
+rule of the new one, right when the user wanted to start typing.
+
+A *ModeSwitcher* instead switches between sets of rules of a single
+grammar.  Only the rules which differ between the old and the new mode
+are enabled or disabled; rules shared by several modes stay active.
+
+Every switch updates the counters in *stats*.  Run ``python headless.py
+--modes`` to time whole mode-switching utterances.
+
+"""
+
+import time
+
+
+#---------------------------------------------------------------------------
+
+stats = {
+    "switches":     0,      # Mode switches.
+    "rules":        0,      # Rules enabled or disabled by switches.
+    "switch_total": 0.0,    # Total seconds spent switching.
+    "switch_max":   0.0,    # Longest switch.
+}
+
+
+class ModeSwitcher(object):
+    """
+        Enables the rules of one mode at a time.
+
+        *modes* maps the name of each mode to the rules active in it.
+        All rules must belong to the same grammar.  The rules of all
+        other modes are disabled right away, so that *initial* is the
+        active mode once the grammar is loaded.
+    """
+
+    def __init__(self, modes, initial):
+        self.modes = dict((name, list(rules))
+                          for name, rules in modes.items())
+        self.mode = initial
+        active = self._ids(initial)
+        for rule in self.rules():
+            if id(rule) not in active:
+                rule.disable()
+
+    def rules(self):
+        """ Return all rules of all modes, each once. """
+        seen = set()
+        rules = []
+        for name in sorted(self.modes):
+            for rule in self.modes[name]:
+                if id(rule) not in seen:
+                    seen.add(id(rule))
+                    rules.append(rule)
+        return rules
+
+    def switch(self, mode):
+        """ Make *mode* the active mode. """
+        if mode == self.mode:
+            return
+        started = time.time()
+        old, new = self._ids(self.mode), self._ids(mode)
+        changed = 0
+        for rule in self.modes[self.mode]:
+            if id(rule) not in new:
+                rule.disable()
+                changed += 1
+        for rule in self.modes[mode]:
+            if id(rule) not in old:
+                rule.enable()
+                changed += 1
+        self.mode = mode
+
+        elapsed = time.time() - started
+        stats["switches"] += 1
+        stats["rules"] += changed
+        stats["switch_total"] += elapsed
+        stats["switch_max"] = max(stats["switch_max"], elapsed)
+
+    def _ids(self, mode):
+        return set(id(rule) for rule in self.modes[mode])
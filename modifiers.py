@@ -0,0 +1,137 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Modifier-state tracker
+============================================================================
+
+notepad.py and gvim.py send ``release = Key("shift:up, ctrl:up")``
+before many commands and after every repeat rule recognition, just in
+case "hold shift" or "hold control" was said earlier.  Usually nothing
+is held and those key-up events are wasted.
+
+This module remembers which modifiers were pressed with an explicit
+``"...:down"`` element, shared by all command-modules.  Its *track*
+pass for keybatch.py drops each ``"...:up"`` element for a modifier
+that is not held, so a release only sends something when it has to.
+Modifiers which were held keep being released exactly as before.
+
+The ReleaseAll action always releases the given modifiers, even if
+this module believes none are held.  Use it for every command the user
+says to release a modifier, e.g. "release shift" or "release all", so
+that a key which got stuck for other reasons can still be released.
+
+*track* runs when a batch is compiled, but it does not change the
+modifier state itself.  If the batch leaves the modifiers in another
+state than they were in, it ends with an action which records that
+state, so the state only changes once the whole batch has been sent.
+A batch which is rejected or cancelled before that changes nothing;
+cancelling releases all modifiers anyway, see executor.py.
+
+"""
+
+from dragonfly import ActionBase, Key
+
+from keybatch import ACTION, KEY, parse_element, split_elements
+
+
+#---------------------------------------------------------------------------
+# Modifier names as used in Key specs, and the modifier they refer to.
+
+modifier_names = {
+    "shift":   "shift",
+    "ctrl":    "ctrl",
+    "control": "ctrl",
+    "alt":     "alt",
+    "win":     "win",
+}
+
+held = set()       # Modifiers currently held down by our key events.
+
+stats = {
+    "releases_sent":    0,  # Modifier key-up events sent.
+    "releases_skipped": 0,  # Modifier key-up events found unnecessary.
+}
+
+
+#---------------------------------------------------------------------------
+
+class ReleaseAll(ActionBase):
+    """ Action which releases the given modifiers unconditionally. """
+
+    def __init__(self, names=("shift", "ctrl")):
+        ActionBase.__init__(self)
+        self._names = tuple(names)
+        self._str = ", ".join(self._names)
+
+    def key_spec(self):
+        return ", ".join("%s:up" % name for name in self._names)
+
+    def _execute(self, data=None):
+        stats["releases_sent"] += len(self._names)
+        Key(self.key_spec()).execute()
+        for name in self._names:
+            held.discard(modifier_names.get(name, name))
+
+
+class _SetHeld(ActionBase):
+    # Action which records the modifiers held once a batch was sent.
+
+    def __init__(self, modifiers):
+        ActionBase.__init__(self)
+        self._modifiers = frozenset(modifiers)
+        self._str = ", ".join(sorted(self._modifiers))
+
+    def _execute(self, data=None):
+        held.clear()
+        held.update(self._modifiers)
+
+
+def track(items):
+    """
+        Pass for keybatch.py which drops releases of modifiers that
+        are not held, and records the modifier state after *items*
+        have been sent.
+    """
+    result = []
+    state = set(held)
+
+    def append(element):
+        if result and result[-1][0] == KEY:
+            result[-1] = (KEY, result[-1][1] + ", " + element)
+        else:
+            result.append((KEY, element))
+
+    for kind, value in items:
+        if kind == ACTION and isinstance(value[0], ReleaseAll):
+            release_all = value[0]
+            for name in release_all._names:
+                state.discard(modifier_names.get(name, name))
+            stats["releases_sent"] += len(release_all._names)
+            append(release_all.key_spec())
+            continue
+        if kind != KEY:
+            result.append((kind, value))
+            continue
+
+        for element in split_elements(value):
+            parsed = parse_element(element)
+            if parsed and not parsed[0] and parsed[1] in modifier_names:
+                modifier = modifier_names[parsed[1]]
+                direction = parsed[3]
+                if direction == "down":
+                    state.add(modifier)
+                elif direction == "up":
+                    if modifier not in state:
+                        stats["releases_skipped"] += 1
+                        continue
+                    state.discard(modifier)
+                    stats["releases_sent"] += 1
+            append(element)
+
+    if state != held:
+        result.append((ACTION, (_SetHeld(state), None)))
+    return result
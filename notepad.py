@@ -71,214 +71,375 @@ except ImportError:
 
 from dragonfly import *
 
+from actioncache import prewarm, validate
+from configwatch import (ConfigWatcher, mapping_changed, reload_grammars,
+                         replace_rule)
+from contextindex import IndexedGrammar
+from executor import StopRule, submit
+from grammarcache import ModuleCache
+from grammarregistry import add_grammar, unload_grammars
+from helpindex import register
+from keybatch import compile_repeat
+from lazygrammar import LazyGrammar
+from modifiers import ReleaseAll, track
+from peephole import optimize
+from spokennumbers import NumberRef, add_number_rules
+from textinsert import InsertText
+from tracing import traced
+from usagestats import (OnDemandRule, record, repeat_max, save,
+                        sequence_max, split_mapping)
+
+
+# Spoken-forms, Key specs and the compiled grammar are read from a cache
+#  instead of being parsed and compiled again, until this file changes.
+#  See grammarcache.py.
+cache = ModuleCache("notepad", __file__)
+
+with cache:
+    #-----------------------------------------------------------------------
+    # Here we globally defined the release action which releases all
+    #  modifier-keys used within this grammar.  It is defined here
+    #  because this functionality is used in many different places.
+    #  Note that it is harmless to release ("...:up") a key multiple
+    #  times or when that key is not held down at all.  When executed
+    #  as part of a repeat rule, releases of keys which are not held
+    #  down are not sent at all.  See modifiers.py.
+
+    release = Key("shift:up, ctrl:up")
+
+
+    #-----------------------------------------------------------------------
+    # Set up this module's configuration.
 
-#---------------------------------------------------------------------------
-# Here we globally defined the release action which releases all
-#  modifier-keys used within this grammar.  It is defined here
-#  because this functionality is used in many different places.
-#  Note that it is harmless to release ("...:up") a key multiple
-#  times or when that key is not held down at all.
-
-release = Key("shift:up, ctrl:up")
-
-
-#---------------------------------------------------------------------------
-# Set up this module's configuration.
-
-config            = Config("multi edit")
-config.cmd        = Section("Language section")
-config.cmd.map    = Item(
     # Here we define the *default* command map.  If you would like to
     #  modify it to your personal taste, please *do not* make changes
     #  here.  Instead change the *config file* called "_multiedit.txt".
-    {
-     # Spoken-form    ->    ->    ->     Action object
-     "[<n>] up":                         Key("up:%(n)d"),
-     "[<n>] down":                       Key("down:%(n)d"),
-     "[<n>] left":                       Key("left:%(n)d"),
-     "[<n>] right":                      Key("right:%(n)d"),
-     "[<n>] go up":                    Key("pgup:%(n)d"),
-     "[<n>] go down":                  Key("pgdown:%(n)d"),
-     "up <n> (page | pages)":            Key("pgup:%(n)d"),
-     "down <n> (page | pages)":          Key("pgdown:%(n)d"),
-     "left <n> (word | words)":          Key("c-left:%(n)d"),
-     "right <n> (word | words)":         Key("c-right:%(n)d"),
-     "hat":                             Key("home"),
-     "dollar":                              Key("end"),
-     "doc home":                         Key("c-home"),
-     "doc end":                          Key("c-end"),
-
-     "space [<n>]":                      release + Key("space:%(n)d"),
-     "enter [<n>]":                      release + Key("enter:%(n)d"),
-     "tab [<n>]":                        Key("tab:%(n)d"),
-     "D. [<n>]":                     release + Key("del:%(n)d"),
-     "D. [<n> | this] (line|lines)": release + Key("home, s-down:%(n)d, del"),
-     "backspace [<n>]":                  release + Key("backspace:%(n)d"),
-     "pop up":                           release + Key("apps"),
-
-     "paste":                            release + Key("c-v"),
-     "duplicate <n>":                    release + Key("c-c, c-v:%(n)d"),
-     "copy":                             release + Key("c-c"),
-     "cut":                              release + Key("c-x"),
-     "select all":                       release + Key("c-a"),
-     "[hold] shift":                     Key("shift:down"),
-     "release shift":                    Key("shift:up"),
-     "[hold] control":                   Key("ctrl:down"),
-     "release control":                  Key("ctrl:up"),
-     "release [all]":                    release,
-
-     "save file":	                 Key("c-s"),
-
-     "mimic <text>":                     release + Mimic(extra="text"),
-    },
-    namespace={
-     "Key":   Key,
-     "Text":  Text,
-    }
-)
-namespace = config.load()
-
-#---------------------------------------------------------------------------
-# Here we prepare the list of formatting functions from the config file.
-
-# Retrieve text-formatting functions from this module's config file.
-#  Each of these functions must have a name that starts with "format_".
-format_functions = {}
-if namespace:
-    for name, function in namespace.items():
-     if name.startswith("format_") and callable(function):
-        spoken_form = function.__doc__.strip()
-
-        # We wrap generation of the Function action in a function so
-        #  that its *function* variable will be local.  Otherwise it
-        #  would change during the next iteration of the namespace loop.
-        def wrap_function(function):
-            def _function(dictation):
-                formatted_text = function(dictation)
-                Text(formatted_text).execute()
-            return Function(_function)
-
-        action = wrap_function(function)
-        format_functions[spoken_form] = action
-
-
-# Here we define the text formatting rule.
-# The contents of this rule were built up from the "format_*"
-#  functions in this module's config file.
-if format_functions:
-    class FormatRule(MappingRule):
-
-        mapping  = format_functions
-        extras   = [Dictation("dictation")]
-
-else:
-    FormatRule = None
-
-
-#---------------------------------------------------------------------------
-# Here we define the keystroke rule.
-
-# This rule maps spoken-forms to actions.  Some of these 
-#  include special elements like the number with name "n" 
-#  or the dictation with name "text".  This rule is not 
-#  exported, but is referenced by other elements later on.
-#  It is derived from MappingRule, so that its "value" when 
-#  processing a recognition will be the right side of the 
-#  mapping: an action.
-# Note that this rule does not execute these actions, it
-#  simply returns them when it's value() method is called.
-#  For example "up 4" will give the value Key("up:4").
-# More information about Key() actions can be found here:
-#  http://dragonfly.googlecode.com/svn/trunk/dragonfly/documentation/actionkey.html
-class KeystrokeRule(MappingRule):
-
-    exported = False
-
-    mapping  = config.cmd.map
-    extras   = [
-                IntegerRef("n", 1, 100),
-                Dictation("text"),
-                Dictation("text2"),
-               ]
-    defaults = {
-                "n": 1,
-               }
-    # Note: when processing a recognition, the *value* of 
-    #  this rule will be an action object from the right side 
-    #  of the mapping given above.  This is default behavior 
-    #  of the MappingRule class' value() method.  It also 
-    #  substitutes any "%(...)." within the action spec
-    #  with the appropriate spoken values.
-
-
-#---------------------------------------------------------------------------
-# Here we create an element which is the sequence of keystrokes.
-
-# First we create an element that references the keystroke rule.
-#  Note: when processing a recognition, the *value* of this element
-#  will be the value of the referenced rule: an action.
-alternatives = []
-alternatives.append(RuleRef(rule=KeystrokeRule()))
-if FormatRule:
-    alternatives.append(RuleRef(rule=FormatRule()))
-single_action = Alternative(alternatives)
-
-# Second we create a repetition of keystroke elements.
-#  This element will match anywhere between 1 and 16 repetitions
-#  of the keystroke elements.  Note that we give this element
-#  the name "sequence" so that it can be used as an extra in
-#  the rule definition below.
-# Note: when processing a recognition, the *value* of this element
-#  will be a sequence of the contained elements: a sequence of
-#  actions.
-sequence = Repetition(single_action, min=1, max=16, name="sequence")
-
-
-#---------------------------------------------------------------------------
-# Here we define the top-level rule which the user can say.
-
-# This is the rule that actually handles recognitions. 
-#  When a recognition occurs, it's _process_recognition() 
-#  method will be called.  It receives information about the 
-#  recognition in the "extras" argument: the sequence of 
-#  actions and the number of times to repeat them.
-class RepeatRule(CompoundRule):
-
-    # Here we define this rule's spoken-form and special elements.
-    spec     = "<sequence> [[[and] repeat [that]] <n> times]"
-    extras   = [
-                sequence,                 # Sequence of actions defined above.
-                IntegerRef("n", 1, 100),  # Times to repeat the sequence.
-               ]
-    defaults = {
-                "n": 1,                   # Default repeat count.
-               }
-
-    # This method gets called when this rule is recognized.
-    # Arguments:
-    #  - node -- root node of the recognition parse tree.
-    #  - extras -- dict of the "extras" special elements:
-    #     . extras["sequence"] gives the sequence of actions.
-    #     . extras["n"] gives the repeat count.
-    def _process_recognition(self, node, extras):
-        sequence = extras["sequence"]   # A sequence of actions.
-        count = extras["n"]             # An integer repeat count.
-        for i in range(count):
-            for action in sequence:
-                action.execute()
-        release.execute()
-
-
-#---------------------------------------------------------------------------
-# Create and load this module's grammar.
-
-notepad_context = AppContext(executable="notepad")
-grammar = Grammar("multi edit", context=notepad_context)
-grammar.add_rule(RepeatRule())    # Add the top-level rule.
-grammar.load()                    # Load the grammar.
+    default_map = {
+         # Spoken-form    ->    ->    ->     Action object
+         "[<n>] up":                         Key("up:%(n)d"),
+         "[<n>] down":                       Key("down:%(n)d"),
+         "[<n>] left":                       Key("left:%(n)d"),
+         "[<n>] right":                      Key("right:%(n)d"),
+         "[<n>] go up":                    Key("pgup:%(n)d"),
+         "[<n>] go down":                  Key("pgdown:%(n)d"),
+         "up <n> (page | pages)":            Key("pgup:%(n)d"),
+         "down <n> (page | pages)":          Key("pgdown:%(n)d"),
+         "left <n> (word | words)":          Key("c-left:%(n)d"),
+         "right <n> (word | words)":         Key("c-right:%(n)d"),
+         "hat":                             Key("home"),
+         "dollar":                              Key("end"),
+         "doc home":                         Key("c-home"),
+         "doc end":                          Key("c-end"),
+
+         "space [<n>]":                      release + Key("space:%(n)d"),
+         "enter [<n>]":                      release + Key("enter:%(n)d"),
+         "tab [<n>]":                        Key("tab:%(n)d"),
+         "D. [<n>]":                     release + Key("del:%(n)d"),
+         "D. [<n> | this] (line|lines)":
+                                     release + Key("home, s-down:%(n)d, del"),
+         "backspace [<n>]":                  release + Key("backspace:%(n)d"),
+         "pop up":                           release + Key("apps"),
+
+         "paste":                            release + Key("c-v"),
+         "duplicate <n>":                    release + Key("c-c, c-v:%(n)d"),
+         "copy":                             release + Key("c-c"),
+         "cut":                              release + Key("c-x"),
+         "select all":                       release + Key("c-a"),
+         "[hold] shift":                     Key("shift:down"),
+         "release shift":                    ReleaseAll(("shift",)),
+         "[hold] control":                   Key("ctrl:down"),
+         "release control":                  ReleaseAll(("ctrl",)),
+         "release [all]":                    ReleaseAll(),
+
+         "save file":	                 Key("c-s"),
+
+         "mimic <text>":                     release + Mimic(extra="text"),
+        }
+
+    # The configuration object.  When the config file changes, a new one
+    #  is made and loaded, see reload_config().
+    def make_config():
+        config            = Config("multi edit")
+        config.cmd        = Section("Language section")
+        config.cmd.map    = Item(dict(default_map), namespace={
+            "Key":   Key,
+            "Text":  Text,
+            "ReleaseAll": ReleaseAll,
+        })
+        return config
+
+    config = make_config()
+    namespace = config.load()
+
+    #-----------------------------------------------------------------------
+    # Here we prepare the list of formatting functions from the config file.
+
+    # Retrieve text-formatting functions from this module's config file.
+    #  Each of these functions must have a name that starts with "format_".
+    #  This is done again when the config file changes, see reload_config().
+    def load_format_functions(namespace):
+        format_functions = {}
+        if not namespace:
+            return format_functions
+        for name, function in namespace.items():
+         if name.startswith("format_") and callable(function):
+            spoken_form = function.__doc__.strip()
+
+            # We wrap generation of the Function action in a function so
+            #  that its *function* variable will be local.  Otherwise it
+            #  would change during the next iteration of the namespace loop.
+            def wrap_function(function):
+                def _function(dictation):
+                    formatted_text = function(dictation)
+                    InsertText(formatted_text, static=True).execute()
+                return Function(_function)
+
+            action = wrap_function(function)
+            format_functions[spoken_form] = action
+        return format_functions
+
+    format_functions = load_format_functions(namespace)
+
+
+    # Here we define the text formatting rule.
+    # The contents of this rule were built up from the "format_*"
+    #  functions in this module's config file.
+    if format_functions:
+        class FormatRule(MappingRule):
+
+            mapping  = format_functions
+            extras   = [Dictation("dictation")]
+
+    else:
+        FormatRule = None
+
+
+    #-----------------------------------------------------------------------
+    # Here we split off the rarely used commands.
+
+    # When usage limits have been applied, the spoken-forms which are
+    #  hardly ever said are not part of the keystroke rule below.  They
+    #  are in a secondary grammar instead, which is enabled on demand.
+    #  See usagestats.py.
+    keystroke_map, rare_keystroke_map = split_mapping(
+        "notepad", "KeystrokeRule", config.cmd.map)
+
+
+    #-----------------------------------------------------------------------
+    # Here we define the keystroke rule.
+
+    # This rule maps spoken-forms to actions.  Some of these 
+    #  include special elements like the number with name "n" 
+    #  or the dictation with name "text".  This rule is not 
+    #  exported, but is referenced by other elements later on.
+    #  It is derived from MappingRule, so that its "value" when 
+    #  processing a recognition will be the right side of the 
+    #  mapping: an action.
+    # Note that this rule does not execute these actions, it
+    #  simply returns them when it's value() method is called.
+    #  For example "up 4" will give the value Key("up:4").
+    # More information about Key() actions can be found here:
+    #  http://dragonfly.googlecode.com/svn/trunk/dragonfly/documentation/actionkey.html
+    class KeystrokeRule(MappingRule):
+
+        exported = False
+
+        mapping  = keystroke_map
+        extras   = [
+                    NumberRef("n", 1, 100),
+                    Dictation("text"),
+                    Dictation("text2"),
+                   ]
+        defaults = {
+                    "n": 1,
+                   }
+        # Note: when processing a recognition, the *value* of 
+        #  this rule will be an action object from the right side 
+        #  of the mapping given above.  This is default behavior 
+        #  of the MappingRule class' value() method.  It also 
+        #  substitutes any "%(...)." within the action spec
+        #  with the appropriate spoken values.
+
+
+    # Check every action spec now instead of when it is first spoken.  The
+    #  specs of the most common counts are parsed ahead of time when the
+    #  grammar is built, see build_grammar() below.
+    validate(config.cmd.map)
+
+
+    #-----------------------------------------------------------------------
+    # Here we create an element which is the sequence of keystrokes.
+
+    # The elements are only created when the grammar is built, see
+    #  build_grammar() below.
+    def build_sequence(keystroke_rule, format_rule=None):
+        # First we create an element that references the keystroke rule.
+        #  Note: when processing a recognition, the *value* of this element
+        #  will be the value of the referenced rule: an action.
+        alternatives = []
+        alternatives.append(RuleRef(rule=keystroke_rule))
+        if format_rule:
+            alternatives.append(RuleRef(rule=format_rule))
+        single_action = Alternative(alternatives)
+
+        # Second we create a repetition of keystroke elements.
+        #  This element will match anywhere between 1 and 15 repetitions
+        #  of the keystroke elements, or fewer if usage limits say so.  Note
+        #  that we give this element the name "sequence" so that it can be
+        #  used as an extra in the rule definition below.
+        # Note: when processing a recognition, the *value* of this element
+        #  will be a sequence of the contained elements: a sequence of
+        #  actions.
+        return Repetition(single_action, min=1,
+                          max=sequence_max("notepad", 16), name="sequence")
+
+
+    #-----------------------------------------------------------------------
+    # Here we define the top-level rule which the user can say.
+
+    # This is the rule that actually handles recognitions. 
+    #  When a recognition occurs, it's _process_recognition() 
+    #  method will be called.  It receives information about the 
+    #  recognition in the "extras" argument: the sequence of 
+    #  actions and the number of times to repeat them.
+    class RepeatRule(CompoundRule):
+
+        # Here we define this rule's spoken-form and special elements.
+        #  The extras are given when the rule is created:  the sequence of
+        #  actions defined above and the number of times to repeat it.
+        spec     = "<sequence> [[[and] repeat [that]] <n> times]"
+        defaults = {
+                    "n": 1,                   # Default repeat count.
+                   }
+
+        # When true, the whole sequence is flattened into a single stream
+        #  of keystrokes before anything is sent.  See keybatch.py.
+        #  Presses of the same key are then merged and needless releases
+        #  removed from that stream, which is sent by the background
+        #  executor.
+        #  See peephole.py and executor.py.
+        batched  = True
+
+        # This method gets called when this rule is recognized.
+        # Arguments:
+        #  - node -- root node of the recognition parse tree.
+        #  - extras -- dict of the "extras" special elements:
+        #     . extras["sequence"] gives the sequence of actions.
+        #     . extras["n"] gives the repeat count.
+        def _process_recognition(self, node, extras):
+            sequence = extras["sequence"]   # A sequence of actions.
+            count = extras["n"]             # An integer repeat count.
+            record("notepad", node, len(sequence), count)
+            if self.batched:
+                submit(compile_repeat(sequence, count, release,
+                                      passes=[optimize, track]))
+                return
+            for i in range(count):
+                for action in sequence:
+                    action.execute()
+            release.execute()
+
+
+    #-----------------------------------------------------------------------
+    # Create and load this module's grammar.
+
+    # Only a stub grammar is loaded at first.  The rules are built and the
+    #  grammars loaded the first time notepad is in the foreground when an
+    #  utterance starts.  See lazygrammar.py.
+    notepad_context = AppContext(executable="notepad")
+    grammar = rare_grammar = None
+    keystroke_rule = rare_keystroke_rule = format_rule = None
+
+
+    def repeat_rule(keystroke_rule, format_rule=None):
+        return traced(RepeatRule(extras=[
+            build_sequence(keystroke_rule, format_rule),
+            NumberRef("n", 1, repeat_max("notepad", 100)),
+            ]))
+
+
+    def build_grammar():
+        global grammar, rare_grammar
+        global keystroke_rule, rare_keystroke_rule, format_rule
+        with cache:
+            prewarm(config.cmd.map)
+
+            # The secondary grammar of rarely used commands, if there are any.
+            #  It is disabled until the user says "more commands".
+            if rare_keystroke_map:
+                rare_keystroke_rule = KeystrokeRule(mapping=rare_keystroke_map)
+                rare_grammar = IndexedGrammar("multi edit rare",
+                                              context=notepad_context)
+                rare_grammar.add_rule(repeat_rule(rare_keystroke_rule))
+                add_number_rules(rare_grammar)
+                rare_grammar.load()
+                add_grammar(rare_grammar, __name__)
+                rare_grammar.disable()
+                register(rare_grammar, "notepad")
+
+            keystroke_rule = KeystrokeRule()
+            if FormatRule:
+                format_rule = FormatRule()
+            grammar = IndexedGrammar("multi edit", context=notepad_context)
+            grammar.add_rule(repeat_rule(keystroke_rule, format_rule))
+            grammar.add_rule(StopRule())      # "stop" cancels keystrokes.
+            if rare_grammar:
+                grammar.add_rule(OnDemandRule(rare_grammar))
+            add_number_rules(grammar)         # Numbers, see spokennumbers.py.
+            grammar.load()                    # Load the grammar.
+            add_grammar(grammar, __name__)    # Unload it with the module.
+            register(grammar, "notepad")      # Add it to the help index.
+        return [g for g in (grammar, rare_grammar) if g]
+
+
+    lazy_grammar = LazyGrammar("multi edit", notepad_context, build_grammar,
+                               __name__)
+
+
+    # When the config file changes, only the rules whose mapping changed are
+    #  built again, and only their grammars are reloaded.  See configwatch.py.
+    def reload_config(new_config, namespace):
+        global config, keystroke_map, rare_keystroke_map, format_functions
+        config = new_config
+        validate(config.cmd.map)
+        keystrokes, rare_keystrokes = split_mapping("notepad", "KeystrokeRule",
+                                                    config.cmd.map)
+        functions = load_format_functions(namespace)
+        if bool(rare_keystrokes) != bool(rare_keystroke_map) \
+                or bool(functions) != bool(format_functions):
+            print("Rules added or removed; reload notepad.py to use them.")
+            return
+        keystroke_map, rare_keystroke_map = keystrokes, rare_keystrokes
+        format_functions = functions
+        KeystrokeRule.mapping = keystrokes
+        if FormatRule:
+            FormatRule.mapping = functions
+
+        changed = []
+        if keystroke_rule and mapping_changed(keystroke_rule._mapping,
+                                              keystrokes):
+            replace_rule(keystroke_rule, KeystrokeRule())
+            changed.append(grammar)
+        if format_rule and mapping_changed(format_rule._mapping, functions):
+            replace_rule(format_rule, FormatRule())
+            changed.append(grammar)
+        if rare_keystroke_rule and mapping_changed(
+                rare_keystroke_rule._mapping, rare_keystrokes):
+            replace_rule(rare_keystroke_rule,
+                         KeystrokeRule(mapping=rare_keystrokes))
+            changed.append(rare_grammar)
+        if changed:
+            prewarm(config.cmd.map)
+            reload_grammars([g for g in (grammar, rare_grammar)
+                             if g in changed], "notepad")
+
+    config_watcher = ConfigWatcher(config, make_config, reload_config)
 
 # Unload function which will be called at unload time.
 def unload():
-    global grammar
-    if grammar: grammar.unload()
-    grammar = None
+    global grammar, rare_grammar
+    config_watcher.close()
+    lazy_grammar.unload()
+    unload_grammars(__name__)
+    grammar = rare_grammar = None
+    save()
@@ -0,0 +1,170 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Index of nearby paths as a dynamic list
+============================================================================
+
+Dictating a path for "CD <text>" or "vim <text>" is slow to decode and
+usually needs tab-completion afterwards.  This module keeps a bounded
+index of the names near the shell's working directory, so that _bash.py
+can offer them as a DictList, e.g. "vim setup py" types "vim setup.py".
+
+The index contains, in this order and up to *max_entries* names:
+
+ - the entries of the working directory, directories with a "/"
+ - the entries of its subdirectories, e.g. "docs/index.txt"
+ - the recently visited directories, as absolute paths
+
+The working directory starts at *path_directory*, by default the
+DRAGONFLY_PATH_DIR environment variable or the current directory.  The
+engine cannot see the shell's working directory, e.g. over PuTTY, so
+it is followed by calling *change_directory()* for the "CD" commands.
+The last *max_directories* directories visited are kept in an LRU.
+
+Every path is quoted for the shell where needed, so that names with
+spaces, quotes or characters like "$", "*" or ";" are typed as they
+are.
+
+Directory listings are cached with their modification time.  A refresh
+stats the indexed directories and only lists those which changed, which
+is cheap enough to do at the start of every utterance.
+
+"""
+
+import os
+import shlex
+import threading
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+
+from spokenlist import spoken_form, update_list as _update_list
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+path_directory  = os.environ.get("DRAGONFLY_PATH_DIR") or os.getcwd()
+max_directories = 8
+max_entries     = 400
+
+stats = {
+    "refreshes": 0,     # Calls of PathIndex.entries().
+    "listings":  0,     # Directories (re-)listed.
+}
+
+
+#---------------------------------------------------------------------------
+
+class PathIndex(object):
+
+    def __init__(self, directory, max_directories=max_directories,
+                 max_entries=max_entries):
+        self.directory = os.path.abspath(directory)
+        self.max_directories = max_directories
+        self.max_entries = max_entries
+        self._visited = OrderedDict() if OrderedDict else {}
+        self._listings = {}     # Directory -> (mtime, [(name, is_dir)]).
+        self._lock = threading.Lock()
+
+    def change_directory(self, path):
+        """ Follow a "cd *path*" of the shell, *path* as typed. """
+        try:
+            words = shlex.split(path)
+        except ValueError:
+            return
+        if len(words) != 1:
+            return
+        path = os.path.expanduser(words[0])
+        directory = os.path.normpath(os.path.join(self.directory, path))
+        if not os.path.isdir(directory):
+            return
+        with self._lock:
+            self._visited.pop(self.directory, None)
+            self._visited[self.directory] = True
+            while len(self._visited) > self.max_directories:
+                oldest = next(iter(self._visited))
+                del self._visited[oldest]
+            self.directory = directory
+
+    def _listing(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            return []
+        cached = self._listings.get(directory)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        entries = []
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError:
+            names = []
+        # Hidden names are only indexed after the others.
+        names.sort(key=lambda name: name.startswith("."))
+        for name in names:
+            entries.append((name, os.path.isdir(os.path.join(directory,
+                                                             name))))
+        stats["listings"] += 1
+        self._listings[directory] = (mtime, entries)
+        return entries
+
+    def entries(self):
+        """ Return a dict of spoken form -> path, nearest first. """
+        stats["refreshes"] += 1
+        with self._lock:
+            directory = self.directory
+            visited = [d for d in reversed(list(self._visited))
+                       if d != directory]
+        paths = OrderedDict() if OrderedDict else {}
+        listed = set([directory])
+
+        def add(path, words):
+            spoken = spoken_form(words)
+            if spoken and spoken not in paths \
+                    and len(paths) < self.max_entries:
+                paths[spoken] = quote(path)
+
+        listing = self._listing(directory)
+        for name, is_dir in listing:
+            add(name + "/" if is_dir else name, name)
+        for subdirectory, is_dir in listing:
+            if not is_dir or subdirectory.startswith(".") \
+                    or len(paths) >= self.max_entries:
+                continue
+            path = os.path.join(directory, subdirectory)
+            listed.add(path)
+            for name, is_dir in self._listing(path):
+                add("%s/%s%s" % (subdirectory, name, "/" if is_dir else ""),
+                    "%s %s" % (subdirectory, name))
+        for path in visited:
+            add(path + "/", os.path.basename(path))
+
+        # Forget the listings of directories no longer indexed.
+        for path in list(self._listings):
+            if path not in listed:
+                del self._listings[path]
+        return paths
+
+
+index = PathIndex(path_directory)
+
+
+def change_directory(path):
+    index.change_directory(path)
+
+
+def update_list(dict_list):
+    """ Fill *dict_list* with the index.  Only changes are sent. """
+    return _update_list(dict_list, dict(index.entries()))
@@ -0,0 +1,114 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Peephole optimizer for recognized action sequences
+============================================================================
+
+A pass over the items built by keybatch.py, for the repeat rule in
+notepad.py.  It looks at neighbouring keystrokes only:
+
+ - adjacent presses of the same key are merged, e.g. "backspace,
+   backspace:3" becomes "backspace:4"
+ - releasing a modifier ("shift:up") which has already been released
+   and not pressed since is dropped, which removes most of the
+   releases that config.cmd.map prefixes to its entries
+
+Motions in opposite directions are *not* cancelled, even unmodified
+arrow keys: "left" collapses a selection, and motions stop at the
+start and end of the document and wrap at the end of a line, so
+"left, right" is not the same as doing nothing.
+
+Every call updates the counters in *stats*, so that the number of
+keyboard events saved can be reported.
+
+"""
+
+from keybatch import (KEY, count_events, format_element, parse_element,
+                      split_elements)
+
+
+#---------------------------------------------------------------------------
+
+stats = {
+    "sequences":     0,  # Number of optimized sequences.
+    "events_before": 0,  # Keyboard events before optimization.
+    "events_after":  0,  # Keyboard events after optimization.
+}
+
+
+def events_saved():
+    """ Return the number of keyboard events saved so far. """
+    return stats["events_before"] - stats["events_after"]
+
+
+#---------------------------------------------------------------------------
+# The optimization pass.
+
+def _optimize_elements(elements, released):
+    # *elements* are the spec elements of one run of keystrokes,
+    #  *released* the set of modifiers known to be up at its start.
+    stack = []
+    for element in elements:
+        parsed = parse_element(element)
+        if parsed is None:
+            stack.append([element])
+            continue
+        modifiers, name, repeat, direction = parsed
+
+        if direction == "up" and not modifiers:
+            if name in released:
+                continue
+            released.add(name)
+            stack.append([element])
+            continue
+        if direction:
+            released.discard(name)
+            stack.append([element])
+            continue
+
+        top = stack[-1] if stack else None
+        if top and len(top) > 1 and top[:2] == [modifiers, name]:
+            top[2] += repeat
+        else:
+            stack.append([modifiers, name, repeat])
+
+    result = []
+    for entry in stack:
+        if len(entry) == 1:
+            result.append(entry[0])
+        else:
+            result.append(format_element(*entry))
+    return result
+
+
+def optimize(items):
+    """ Return an equivalent list of *items* with fewer keystrokes. """
+    result = []
+    released = set()
+    run = []
+
+    def flush():
+        if run:
+            elements = _optimize_elements(run, released)
+            if elements:
+                result.append((KEY, ", ".join(elements)))
+            del run[:]
+
+    for kind, value in items:
+        if kind == KEY:
+            run.extend(split_elements(value))
+        else:
+            # Other actions may press anything, so forget what we know.
+            flush()
+            released.clear()
+            result.append((kind, value))
+    flush()
+
+    stats["sequences"] += 1
+    stats["events_before"] += count_events(items)
+    stats["events_after"] += count_events(result)
+    return result
@@ -0,0 +1,69 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Dynamic lists of names
+============================================================================
+
+Shared by gitrefs.py and pathindex.py, which offer branch and file names
+through a DictList that maps spoken forms to the names:
+
+ - *spoken_form()* turns a name into words, e.g. "feature/login-page"
+   into "feature login page"
+ - *PhraseListRef* refers to such a list.  Unlike DictListRef, it also
+   matches an entry when a shorter entry is a prefix of it, e.g. "setup
+   py" when there is also "setup", by trying the longest entry first
+ - *update_list()* only changes a list if its entries changed, because
+   every change makes the engine reload the list
+
+"""
+
+import re
+
+from dragonfly import DictListRef
+
+
+#---------------------------------------------------------------------------
+
+_word_pattern = re.compile(r"[a-zA-Z]+|[0-9]+")
+
+
+def spoken_form(name):
+    """ Return the words for *name*, e.g. "origin feature login". """
+    return " ".join(_word_pattern.findall(name)).lower()
+
+
+class PhraseListRef(DictListRef):
+
+    def decode(self, state):
+        state.decode_attempt(self)
+
+        # Lengths of all entries matching the next words.
+        lengths = []
+        words = []
+        while True:
+            word = state.word(len(words))
+            if word is None:
+                break
+            words.append(word)
+            if " ".join(words) in self._list:
+                lengths.append(len(words))
+
+        for length in reversed(lengths):
+            state.next(length)
+            state.decode_success(self)
+            yield state
+            state.decode_retry(self)
+            state.next(-length)
+
+        state.decode_failure(self)
+
+
+def update_list(dict_list, entries):
+    """ Set *dict_list* to *entries*, if they differ. """
+    if entries != dict(dict_list):
+        dict_list.set(entries)
+    return entries
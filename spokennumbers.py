@@ -0,0 +1,176 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Spoken numbers
+============================================================================
+
+Every IntegerRef wraps its own private rule, which is compiled into the
+grammar separately.  gvim.py alone had six of them, among them one for
+the line numbers 1 to 10000, which is by far the largest rule of the
+grammar.
+
+Instead, all *NumberRef* elements with the same range refer to one
+number rule, which is compiled once into each grammar using it.  A
+number can be said:
+
+ - as usual, e.g. "twenty five" or "one hundred twenty"
+ - digit by digit, e.g. "one two three four" for 1234
+
+A NumberRef has the same arguments as an IntegerRef.  Both forms only
+accept numbers within its range, e.g. ``NumberRef("n", 1, 21)`` does not
+recognize "ninety nine" or "nine nine", as with an IntegerRef.
+
+A rule can only belong to one grammar, so every grammar containing
+NumberRefs gets number rules of its own from *add_number_rules()*
+before it is loaded:
+
+    grammar = Grammar("gvim")
+    ...
+    add_number_rules(grammar)
+    grammar.load()
+
+The number rules of all grammars share their elements, which the
+NumberRefs decode with.
+
+Run ``python headless.py`` to compare the compiled size of the grammars.
+
+"""
+
+from dragonfly import Alternative, Choice, Integer, Rule, RuleRef, Sequence
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+digits = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4,
+    "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9,
+}
+
+
+#---------------------------------------------------------------------------
+# Numbers said digit by digit.
+
+class Digits(Sequence):
+    """ A sequence of digits, whose value is the number they spell. """
+
+    def value(self, node):
+        return int("".join(str(d) for d in Sequence.value(self, node)))
+
+
+def _digit_patterns(low, high):
+    # Return the patterns matching the digit strings from *low* to
+    #  *high*, which have the same length.  A pattern is a list of the
+    #  digits allowed at each position.
+    if not low:
+        return [[]]
+    first, last = int(low[0]), int(high[0])
+    if first == last:
+        return [[[first]] + rest
+                for rest in _digit_patterns(low[1:], high[1:])]
+
+    width = len(low) - 1
+    patterns = []
+    if low[1:] != "0" * width:
+        patterns.extend([[first]] + rest
+                        for rest in _digit_patterns(low[1:], "9" * width))
+        first += 1
+    tail = []
+    if high[1:] != "9" * width:
+        tail = [[[last]] + rest
+                for rest in _digit_patterns("0" * width, high[1:])]
+        last -= 1
+    if first <= last:
+        patterns.append([list(range(first, last + 1))]
+                        + [list(range(10))] * width)
+    return patterns + tail
+
+
+def _digits_element(pattern):
+    choices = []
+    for allowed in pattern:
+        choices.append(Choice(None, dict((word, digit)
+                                         for word, digit in digits.items()
+                                         if digit in allowed)))
+    return Digits(choices)
+
+
+def number_element(min, max):
+    """ Return an element for the numbers from *min* up to *max*. """
+    alternatives = [Integer(None, min, max)]
+    length = 2
+    while 10 ** (length - 1) < max:
+        high = 10 ** length - 1
+        if high > max - 1:
+            high = max - 1
+        if min <= high:
+            for pattern in _digit_patterns(str(min).zfill(length),
+                                           str(high).zfill(length)):
+                alternatives.append(_digits_element(pattern))
+        length += 1
+    return Alternative(alternatives)
+
+
+#---------------------------------------------------------------------------
+# The rules NumberRefs refer to, one per range.  They are never added to
+#  a grammar themselves; a reference to one compiles to the number rule
+#  of the grammar which has the same name, see add_number_rules().
+
+_number_rules = {}
+
+
+def number_rule(min, max):
+    """ Return the rule referred to by NumberRefs from *min* to *max*. """
+    rule = _number_rules.get((min, max))
+    if rule is None:
+        rule = Rule(name="_number_%d_%d" % (min, max),
+                    element=number_element(min, max), exported=False)
+        _number_rules[(min, max)] = rule
+    return rule
+
+
+def _referenced_number_rules(rules):
+    # Return the number rules referred to by the NumberRefs in *rules*
+    #  and in the rules they refer to.
+    found = {}
+    seen = set()
+    stack = [rule.element for rule in rules]
+    while stack:
+        element = stack.pop()
+        if element is None or id(element) in seen:
+            continue
+        seen.add(id(element))
+        if isinstance(element, NumberRef):
+            found[element.rule.name] = element.rule
+        elif isinstance(element, RuleRef):
+            stack.append(element.rule.element)
+        stack.extend(element.children)
+    return [found[name] for name in sorted(found)]
+
+
+def add_number_rules(grammar):
+    """ Add the number rules *grammar*'s rules refer to, if missing. """
+    names = set(rule.name for rule in grammar.rules)
+    for template in _referenced_number_rules(grammar.rules):
+        if template.name not in names:
+            grammar.add_rule(Rule(name=template.name,
+                                  element=template.element, exported=False))
+            names.add(template.name)
+
+
+class NumberRef(RuleRef):
+    """ A number from *min* up to, but not including, *max*. """
+
+    def __init__(self, name, min, max, default=None):
+        RuleRef.__init__(self, rule=number_rule(min, max), name=name,
+                         default=default)
+        self.min = min
+        self.max = max
+
+    def dependencies(self, memo):
+        # The grammar's own number rule, see add_number_rules().
+        return []
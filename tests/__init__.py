@@ -0,0 +1,5 @@
+#
+# Tests for the helper modules in the parent directory.  Run them from
+# there with "python -m unittest discover -s tests -t .".
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
@@ -0,0 +1,63 @@
+#
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from dragonfly import Compound, Integer, Key, get_engine
+
+import grammarcache
+from grammarcache import ModuleCache
+
+
+class ModuleCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        get_engine("text")
+        self.directory = tempfile.mkdtemp()
+        self.saved_directory = grammarcache.cache_directory
+        grammarcache.cache_directory = self.directory
+        self.module_file = os.path.join(self.directory, "module.py")
+        with open(self.module_file, "w") as f:
+            f.write("# module\n")
+
+    def tearDown(self):
+        grammarcache.cache_directory = self.saved_directory
+        shutil.rmtree(self.directory)
+
+    def cache(self):
+        return ModuleCache("module", self.module_file)
+
+    def build(self, spec, extras):
+        # Build *spec* in a fresh cache, as when a module is loaded again.
+        with self.cache():
+            return Compound(spec, extras=extras)
+
+    def test_results_are_not_shared(self):
+        first = self.build("go [to] line <n>", [Integer("n", 1, 10)])
+        hits = grammarcache.stats["hits"]
+        extra = Integer("n", 1, 100)
+        second = self.build("go [to] line <n>", [extra])
+        self.assertEqual(grammarcache.stats["hits"], hits + 1)
+        self.assertEqual(second.gstring(),
+                         Compound("go [to] line <n>", extras=[extra]).gstring())
+        self.assertIsNot(first.children[0], second.children[0])
+        self.assertIs(second.children[0].children[-1], extra)
+
+    def test_key_includes_extras(self):
+        self.build("go <n>", [Integer("n", 1, 10)])
+        misses = grammarcache.stats["misses"]
+        self.build("go <n>", [Integer("n", 1, 10), Integer("m", 1, 3)])
+        self.assertEqual(grammarcache.stats["misses"], misses + 1)
+
+    def test_originals_restored_after_errors(self):
+        parser, parse_spec = Compound._parser, Key.__dict__["_parse_spec"]
+        with self.assertRaises(ZeroDivisionError):
+            with self.cache():
+                Key("a")
+                1 / 0
+        self.assertIs(Compound._parser, parser)
+        self.assertIs(Key.__dict__["_parse_spec"], parse_spec)
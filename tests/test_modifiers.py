@@ -0,0 +1,87 @@
+#
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+import unittest
+
+from dragonfly import Key
+
+from keybatch import ACTION, KEY, emit, flatten
+import modifiers
+from modifiers import ReleaseAll, track
+
+
+class TrackTest(unittest.TestCase):
+
+    def setUp(self):
+        modifiers.held.clear()
+        self.sent = []
+
+    def tearDown(self):
+        modifiers.held.clear()
+
+    def track(self, *actions):
+        return track(flatten(actions))
+
+    def send(self, items):
+        # Execute what emit() would, without a keyboard.
+        for kind, value in items:
+            if kind == KEY:
+                self.sent.append(value)
+            else:
+                action, data = value
+                if isinstance(action, ReleaseAll):
+                    self.sent.append(action.key_spec())
+                else:
+                    action.execute(data)
+
+    def keys(self, items):
+        return [value for kind, value in items if kind == KEY]
+
+    def test_release_of_unheld_modifier_is_dropped(self):
+        items = self.track(Key("shift:up, ctrl:up, c-a"))
+        self.assertEqual(items, [(KEY, "c-a")])
+
+    def test_release_of_held_modifier_is_kept(self):
+        items = self.track(Key("shift:down, right:2"),
+                           Key("shift:up, ctrl:up"))
+        self.assertEqual(items, [(KEY, "shift:down, right:2, shift:up")])
+        self.assertEqual(modifiers.held, set())
+
+    def test_explicit_release_is_always_sent(self):
+        for names, spec in ((("shift",), "shift:up"),
+                            (("ctrl",), "ctrl:up"),
+                            (("shift", "ctrl"), "shift:up, ctrl:up")):
+            items = self.track(ReleaseAll(names))
+            self.assertEqual(self.keys(items), [spec])
+
+    def test_explicit_release_clears_held_modifier(self):
+        modifiers.held.add("shift")
+        items = self.track(ReleaseAll(("shift",)))
+        self.assertEqual(self.keys(items), ["shift:up"])
+        self.assertEqual(modifiers.held, set(["shift"]))
+        self.send(items)
+        self.assertEqual(modifiers.held, set())
+
+    def test_state_changes_only_once_sent(self):
+        items = self.track(Key("ctrl:down"))
+        self.assertEqual(modifiers.held, set())
+        self.assertEqual(items[-1][0], ACTION)
+
+        # A batch compiled meanwhile still sees the state as it is.
+        self.assertEqual(self.track(Key("ctrl:up")), [])
+
+        self.send(items)
+        self.assertEqual(self.sent, ["ctrl:down"])
+        self.assertEqual(modifiers.held, set(["ctrl"]))
+        self.assertEqual(self.keys(self.track(Key("ctrl:up"))),
+                         ["ctrl:up"])
+
+    def test_unsent_batch_changes_nothing(self):
+        self.track(Key("shift:down"))
+        emit(self.track(Key("c-a")), stopped=lambda: True)
+        self.assertEqual(modifiers.held, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
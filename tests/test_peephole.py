@@ -0,0 +1,57 @@
+#
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+import unittest
+
+from keybatch import ACTION, KEY
+from peephole import optimize
+
+
+class OptimizeTest(unittest.TestCase):
+
+    def optimize(self, *specs):
+        return optimize([(KEY, spec) for spec in specs])
+
+    def test_presses_of_the_same_key_are_merged(self):
+        self.assertEqual(self.optimize("backspace", "backspace:3"),
+                         [(KEY, "backspace:4")])
+        self.assertEqual(self.optimize("c-left:2", "c-left"),
+                         [(KEY, "c-left:3")])
+
+    def test_different_modifiers_are_not_merged(self):
+        self.assertEqual(self.optimize("left", "s-left"),
+                         [(KEY, "left, s-left")])
+
+    def test_opposite_motions_are_kept(self):
+        for specs in (("left:3", "right:3"), ("up", "down:2"),
+                      ("pgup", "pgdown"), ("s-left", "s-right")):
+            self.assertEqual(self.optimize(*specs),
+                             [(KEY, ", ".join(specs))])
+
+    def test_left_still_collapses_a_selection(self):
+        # "select all left right backspace" in notepad.py.
+        self.assertEqual(self.optimize("shift:up, ctrl:up, c-a", "left",
+                                       "right",
+                                       "shift:up, ctrl:up, backspace"),
+                         [(KEY, "shift:up, ctrl:up, c-a, left, right,"
+                                " backspace")])
+
+    def test_release_after_press_is_kept(self):
+        self.assertEqual(self.optimize("shift:down, right:2", "shift:up",
+                                       "shift:up"),
+                         [(KEY, "shift:down, right:2, shift:up")])
+
+    def test_first_release_is_kept(self):
+        self.assertEqual(self.optimize("shift:up"), [(KEY, "shift:up")])
+
+    def test_actions_are_not_merged_across(self):
+        action = (ACTION, (None, None))
+        self.assertEqual(optimize([(KEY, "shift:up, left"), action,
+                                   (KEY, "shift:up, left")]),
+                         [(KEY, "shift:up, left"), action,
+                          (KEY, "shift:up, left")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+#
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+import unittest
+
+from dragonfly import CompoundRule, Grammar, get_engine
+from dragonfly.engines.base import MimicFailure
+
+from spokennumbers import NumberRef, add_number_rules
+
+
+class NumberRule(CompoundRule):
+
+    spec = "number <n>"
+
+    def _process_recognition(self, node, extras):
+        self.values.append(extras["n"])
+
+
+class NumberRefTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = get_engine("text")
+        self.engine.connect()
+
+    def decode(self, min, max, words):
+        rule = NumberRule(extras=[NumberRef("n", min, max)])
+        rule.values = []
+        grammar = Grammar("numbers")
+        grammar.add_rule(rule)
+        add_number_rules(grammar)
+        grammar.load()
+        try:
+            self.engine.mimic(("number " + words).split())
+        except MimicFailure:
+            return None
+        finally:
+            grammar.unload()
+        return rule.values[0]
+
+    def test_numbers_said_as_usual(self):
+        self.assertEqual(self.decode(1, 100, "twenty five"), 25)
+        self.assertEqual(self.decode(1, 10000, "one hundred twenty"), 120)
+        self.assertEqual(self.decode(1, 10000,
+                                     "nine thousand nine hundred ninety nine"),
+                         9999)
+
+    def test_numbers_said_digit_by_digit(self):
+        self.assertEqual(self.decode(1, 10000, "one two three four"), 1234)
+        self.assertEqual(self.decode(1, 100, "zero five"), 5)
+        self.assertEqual(self.decode(0, 20, "one nine"), 19)
+
+    def test_numbers_out_of_range_are_not_recognized(self):
+        self.assertEqual(self.decode(1, 21, "ninety nine"), None)
+        self.assertEqual(self.decode(1, 21, "nine nine"), None)
+        self.assertEqual(self.decode(1, 21, "two one"), None)
+        self.assertEqual(self.decode(1, 10, "zero"), None)
+        self.assertEqual(self.decode(1, 100, "zero zero"), None)
+        self.assertEqual(self.decode(1, 10000, "ten thousand"), None)
+        self.assertEqual(self.decode(1, 10000, "one zero zero zero zero"),
+                         None)
+
+    def test_bounds(self):
+        self.assertEqual(self.decode(1, 21, "twenty"), 20)
+        self.assertEqual(self.decode(1, 21, "two zero"), 20)
+        self.assertEqual(self.decode(1, 21, "one"), 1)
+        self.assertEqual(self.decode(0, 20, "zero"), 0)
+
+    def test_each_grammar_has_its_own_number_rules(self):
+        first = Grammar("first")
+        second = Grammar("second")
+        for grammar in (first, second):
+            grammar.add_rule(NumberRule(extras=[NumberRef("n", 1, 50)]))
+            add_number_rules(grammar)
+            add_number_rules(grammar)
+        names = [[r.name for r in g.rules if r.name.startswith("_number")]
+                 for g in (first, second)]
+        self.assertEqual(names, [["_number_1_50"], ["_number_1_50"]])
+        self.assertNotEqual(first.rules[-1], second.rules[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+#
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+import unittest
+
+from keybatch import ACTION, KEY
+from vimcount import fold_counts
+
+
+class FoldCountsTest(unittest.TestCase):
+
+    def fold(self, *specs):
+        return fold_counts([(KEY, spec) for spec in specs])
+
+    def test_repeated_motion_gets_a_count(self):
+        self.assertEqual(self.fold("j:5"), [(KEY, "5, j")])
+        self.assertEqual(self.fold(*["j"] * 20), [(KEY, "2, 0, j")])
+
+    def test_short_runs_are_sent_literally(self):
+        self.assertEqual(self.fold("j, j"), [(KEY, "j:2")])
+        self.assertEqual(self.fold("w"), [(KEY, "w")])
+
+    def test_join_count_is_one_more(self):
+        self.assertEqual(self.fold("J:5"), [(KEY, "6, J")])
+
+    def test_uncountable_keys_are_literal(self):
+        for spec in ("x:5", "X:5", "dot:5", "p:5"):
+            self.assertEqual(self.fold(spec), [(KEY, spec)])
+
+    def test_motion_after_operator_is_literal(self):
+        self.assertEqual(self.fold("d, w:3"), [(KEY, "d, w:3")])
+        self.assertEqual(self.fold("f, j:5"), [(KEY, "f, j:5")])
+
+    def test_motion_after_digit_is_literal(self):
+        self.assertEqual(self.fold("2, j:5"), [(KEY, "2, j:5")])
+
+    def test_text_object_ends_the_operator(self):
+        self.assertEqual(self.fold("d, i, w, j:9"),
+                         [(KEY, "d, i, w, 9, j")])
+
+    def test_nothing_is_folded_after_leaving_normal_mode(self):
+        self.assertEqual(self.fold("i, j:20"), [(KEY, "i, j:20")])
+        self.assertEqual(self.fold("c, i, w, j:9"), [(KEY, "c, i, w, j:9")])
+
+    def test_key_up_and_down_are_literal(self):
+        self.assertEqual(self.fold("shift:down, j:5, shift:up"),
+                         [(KEY, "shift:down, 5, j, shift:up")])
+
+    def test_actions_end_a_run(self):
+        action = (ACTION, (None, None))
+        self.assertEqual(fold_counts([(KEY, "j:2"), action, (KEY, "j")]),
+                         [(KEY, "j:2"), action, (KEY, "j")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Clipboard-paste fast path for long text
+============================================================================
+
+Text actions type their output one character at a time, which is slow
+for long dictation and very slow over PuTTY.
+
+The InsertText action can be used in place of Text.  Text shorter than
+*paste_threshold* characters is still typed.  Longer text is put on the
+clipboard and pasted with dragonfly's Paste action, which saves the
+clipboard beforehand and restores it afterwards.
+
+The keys used for pasting depend on the foreground window, see
+*paste_contexts*:
+
+ - gvim:  ctrl-r ctrl-o + (insert the clipboard register literally),
+   which is only valid in insert and command-line mode; gvim.py only
+   uses InsertText in the rules of those modes
+ - terminals like PuTTY or Git Bash:  shift-insert
+ - anything else:  ctrl-v
+
+Run this file directly to compare the two strategies on the current
+foreground window, e.g. with an empty editor window focused:
+
+    python textinsert.py
+
+"""
+
+import time
+
+from dragonfly import (AppContext, DynStrActionBase, Key, Paste, Text,
+                       Window)
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+# Text of at least this many characters is pasted instead of typed.
+paste_threshold = 40
+
+# Foreground window contexts and the paste action to use in them.  The
+#  first matching context wins.  The pauses give the application time
+#  to read the clipboard before it is restored.
+paste_contexts = [
+    (AppContext(executable="gvim"), Key("c-r, c-o, plus/20")),
+    (AppContext(executable="putty"), Key("s-insert/20")),
+    (AppContext(title="vim"), Key("s-insert/20")),
+    (AppContext(title="bash"), Key("s-insert/20")),
+    (AppContext(title="git Bash"), Key("s-insert/20")),
+    (AppContext(title="MINGW32:"), Key("s-insert/20")),
+]
+default_paste = Key("c-v/20")
+
+
+def paste_action():
+    """ Return the paste action for the current foreground window. """
+    window = Window.get_foreground()
+    for context, action in paste_contexts:
+        if context.matches(window.executable, window.title, window.handle):
+            return action
+    return default_paste
+
+
+#---------------------------------------------------------------------------
+
+class InsertText(DynStrActionBase):
+    """
+        Action which types short text and pastes long text.
+
+        Arguments are the same as for Text, plus *threshold* which
+        overrides the module's *paste_threshold* for this action.
+    """
+
+    def __init__(self, spec=None, static=False, threshold=None):
+        self._threshold = threshold
+        DynStrActionBase.__init__(self, spec=spec, static=static)
+
+    def _parse_spec(self, spec):
+        return spec
+
+    def _execute_events(self, text):
+        threshold = self._threshold
+        if threshold is None:
+            threshold = paste_threshold
+        if len(text) < threshold:
+            Text(text, static=True).execute()
+        else:
+            Paste(text, paste=paste_action(), static=True).execute()
+
+
+#---------------------------------------------------------------------------
+# Benchmark of typing versus pasting.
+
+def benchmark(lengths=(10, 40, 100, 400), repeat=3):
+    """
+        Insert text of the given *lengths* into the foreground window
+        using both strategies and print the average times.
+    """
+    print("%8s %12s %12s" % ("length", "typed [s]", "pasted [s]"))
+    for length in lengths:
+        text = ("abcdefghij" * (length // 10 + 1))[:length]
+        timings = []
+        for action in (InsertText(text, static=True, threshold=length + 1),
+                       InsertText(text, static=True, threshold=0)):
+            start = time.time()
+            for i in range(repeat):
+                action.execute()
+                Key("enter").execute()
+            timings.append((time.time() - start) / repeat)
+        print("%8d %12.3f %12.3f" % (length, timings[0], timings[1]))
+
+
+if __name__ == "__main__":
+    print("Focus the target window within 3 seconds...")
+    time.sleep(3)
+    benchmark()
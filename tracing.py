@@ -0,0 +1,292 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Per-phase latency tracing of recognitions
+============================================================================
+
+When a command feels slow, this module shows where the time went.  Rules
+wrapped with *traced()* record these phases for every recognition:
+
+ - decode -- dragonfly decoding the recognized words into a parse tree
+ - extras -- resolving the values of the rule's extras
+ - callback -- the rule's own *_process_recognition()*
+ - substitute -- substituting extras into action specs (keybatch.py)
+ - optimize -- the passes applied to a batch (keybatch.py)
+ - queue -- time a batch waited for the executor (executor.py)
+ - inject -- sending the keystrokes
+
+Plain MappingRules execute their action directly, which substitutes
+and sends in one step.  While tracing, traced MappingRules flatten the
+action first so that the two are recorded separately.
+
+Phases are written as they end, one record per line, to a trace file
+which is rotated when it grows larger than *max_bytes*:
+
+ - ``*.json`` -- Chrome trace events, which can be opened with
+   chrome://tracing or https://ui.perfetto.dev
+ - anything else -- JSON lines with the fields utterance, rule, phase,
+   ts and dur (both in microseconds) and thread
+
+Tracing is off by default.  Enable it by setting the DRAGONFLY_TRACE
+environment variable to the path of the trace file, or by calling
+*enable()*.  While it is off, the wrappers only check a global.
+
+"""
+
+import inspect
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import types
+
+from dragonfly import MappingRule
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+trace_path = os.environ.get("DRAGONFLY_TRACE")
+max_bytes  = 4 * 1024 * 1024
+backups    = 3
+
+if hasattr(time, "perf_counter"):
+    clock = time.perf_counter
+elif sys.platform.startswith("win"):
+    clock = time.clock
+else:
+    clock = time.time
+
+
+#---------------------------------------------------------------------------
+# Trace files.
+
+class TraceWriter(object):
+
+    def __init__(self, path, max_bytes=max_bytes, backups=backups):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.chrome = path.endswith(".json")
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+
+    def write(self, record):
+        line = json.dumps(record, sort_keys=True)
+        if self.chrome:
+            line += ","
+        line += "\n"
+        with self._lock:
+            if self._file is None:
+                self._open()
+            elif self._size + len(line) > self.max_bytes:
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _open(self):
+        self._file = open(self.path, "a")
+        self._size = self._file.tell()
+        if self.chrome and self._size == 0:
+            # Chrome's trace viewer accepts an unterminated array.
+            self._file.write("[\n")
+            self._size = 2
+
+    def _rotate(self):
+        self._file.close()
+        for number in range(self.backups - 1, 0, -1):
+            source = "%s.%d" % (self.path, number)
+            if os.path.exists(source):
+                os.rename(source, "%s.%d" % (self.path, number + 1))
+        if self.backups > 0:
+            if os.path.exists(self.path + ".1"):
+                os.remove(self.path + ".1")
+            os.rename(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+
+_writer = None
+_local = threading.local()
+_utterances = itertools.count(1)
+_pid = os.getpid()
+
+
+def enable(path=None):
+    """ Start writing phases to *path*, by default *trace_path*. """
+    global _writer
+    disable()
+    _writer = TraceWriter(path or trace_path)
+
+
+def disable():
+    global _writer
+    writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+
+def enabled():
+    return _writer is not None
+
+
+#---------------------------------------------------------------------------
+# Recording phases.
+
+def current():
+    """ Return the utterance being processed by this thread, or None. """
+    return getattr(_local, "utterance", None)
+
+
+def record(phase, start, end, utterance=None):
+    """ Record a *phase* of *utterance*, by default the current one. """
+    writer = _writer
+    if writer is None:
+        return
+    if utterance is None:
+        utterance = current()
+        if utterance is None:
+            return
+    number, rule = utterance
+    thread = threading.current_thread().name
+    if writer.chrome:
+        writer.write({"name": phase, "ph": "X", "pid": _pid, "tid": thread,
+                      "ts": int(start * 1e6),
+                      "dur": int((end - start) * 1e6),
+                      "args": {"utterance": number, "rule": rule}})
+    else:
+        writer.write({"utterance": number, "rule": rule, "phase": phase,
+                      "ts": int(start * 1e6),
+                      "dur": int((end - start) * 1e6),
+                      "thread": thread})
+
+
+class _Span(object):
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = clock()
+
+    def __exit__(self, *exc_info):
+        record(self.phase, self.start, clock())
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_null_span = _NullSpan()
+
+
+def span(phase):
+    """ Context manager which records *phase* of the current utterance. """
+    if _writer is None or current() is None:
+        return _null_span
+    return _Span(phase)
+
+
+class resume(object):
+    """ Context manager which continues *utterance* in another thread. """
+
+    def __init__(self, utterance):
+        self.utterance = utterance
+
+    def __enter__(self):
+        self.previous = current()
+        _local.utterance = self.utterance
+
+    def __exit__(self, *exc_info):
+        _local.utterance = self.previous
+
+
+#---------------------------------------------------------------------------
+# Wrappers for rules.
+
+def _wrap_decode(decode):
+    def _decode(self, state):
+        if _writer is not None:
+            self._trace_decoded = clock()
+        return decode(self, state)
+    return _decode
+
+
+def _wrap_process_recognition(process_recognition):
+    def _process_recognition(self, node):
+        if _writer is None:
+            return process_recognition(self, node)
+        started = clock()
+        utterance = (next(_utterances), self.name)
+        with resume(utterance):
+            decoded = getattr(self, "_trace_decoded", None)
+            if decoded is not None:
+                record("decode", decoded, started)
+            self._trace_started = started
+            return process_recognition(self, node)
+    return _process_recognition
+
+
+def _function(method):
+    return getattr(method, "__func__", method)
+
+
+def _wrap_callback(callback):
+    executes = callback is _function(MappingRule._process_recognition)
+
+    def _callback(self, value, extras):
+        if _writer is None or current() is None:
+            return callback(self, value, extras)
+        started = clock()
+        record("extras", self._trace_started, started)
+        if executes:
+            # Import here, keybatch.py imports this module.
+            from keybatch import emit, flatten
+            items = flatten([value], extras)
+            with span("inject"):
+                emit(items)
+        else:
+            callback(self, value, extras)
+        record("callback", started, clock())
+    return _callback
+
+
+def traced(rule):
+    """
+        Trace the recognitions of *rule*, a Rule instance or class,
+        and return it.
+    """
+    wrappers = [("decode", _wrap_decode),
+                ("process_recognition", _wrap_process_recognition),
+                ("_process_recognition", _wrap_callback)]
+    for name, wrap in wrappers:
+        wrapper = wrap(_function(getattr(rule, name)))
+        if inspect.isclass(rule):
+            setattr(rule, name, wrapper)
+        else:
+            setattr(rule, name, types.MethodType(wrapper, rule))
+    return rule
+
+
+if trace_path:
+    enable()
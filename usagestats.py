@@ -0,0 +1,352 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Usage statistics and usage-driven grammar limits
+============================================================================
+
+The repeat rules of notepad.py, gvim.py and _bash.py accept sequences of
+up to 15 commands and repeat counts up to 99, and all their commands are
+always active.  These limits are guesses, and rarely used commands make
+the grammars larger and slower to decode for everyone.
+
+This module records, per command-module, how the repeat rules are used:
+
+ - how often each spoken form of each MappingRule is said
+ - how many commands are said in one utterance
+ - the repeat counts
+
+Recording is off by default.  Enable it by setting the DRAGONFLY_USAGE
+environment variable to the path of the statistics file, or by calling
+*enable()*.  The counts are written to that file as JSON at most every
+*save_interval* seconds and by *save()*, which the command-modules call
+when they are unloaded.  Nothing but the counts is stored.
+
+Run ``python usagestats.py`` to see the statistics and the limits they
+suggest, and ``python usagestats.py --apply`` to write those limits to
+*limits_path*, by default the DRAGONFLY_USAGE_LIMITS environment
+variable or ~/.dragonfly_usage_limits.json.  The command-modules read
+the limits when they are loaded:
+
+ - *sequence_max()* -- the bound of a sequence Repetition, covering
+   *coverage* of the recorded utterances
+ - *repeat_max()* -- the bound of the repeat count, likewise
+ - *split_mapping()* -- the spoken forms making up less than
+   *rare_share* of the recorded commands are moved out of a mapping,
+   into a secondary grammar which "more commands" enables on demand,
+   see *OnDemandRule*
+
+Rare commands are only split off for the rules listed in *bounds*
+below, which is notepad.py's KeystrokeRule.  _bash.py's rules refer to
+DictLists, and a DictList can only be kept up to date in one grammar;
+gvim.py's normal mode commands would have to be a mode of their own in
+its grammar, see modes.py.  Only sequence and repeat limits are applied
+to those two modules, and no rare commands are suggested for them.
+
+Limits are only suggested for modules with at least *min_samples*
+recorded utterances, and never above the bounds in the code.  Delete
+the limits file to go back to those.
+
+"""
+
+import json
+import os
+import sys
+import time
+
+from dragonfly import Compound, CompoundRule, MappingRule, RuleRef
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+usage_path    = os.environ.get("DRAGONFLY_USAGE")
+limits_path   = (os.environ.get("DRAGONFLY_USAGE_LIMITS")
+                 or os.path.expanduser("~/.dragonfly_usage_limits.json"))
+save_interval = 60
+min_samples   = 500
+coverage      = 0.995
+rare_share    = 0.001
+
+_version = 1
+
+
+#---------------------------------------------------------------------------
+# Recording.
+
+class UsageStats(object):
+    """ Counts of one statistics file, by command-module. """
+
+    def __init__(self, path):
+        self.path = path
+        self.modules = {}
+        self._dirty = False
+        self._saved = time.time()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get("version") == _version:
+            self.modules = data.get("modules", {})
+
+    def save(self):
+        if not self._dirty:
+            return
+        temporary = self.path + ".tmp"
+        try:
+            with open(temporary, "w") as f:
+                json.dump({"version": _version, "modules": self.modules},
+                          f, separators=(",", ":"), sort_keys=True)
+            if os.name == "nt" and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(temporary, self.path)
+        except (IOError, OSError):
+            return
+        self._dirty = False
+        self._saved = time.time()
+
+    def module(self, name):
+        return self.modules.setdefault(name, {"forms": {}, "lengths": {},
+                                              "repeats": {}})
+
+    def record(self, module, node, length, count):
+        counts = self.module(module)
+        forms = counts["forms"]
+        for rule, spec in spoken_forms(node):
+            specs = forms.setdefault(rule, {})
+            specs[spec] = specs.get(spec, 0) + 1
+        for key, value in (("lengths", length), ("repeats", count)):
+            # JSON object keys are strings.
+            value = "%d" % value
+            counts[key][value] = counts[key].get(value, 0) + 1
+        self._dirty = True
+        if time.time() - self._saved > save_interval:
+            self.save()
+
+
+def spoken_forms(node):
+    """ Yield (rule name, spoken form) of each mapping in *node*. """
+    actor = node.actor
+    if isinstance(actor, RuleRef) and isinstance(actor.rule, MappingRule):
+        # The form said is the first Compound below the reference.
+        compound = node
+        while not isinstance(compound.actor, Compound):
+            compound = compound.children[0]
+        yield actor.rule.name, compound.actor._spec
+    for child in node.children:
+        for form in spoken_forms(child):
+            yield form
+
+
+_stats = None
+
+
+def enable(path):
+    global _stats
+    if _stats is not None:
+        _stats.save()
+    _stats = UsageStats(path)
+
+
+def disable():
+    global _stats
+    if _stats is not None:
+        _stats.save()
+    _stats = None
+
+
+def enabled():
+    return _stats is not None
+
+
+def record(module, node, length, count=1):
+    """
+        Count a recognition of a repeat rule of *module*: its root
+        *node*, the *length* of its sequence and its repeat *count*.
+    """
+    if _stats is not None:
+        _stats.record(module, node, length, count)
+
+
+def save():
+    if _stats is not None:
+        _stats.save()
+
+
+if usage_path:
+    enable(usage_path)
+
+
+#---------------------------------------------------------------------------
+# Limits.
+
+_limits = None
+
+
+def limits(module):
+    """ Return the applied limits of *module*, read once. """
+    global _limits
+    if _limits is None:
+        try:
+            with open(limits_path) as f:
+                _limits = json.load(f)
+        except (IOError, OSError, ValueError):
+            _limits = {}
+    return _limits.get(module, {})
+
+
+def sequence_max(module, default):
+    """ Return the Repetition *max* for *module*'s sequences. """
+    return min(default, limits(module).get("sequence_max", default))
+
+
+def repeat_max(module, default):
+    """ Return the exclusive bound of *module*'s repeat counts. """
+    return min(default, limits(module).get("repeat_max", default))
+
+
+def split_mapping(module, rule_name, mapping):
+    """
+        Return (common, rare): *mapping* split by the spoken forms which
+        the limits of *module* name as rare for rule *rule_name*.
+    """
+    rare_forms = set(limits(module).get("rare", {}).get(rule_name, ()))
+    common, rare = {}, {}
+    for spec, action in mapping.items():
+        if spec in rare_forms:
+            rare[spec] = action
+        else:
+            common[spec] = action
+    return common, rare
+
+
+class OnDemandRule(CompoundRule):
+    """
+        Rule which enables a secondary grammar of rarely used commands
+        with "more commands", and disables it with "fewer commands".
+    """
+
+    spec = "(more | fewer) commands"
+
+    def __init__(self, secondary, **kwargs):
+        CompoundRule.__init__(self, **kwargs)
+        self.secondary = secondary
+
+    def _process_recognition(self, node, extras):
+        if node.words()[0] == "more":
+            self.secondary.enable()
+            print("(MORE COMMANDS)")
+        else:
+            self.secondary.disable()
+            print("(FEWER COMMANDS)")
+
+
+#---------------------------------------------------------------------------
+# Suggesting limits.
+
+def _bound(histogram, default):
+    # The exclusive bound covering *coverage* of the counts.
+    values = sorted((int(value), count) for value, count
+                    in histogram.items())
+    total = sum(count for value, count in values)
+    covered = 0
+    for value, count in values:
+        covered += count
+        if covered >= coverage * total:
+            return min(default, value + 1)
+    return default
+
+
+def _mapping_forms(modules):
+    # Spoken forms of the MappingRules of the loaded *modules* which can
+    #  have rare commands, by module and rule name.
+    from headless import HeadlessSession
+    session = HeadlessSession()
+    session.load_all(modules=modules)
+    forms = {}
+    for module in modules:
+        rules = forms.setdefault(module, {})
+        for grammar in session.grammars[module]:
+            for rule in grammar.rules:
+                if isinstance(rule, MappingRule) \
+                        and rule.name in bounds[module]["rare_rules"]:
+                    rules.setdefault(rule.name, set()).update(rule._mapping)
+    session.unload_all()
+    return forms
+
+
+def suggest(counts, forms, bounds):
+    """
+        Return the limits suggested by the *counts* of one module, given
+        all *forms* of its MappingRules and the *bounds* in its code.
+    """
+    samples = sum(counts["lengths"].values())
+    if samples < min_samples:
+        return None
+    suggested = {
+        "sequence_max": _bound(counts["lengths"], bounds["sequence_max"]),
+        "repeat_max":   _bound(counts["repeats"], bounds["repeat_max"]),
+        "rare":         {},
+    }
+    total = sum(sum(specs.values()) for specs in counts["forms"].values())
+    for rule, specs in sorted(forms.items()):
+        used = counts["forms"].get(rule, {})
+        rare = sorted(spec for spec in specs
+                      if used.get(spec, 0) < rare_share * total)
+        if rare and len(rare) < len(specs):
+            suggested["rare"][rule] = rare
+    return suggested
+
+
+# The bounds in the code of each module, see sequence_max() and
+#  repeat_max(), and the rules whose rare commands it splits off, see
+#  split_mapping().
+bounds = {
+    "notepad": {"sequence_max": 16, "repeat_max": 100,
+                "rare_rules": ["KeystrokeRule"]},
+    "gvim":    {"sequence_max": 16, "repeat_max": 100, "rare_rules": []},
+    "_bash":   {"sequence_max": 8,  "repeat_max": 20,  "rare_rules": []},
+}
+
+
+def main(argv):
+    apply = "--apply" in argv
+    if not usage_path:
+        print("Set DRAGONFLY_USAGE to the statistics file.")
+        return 1
+    stats = UsageStats(usage_path)
+    modules = sorted(m for m in stats.modules if m in bounds)
+    forms = _mapping_forms(modules) if modules else {}
+    applied = {}
+    for module in modules:
+        counts = stats.modules[module]
+        samples = sum(counts["lengths"].values())
+        print("%s: %d utterances" % (module, samples))
+        suggested = suggest(counts, forms[module], bounds[module])
+        if suggested is None:
+            print("  fewer than %d utterances, no limits suggested"
+                  % min_samples)
+            continue
+        print("  sequence max %d (code: %d), repeat max %d (code: %d)"
+              % (suggested["sequence_max"], bounds[module]["sequence_max"],
+                 suggested["repeat_max"], bounds[module]["repeat_max"]))
+        for rule, rare in sorted(suggested["rare"].items()):
+            print("  %d rare forms of %s: %s" % (len(rare), rule,
+                                                 ", ".join(rare)))
+        applied[module] = suggested
+    if apply:
+        with open(limits_path, "w") as f:
+            json.dump(applied, f, indent=1, sort_keys=True)
+        print("Limits written to %s" % limits_path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
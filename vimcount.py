@@ -0,0 +1,147 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Vim count folding
+============================================================================
+
+A pass over the items built by keybatch.py which rewrites runs of
+count-able normal-mode keystrokes into a single vim count prefix.
+For example "down 5 times" repeated 100 times is sent as the four
+keystrokes "500j" instead of five hundred "j" keystrokes.
+
+Folding is only done where vim gives the count the same meaning as
+repeating the keystroke.  The following are always sent literally:
+
+ - the keystroke directly after an operator or any other key which
+   waits for an argument ("d, w:3" is *not* "d3w"), or after a digit
+ - everything after a keystroke which leaves normal mode, because
+   from then on keys are typed as text
+ - "dot", because a count given to "." replaces the count of the
+   repeated change instead of repeating it
+ - "x" and "X", because their count is cut off at the end of the line
+   and "X" with a count fails altogether in the first column, where
+   pressing it repeatedly does nothing
+
+"""
+
+from keybatch import KEY, format_element, parse_element, split_elements
+
+
+#---------------------------------------------------------------------------
+# Key names as used in Key specs.
+
+# Keys for which "N<key>" does the same as pressing <key> N times.
+countable_keys = set([
+    "h", "j", "k", "l", "w", "b", "e", "W", "B", "E",
+    "u", "J", "n", "N",
+    "c-b", "c-f", "c-r", "c-a", "c-x",
+])
+
+# Keys after which vim waits for a motion, a character or a register.
+operator_keys = set([
+    "d", "y", "c", "g", "z", "r", "f", "F", "t", "T", "m", "q",
+    "at", "squote", "backtick", "dquote", "langle", "rangle", "equal",
+    "exclamation", "lbracket", "rbracket", "c-w",
+])
+
+# Keys which leave normal mode so that later keys are typed as text.
+insert_keys = set(["i", "I", "a", "A", "o", "O", "s", "S", "C", "R"])
+
+# Text object selectors, only valid while an operator is pending.
+text_object_keys = set(["i", "a"])
+
+digit_keys = set("0123456789")
+
+
+def _counted(name, presses):
+    # Return the Key spec elements for pressing *name* *presses* times
+    #  using a vim count prefix if that is shorter.
+    count = presses
+    if name == "J":
+        # "J" pressed N times joins N + 1 lines, as does "(N+1)J".
+        count = presses + 1
+    if len(str(count)) + 1 >= presses:
+        if presses == 1:
+            return [name]
+        return ["%s:%d" % (name, presses)]
+    return list(str(count)) + [name]
+
+
+#---------------------------------------------------------------------------
+# The folding pass.
+
+def fold_counts(items):
+    """
+        Return *items* with runs of count-able keystrokes folded
+        into vim count prefixes.
+    """
+    result = []
+    state = {"run": None, "pending": None, "blocked": False,
+             "literal": False}
+
+    def append(element):
+        if result and result[-1][0] == KEY:
+            result[-1] = (KEY, result[-1][1] + ", " + element)
+        else:
+            result.append((KEY, element))
+
+    def flush():
+        run = state["run"]
+        if run:
+            for element in _counted(*run):
+                append(element)
+            state["run"] = None
+
+    def literal(element, name):
+        # Track vim's state for an element that is sent unchanged.
+        flush()
+        append(element)
+        pending = state["pending"]
+        if pending and name in text_object_keys:
+            state["blocked"] = True
+            return
+        state["pending"] = None
+        state["blocked"] = False
+        if pending:
+            if pending == "c":
+                state["literal"] = True
+        elif name in insert_keys:
+            state["literal"] = True
+        elif name in operator_keys:
+            state["pending"] = name
+            state["blocked"] = True
+        elif name in digit_keys:
+            state["blocked"] = True
+
+    for kind, value in items:
+        if kind != KEY:
+            flush()
+            result.append((kind, value))
+            state["pending"] = None
+            state["blocked"] = False
+            continue
+
+        for element in split_elements(value):
+            parsed = parse_element(element)
+            if parsed is None or parsed[3]:
+                literal(element, None)
+                continue
+            name = format_element(parsed[0], parsed[1])
+            count = parsed[2]
+            if (state["literal"] or state["blocked"]
+                    or name not in countable_keys):
+                literal(element, name)
+                continue
+            run = state["run"]
+            if run and run[0] == name:
+                run[1] += count
+            else:
+                flush()
+                state["run"] = [name, count]
+
+    flush()
+    return result
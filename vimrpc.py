@@ -0,0 +1,202 @@
+#
+# This file is a helper module for the Dragonfly command-modules in this
+# directory.  It does not define any grammars itself.
+# Licensed under the LGPL, see <http://www.gnu.org/licenses/>
+#
+
+"""
+Remote vim backend
+============================================================================
+
+Instead of synthesizing keystrokes, gvim.py can send a whole batch of
+items (see keybatch.py) to a running editor in a single call:
+
+ - Neovim, through its msgpack-RPC API (nvim_input) if the optional
+   pynvim package is installed, and otherwise through
+   ``nvim --server <address> --remote-send <keys>``
+ - Vim, through ``vim --servername <name> --remote-send <keys>``
+
+The backend is only used if it is configured, either by setting
+*nvim_address* / *vim_servername* below or through the
+NVIM_LISTEN_ADDRESS / VIM_SERVERNAME environment variables.  Make sure
+it points at the editor you are dictating to, e.g. by starting it with
+``nvim --listen \\\\.\\pipe\\dragonfly`` or ``gvim --servername DRAGONFLY``.
+
+Batches which cannot be expressed as vim key notation, for example
+because they contain a Mimic or a Function action, fall back to
+keystroke injection.  InsertText actions are sent as text.
+
+Once a batch fails to be delivered, that batch and all later ones are
+typed: keys sent to the editor earlier may not have been processed
+yet, and switching back and forth between the two paths could deliver
+keys out of order.  Reload gvim.py to use the backend again.
+
+"""
+
+import os
+import subprocess
+
+try:
+    import pynvim
+except ImportError:
+    pynvim = None
+
+from keybatch import (ACTION, KEY, TEXT, key_characters, parse_element,
+                      resolve_spec, split_elements)
+from textinsert import InsertText
+
+
+#---------------------------------------------------------------------------
+# Configuration.
+
+nvim_address   = os.environ.get("NVIM_LISTEN_ADDRESS")
+vim_servername = os.environ.get("VIM_SERVERNAME")
+vim_executable = "vim"
+nvim_executable = "nvim"
+
+
+#---------------------------------------------------------------------------
+# Conversion of items to vim key notation.
+
+vim_key_names = {
+    "escape":    "Esc",      "enter":     "CR",       "tab":      "Tab",
+    "space":     "Space",    "backspace": "BS",       "del":      "Del",
+    "delete":    "Del",      "insert":    "Insert",   "home":     "Home",
+    "end":       "End",      "pgup":      "PageUp",   "pgdown":   "PageDown",
+    "up":        "Up",       "down":      "Down",     "left":     "Left",
+    "right":     "Right",    "langle":    "lt",       "backslash": "Bslash",
+    "bar":       "Bar",
+}
+for number in range(1, 13):
+    vim_key_names["f%d" % number] = "F%d" % number
+
+vim_modifiers = {"c": "C-", "a": "M-", "s": "S-"}
+
+
+def _vim_key(modifiers, name):
+    # Return the vim notation for one keystroke, or None.
+    if name in vim_key_names:
+        key = vim_key_names[name]
+    elif name in key_characters:
+        key = key_characters[name]
+    else:
+        return None
+
+    if modifiers == "s" and len(key) == 1 and key.isalpha():
+        return key.upper()
+    prefix = ""
+    for modifier in modifiers:
+        if modifier not in vim_modifiers:
+            return None
+        prefix += vim_modifiers[modifier]
+    if prefix or len(key) > 1:
+        return "<%s%s>" % (prefix, key)
+    return key
+
+
+def to_vim_keys(items):
+    """ Return *items* in vim key notation, or None. """
+    keys = []
+    for kind, value in items:
+        if kind == ACTION and isinstance(value[0], InsertText):
+            text = resolve_spec(*value)
+            if text is None:
+                return None
+            keys.append(text.replace("<", "<lt>"))
+        elif kind == TEXT:
+            keys.append(value.replace("<", "<lt>"))
+        elif kind == KEY:
+            for element in split_elements(value):
+                parsed = parse_element(element)
+                if parsed is None:
+                    return None
+                modifiers, name, repeat, direction = parsed
+                if direction == "up":
+                    # Releasing a key means nothing to the editor.
+                    continue
+                if direction:
+                    return None
+                key = _vim_key(modifiers, name)
+                if key is None:
+                    return None
+                keys.append(key * repeat)
+        else:
+            return None
+    return "".join(keys)
+
+
+#---------------------------------------------------------------------------
+# Senders for executor.py.  Each is called with a batch of items and
+#  returns True if it delivered them.
+
+class RemoteSender(object):
+    """
+        Base of the senders below.  Converts a batch to vim key
+        notation and passes it to the *send(keys)* method of the
+        subclass, which delivers it or raises.
+
+        After the first failure nothing is sent anymore, see the
+        module documentation.
+    """
+
+    failed = False
+
+    def __call__(self, items):
+        if self.failed:
+            return False
+        keys = to_vim_keys(items)
+        if keys is None:
+            return False
+        if not keys:
+            return True
+        try:
+            self.send(keys)
+        except Exception as e:
+            self.failed = True
+            print("Remote vim backend failed, typing from now on: %s" % e)
+            return False
+        return True
+
+
+class NeovimSender(RemoteSender):
+
+    def __init__(self, address):
+        self.address = address
+        self._nvim = None
+
+    def send(self, keys):
+        if pynvim is None:
+            subprocess.check_call([nvim_executable, "--server",
+                                   self.address, "--remote-send", keys])
+            return
+        if self._nvim is None:
+            host, _, port = self.address.rpartition(":")
+            if host and port.isdigit():
+                self._nvim = pynvim.attach("tcp", address=host,
+                                           port=int(port))
+            else:
+                self._nvim = pynvim.attach("socket", path=self.address)
+        try:
+            self._nvim.input(keys)
+        except Exception:
+            self._nvim = None
+            raise
+
+
+class VimSender(RemoteSender):
+
+    def __init__(self, servername):
+        self.servername = servername
+
+    def send(self, keys):
+        subprocess.check_call([vim_executable, "--servername",
+                               self.servername, "--remote-send", keys])
+
+
+def sender():
+    """ Return the configured sender, or None. """
+    if nvim_address:
+        return NeovimSender(nvim_address)
+    if vim_servername:
+        return VimSender(vim_servername)
+    return None